@@ -0,0 +1,121 @@
+"""
+Running transaction aggregates for the in-memory (JSON) storage backend.
+
+Totals are updated as each transaction is committed, so dashboards read them in
+constant time instead of scanning the history. SQLiteStorage keeps the same
+totals in summary tables updated inside each write transaction.
+"""
+import copy
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from ledger import DEFAULT_TERMINAL
+
+# Window the cash-out rate is measured over, in seconds
+CASH_OUT_WINDOW = 3600
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _empty_totals():
+    return {'withdrawn': 0.0, 'deposited': 0.0, 'count': 0}
+
+
+def _add(totals, transaction):
+    if transaction['type'] == 'Deposit':
+        totals['deposited'] += transaction['amount']
+    else:
+        totals['withdrawn'] += transaction['amount']
+    totals['count'] += 1
+
+
+def totals_of(rows):
+    """Per-user, per-terminal and per-day totals of (name, type, amount, date, terminal) rows"""
+    totals = {'users': {}, 'terminals': {}, 'days': {}}
+    for name, kind, amount, date, terminal in rows:
+        transaction = {'type': kind, 'amount': amount}
+        _add(totals['users'].setdefault(name, _empty_totals()), transaction)
+        _add(totals['terminals'].setdefault(terminal, _empty_totals()), transaction)
+        _add(totals['days'].setdefault(date[:10], _empty_totals()), transaction)
+    return totals
+
+
+def merge_totals(into, totals):
+    """Add totals (as returned by totals_of) into another such dict in place"""
+    for section, groups in totals.items():
+        target = into.setdefault(section, {})
+        for key, values in groups.items():
+            current = target.setdefault(key, _empty_totals())
+            for field, value in values.items():
+                current[field] += value
+
+
+def window_start(window=CASH_OUT_WINDOW):
+    """Date string of the start of the trailing cash-out window"""
+    return (datetime.now() - timedelta(seconds=window)).strftime(DATE_FORMAT)
+
+
+class LedgerAggregates:
+    """Per-user, per-terminal and daily totals and the recent cash-out rate"""
+
+    def __init__(self, window=CASH_OUT_WINDOW):
+        self.window = window
+        self._users = {}
+        self._terminals = {}
+        self._days = {}
+        # (date, amount) of withdrawals inside the window, oldest first
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def record(self, transaction):
+        """Add one committed transaction"""
+        with self._lock:
+            _add(self._users.setdefault(transaction['name'], _empty_totals()), transaction)
+            _add(self._terminals.setdefault(transaction.get('terminal', DEFAULT_TERMINAL), _empty_totals()),
+                 transaction)
+            # Dates are 'YYYY-MM-DD HH:MM:SS' strings, so the day is a prefix
+            _add(self._days.setdefault(transaction['date'][:10], _empty_totals()), transaction)
+            if transaction['type'] != 'Deposit':
+                self._recent.append((transaction['date'], transaction['amount']))
+
+    def rebuild(self, rows, base=None):
+        """
+        Recompute every total from (name, type, amount, date, terminal) rows of
+        the history, on top of base totals (as returned by totals_of) of
+        transactions that are not in rows
+        """
+        cutoff = window_start(self.window)
+        base = copy.deepcopy(base or {})
+        with self._lock:
+            self._users, self._terminals, self._days, self._recent = (
+                base.get('users', {}), base.get('terminals', {}), base.get('days', {}), deque())
+            for name, kind, amount, date, terminal in rows:
+                transaction = {'type': kind, 'amount': amount}
+                _add(self._users.setdefault(name, _empty_totals()), transaction)
+                _add(self._terminals.setdefault(terminal, _empty_totals()), transaction)
+                _add(self._days.setdefault(date[:10], _empty_totals()), transaction)
+                if kind != 'Deposit' and date >= cutoff:
+                    self._recent.append((date, amount))
+
+    def user_totals(self, username):
+        with self._lock:
+            return dict(self._users.get(username) or _empty_totals())
+
+    def terminal_totals(self):
+        """terminal -> totals of every terminal with transactions"""
+        with self._lock:
+            return {terminal: dict(totals) for terminal, totals in self._terminals.items()}
+
+    def daily_totals(self, days=7):
+        """Totals of the most recent days with transactions, newest first"""
+        with self._lock:
+            return [dict(self._days[day], day=day) for day in sorted(self._days, reverse=True)[:days]]
+
+    def cash_out_rate(self):
+        """Amount withdrawn per hour over the trailing window"""
+        cutoff = window_start(self.window)
+        with self._lock:
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
+            return sum(amount for _, amount in self._recent) * 3600 / self.window
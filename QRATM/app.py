@@ -1,22 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, g, Response, stream_with_context
 import base64
 import os
 from datetime import datetime
 from functools import wraps
-import qrcode
 from io import BytesIO
 import logging
+import threading
 from werkzeug.utils import secure_filename
 import json
-import csv
-import io
+import math
+import re
+import time
+import uuid
+import zipfile
+from decode_pool import DecodePool, PoolBusy
+from batch_scan import decode_all, describe, iter_zip
+from frame_gate import FrameGate, FrameSuperseded
+from frame_cache import FrameCache, RegionTracker, frame_hash
+from qr_images import QRImageCache, UploadSweeper
+from token_registry import TokenRegistry
+from export import FORMATS as EXPORT_FORMATS, ExportFilters, generate_export
+import qr_payload
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from log_config import configure_logging
+from ledger import InvalidAmount
+from storage import (create_storage, UnknownUser, InsufficientBalance, InsufficientATMBalance, QRAlreadyUsed,
+                     UnknownTerminal, DEFAULT_TERMINAL)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, 
-                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -24,59 +34,45 @@ app.secret_key = 'qratm_secret_key'  # For session management
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Create upload folder if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
 # Data file path
 DATA_FILE = 'qratm_data.json'
 
-# Global variables
-users = {}
-atm_balance = 50000.00
-atm_history = []
-user_history = {}
+# How long a generated QR code can be redeemed, in seconds
+QR_VALIDITY_SECONDS = 300
+
+# Key for signing QR payloads and hashing the PINs inside them
+app.config['QR_SIGNING_KEY'] = os.environ.get('QRATM_QR_KEY', app.secret_key).encode('utf-8')
+
+# Shared-state mode lets several worker processes serve one ledger; it keeps
+# all state in the SQLite database instead of process memory
+app.config['SHARED_STATE'] = os.environ.get('QRATM_SHARED_STATE', '0') == '1'
+
+# Storage backend: 'json' (journal + snapshot, the default) or 'sqlite'
+app.config['STORAGE_BACKEND'] = os.environ.get('QRATM_STORAGE', 'sqlite' if app.config['SHARED_STATE'] else 'json')
+app.config['DATA_FILE'] = DATA_FILE
+app.config['SQLITE_FILE'] = os.environ.get('QRATM_DB', 'qratm_data.db')
+# Days of history the json backend keeps in memory; older transactions are
+# archived to compressed segment files (0 keeps everything in memory)
+app.config['HISTORY_HOT_DAYS'] = int(os.environ.get('QRATM_HISTORY_HOT_DAYS', 30))
+
+# Built here, loaded by create_app(); neither backend touches files until then
+store = create_storage(app.config)
 
 def load_data():
-    """Load data from JSON file"""
-    global users, atm_balance, atm_history, user_history
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                users = data.get('users', {})
-                atm_balance = data.get('atm_balance', 50000.00)
-                atm_history = data.get('atm_history', [])
-                user_history = data.get('user_history', {})
-        except Exception as e:
-            app.logger.error(f"Error loading data: {str(e)}")
+    """Load persisted state into the storage backend"""
+    try:
+        store.load()
+    except Exception as e:
+        app.logger.error(f"Error loading data: {str(e)}")
 
 def save_data():
-    """Save data to JSON file"""
+    """Flush the storage backend (full JSON snapshot or SQLite checkpoint)"""
     try:
-        data = {
-            'users': users,
-            'atm_balance': atm_balance,
-            'atm_history': atm_history,
-            'user_history': user_history,
-            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+        store.save()
         app.logger.info("Data saved successfully")
     except Exception as e:
         app.logger.error(f"Error saving data: {str(e)}")
 
-# Load initial data
-load_data()
-
-# Initialize default admin user if not exists
-if 'admin' not in users:
-    users['admin'] = {
-        'password': 'admin123',
-        'role': 'admin'  # Admin is ATM administrator, no balance needed
-    }
-    save_data()
-
 # Initialize some default users if not exists
 default_users = {
     'Surya': {'password': 'user123', 'role': 'user', 'balance': 15000.00},
@@ -85,16 +81,90 @@ default_users = {
 
 }
 
-for username, user_data in default_users.items():
-    if username not in users:
-        users[username] = user_data
-        save_data()
+def init_data():
+    """Load initial data and create the missing default accounts in one write"""
+    load_data()
+
+    seed_users = {
+        'admin': {
+            'password': 'admin123',
+            'role': 'admin'  # Admin is ATM administrator, no balance needed
+        }
+    }
+    seed_users.update(default_users)
+    added = store.add_missing_users(seed_users)
+    if added:
+        app.logger.info(f"Created default users: {', '.join(added)}")
+
+# Generated QR images live in memory; stale files in the upload folder are swept
+qr_images = QRImageCache(ttl=QR_VALIDITY_SECONDS)
+upload_sweeper = UploadSweeper(app.config['UPLOAD_FOLDER'], max_age=QR_VALIDITY_SECONDS)
+
+# QR codes issued here wait in the token registry until redeemed or expired,
+# and /confirm and /process pass only their token. Shared-state workers do not
+# share it, so there every scan is validated from the payload instead.
+app.config['TOKEN_REGISTRY'] = not app.config['SHARED_STATE']
+pending_tokens = TokenRegistry(ttl=QR_VALIDITY_SECONDS)
+
+# Serializes the one-time start of the background tasks between concurrent
+# first requests
+_start_lock = threading.Lock()
+
+@app.before_request
+def start_background_tasks():
+    # Started on the first request so the debug reloader's parent process,
+    # which never serves requests, does not compact or sweep the same files
+    if app.config.get('BACKGROUND_STARTED'):
+        return
+    with _start_lock:
+        if app.config.get('BACKGROUND_STARTED'):
+            return
+        # Servers that import app:app directly (flask run, waitress) never
+        # call create_app(); the ledger is then loaded here
+        create_app()
+        store.start()
+        upload_sweeper.start()
+        if app.config['TOKEN_REGISTRY']:
+            pending_tokens.start()
+        app.config['BACKGROUND_STARTED'] = True
+
+# Latency and decoder metrics, exposed in Prometheus text format on /metrics
+app.config['METRICS_TOKEN'] = os.environ.get('QRATM_METRICS_TOKEN')
+REQUEST_SECONDS = REGISTRY.histogram('qratm_request_seconds', 'Request handling time per endpoint',
+                                     ['endpoint', 'method'])
+SCAN_STAGE_SECONDS = REGISTRY.histogram('qratm_scan_stage_seconds', 'Time spent in each /scan stage', ['stage'])
+PROCESS_STAGE_SECONDS = REGISTRY.histogram('qratm_process_stage_seconds', 'Time spent in each /process stage',
+                                           ['stage'])
+GENERATE_STAGE_SECONDS = REGISTRY.histogram('qratm_generate_stage_seconds', 'Time spent in each /generate stage',
+                                            ['stage'])
+QR_DECODES = REGISTRY.counter('qratm_qr_decode_total', 'QR decode attempts per decoder', ['decoder', 'result'])
+SCAN_FRAMES = REGISTRY.counter('qratm_scan_frames_total', 'Camera frames received on /scan by outcome',
+                               ['outcome'])
+REGISTRY.gauge('qratm_frame_cache_hit_ratio', 'Share of frames answered from the frame cache',
+               callback=lambda: frame_cache.hit_rate())
+REGISTRY.gauge('qratm_decode_latency_seconds', 'Moving average of per-frame decode time',
+               callback=lambda: frame_gate.latency)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Every log record of this request carries its id
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint, method=request.method)
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
 
 # Admin required decorator
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'username' not in session or users[session['username']]['role'] != 'admin':
+        user = store.get_user(session['username']) if 'username' in session else None
+        if user is None or user['role'] != 'admin':
             flash('Admin access required', 'danger')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
@@ -116,9 +186,10 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        if username in users and users[username]['password'] == password:
+        user = store.get_user(username)
+        if user is not None and user['password'] == password:
             session['username'] = username
-            session['role'] = users[username]['role']
+            session['role'] = user['role']
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -132,18 +203,53 @@ def logout():
     flash('You have been logged out', 'info')
     return redirect(url_for('login'))
 
+# Kiosks name their ATM terminal once with /scan?terminal=<id>, which is kept
+# in their session, or on every request with an X-Terminal-ID header
+TERMINAL_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+def current_terminal():
+    """The ATM terminal the current request comes from"""
+    return (request.args.get('terminal') or request.headers.get('X-Terminal-ID')
+            or session.get('terminal') or DEFAULT_TERMINAL)
+
 @app.route('/')
 def index():
     if 'username' in session:
         return redirect(url_for('dashboard'))
     return redirect(url_for('scan'))
 
+# Last QR position per scan session, used to crop the next frame
+scan_regions = RegionTracker()
+
+# Camera frames are decoded by a pool of worker processes so CPU-bound decoding
+# never blocks other requests. QRATM_DECODE_WORKERS=0 decodes in the request thread.
+app.config['DECODE_WORKERS'] = int(os.environ.get('QRATM_DECODE_WORKERS', max((os.cpu_count() or 2) - 1, 1)))
+app.config['DECODE_QUEUE_SIZE'] = int(os.environ.get('QRATM_DECODE_QUEUE_SIZE', 0)) or None
+decode_pool = DecodePool(app.config['DECODE_WORKERS'], app.config['DECODE_QUEUE_SIZE'])
+
+# One frame in flight per kiosk, newest frame wins, adaptive client frame rate
+app.config['SCAN_MAX_FPS'] = float(os.environ.get('QRATM_SCAN_MAX_FPS', 15))
+frame_gate = FrameGate(capacity=app.config['DECODE_WORKERS'], max_fps=app.config['SCAN_MAX_FPS'])
+
+# Decode results of recent frames, reused for near-identical frames
+frame_cache = FrameCache()
+
+# Content types accepted for binary camera frames on /scan
+BINARY_FRAME_TYPES = ('application/octet-stream', 'image/jpeg', 'image/png')
+
 @app.route('/scan', methods=['GET', 'POST'])
 def scan():
     if request.method == 'POST':
         try:
+            # Handle camera input sent as raw JPEG bytes
+            if request.mimetype in BINARY_FRAME_TYPES:
+                image_bytes = request.get_data(cache=False)
+                if image_bytes:
+                    return scan_frame(image_bytes)
+                return jsonify({'success': False, 'error': 'No image data received.'}), 400
+
             # Handle file upload
-            if 'qr_image' in request.files:
+            elif 'qr_image' in request.files:
                 file = request.files['qr_image']
                 if file and file.filename:
                     # Save the file temporarily
@@ -159,10 +265,8 @@ def scan():
                     
                     if result:
                         if result.get('is_used'):
-                            return render_template('scan.html', error='This QR code has already been used. Please generate a new one.')
-                        return redirect(url_for('confirm', name=result['name'], 
-                                             amount=result['amount'], 
-                                             pin=result['pin']))
+                            return render_template('scan.html', error=result['error'])
+                        return redirect(url_for('confirm', **confirm_args(result)))
                     return render_template('scan.html', error='No valid QR code found. Please try again with a clearer image.')
             
             # Handle camera input (base64 image)
@@ -174,31 +278,10 @@ def scan():
                     if ',' in image_data:
                         image_data = image_data.split(',')[1]
                     
-                    # Decode base64 image
-                    image_bytes = base64.b64decode(image_data)
-                    nparr = np.frombuffer(image_bytes, np.uint8)
-                    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    
-                    if img is not None:
-                        # Process the QR code
-                        result = process_qr_code(img)
-                        if result:
-                            if result.get('is_used'):
-                                return jsonify({
-                                    'success': False,
-                                    'error': 'This QR code has already been used. Please generate a new one.'
-                                })
-                            return jsonify({
-                                'success': True,
-                                'redirect': url_for('confirm', 
-                                                  name=result['name'],
-                                                  amount=result['amount'],
-                                                  pin=result['pin'])
-                            })
-                        return jsonify({
-                            'success': False,
-                            'error': 'No valid QR code found. Please try again with a clearer image.'
-                        })
+                    # Decode base64 image; the JPEG itself is decoded in a worker
+                    with SCAN_STAGE_SECONDS.time(stage='base64_decode'):
+                        image_bytes = base64.b64decode(image_data)
+                    return scan_frame(image_bytes)
             
             return render_template('scan.html', error='No image data received.')
             
@@ -206,13 +289,151 @@ def scan():
             app.logger.error(f"Error processing QR code: {str(e)}")
             return render_template('scan.html', error='An error occurred while processing the QR code.')
     
+    terminal = request.args.get('terminal')
+    if terminal is not None:
+        if store.get_terminal(terminal) is None:
+            return render_template('scan.html', error='Unknown ATM terminal.'), 404
+        session['terminal'] = terminal
     return render_template('scan.html')
 
-def process_qr_code(image_source):
+def scan_frame(image_bytes):
+    """Decode one encoded camera frame and build the JSON answer for the scan page"""
+    scan_id = session.setdefault('scan_id', uuid.uuid4().hex)
+    try:
+        # At most one frame per kiosk is decoded at a time; a newer frame
+        # replaces one that is still waiting
+        with frame_gate.admit(scan_id):
+            payload, status = decode_scan_frame(image_bytes, scan_id)
+    except FrameSuperseded:
+        payload, status = {'success': False, 'dropped': True}, 200
+        SCAN_FRAMES.inc(outcome='dropped')
+    return scan_frame_response(payload, status)
+
+def scan_frame_response(payload, status):
+    # Tell the kiosk how fast to send frames given current decode latency
+    payload['target_fps'] = frame_gate.target_fps()
+    response = jsonify(payload)
+    response.status_code = status
+    if status == 503:
+        response.headers['Retry-After'] = '1'
+    return response
+
+def decode_scan_frame(image_bytes, scan_id):
+    """Decode a frame and return the scan page payload and HTTP status"""
+    digest, hit, found = lookup_scan_frame(image_bytes, scan_id)
+    timings = []
+    if digest is not None and not hit:
+        # Decode in the worker pool, starting from where this kiosk last saw a QR code
+        try:
+            found, timings = decode_pool.decode(image_bytes, roi=scan_regions.get(scan_id))
+        except PoolBusy:
+            SCAN_FRAMES.inc(outcome='busy')
+            return {'success': False, 'busy': True}, 503
+    return scan_frame_result(scan_id, digest, hit, found, timings)
+
+def lookup_scan_frame(image_bytes, scan_id):
+    """Hash a frame and look it up in the frame cache; returns (digest, hit, QR codes)"""
+    with SCAN_STAGE_SECONDS.time(stage='frame_hash'):
+        digest = frame_hash(image_bytes)
+    if digest is None:
+        return None, False, None
+    # Reuse the result of a recent near-identical frame from this kiosk
+    hit, found = frame_cache.get(scan_id, digest)
+    return digest, hit, found
+
+def scan_frame_result(scan_id, digest, hit, found, timings):
+    """Record a frame's decode result and return the scan page payload and HTTP status"""
+    if digest is None:
+        return {'success': False, 'error': 'Could not read the camera image.'}, 200
+    if not hit:
+        record_decode_timings(timings)
+        if found is None:
+            return {'success': False, 'error': 'Could not read the camera image.'}, 200
+        frame_cache.put(scan_id, digest, found)
+    SCAN_FRAMES.inc(outcome='cache_hit' if hit else 'decoded')
+
+    result = resolve_qr_codes(found)
+    scan_regions.update(scan_id, result['bounds'] if result else None)
+    if result:
+        if result.get('is_used'):
+            return {
+                'success': False,
+                'bounds': result['bounds'],
+                'error': result['error']
+            }, 200
+        return {
+            'success': True,
+            'bounds': result['bounds'],
+            'redirect': url_for('confirm', **confirm_args(result))
+        }, 200
+    return {
+        'success': False,
+        'error': 'No valid QR code found. Please try again with a clearer image.'
+    }, 200
+
+# Batch uploads may be far larger than single scans
+app.config['BATCH_MAX_CONTENT_LENGTH'] = int(os.environ.get('QRATM_BATCH_MAX_BYTES', 512 * 1024 * 1024))
+
+@app.route('/scan/batch', methods=['POST'])
+@admin_required
+def scan_batch():
+    """Decode many images (multipart 'images' files and/or a zip 'archive') and stream NDJSON results"""
+    request.max_content_length = app.config['BATCH_MAX_CONTENT_LENGTH']
+    uploads = request.files.getlist('images')
+    archive = request.files.get('archive')
+    if not uploads and not archive:
+        return jsonify({'success': False, 'error': 'Upload images or a zip archive.'}), 400
+
+    # The request closes its uploaded files as soon as this view returns,
+    # before the body is streamed, so take their streams over from it
+    def take_stream(upload):
+        stream, upload.stream = upload.stream, BytesIO()
+        return stream
+    streams = [(upload.filename, take_stream(upload)) for upload in uploads]
+    archive_stream = take_stream(archive) if archive else None
+
+    def images():
+        for filename, stream in streams:
+            yield filename, stream.read()
+        if archive_stream:
+            yield from iter_zip(archive_stream)
+
+    def results():
+        # Batches share half the decode slots between them, so kiosks keep
+        # getting frames through
+        try:
+            for name, found, timings in decode_all(images(), decode_pool.submit_batch, decode_pool.batch_slots):
+                record_decode_timings(timings)
+                yield json.dumps(describe(name, found, timings, qr_status)) + '\n'
+        except zipfile.BadZipFile:
+            yield json.dumps({'error': 'The archive is not a valid zip file.'}) + '\n'
+        finally:
+            for _, stream in streams:
+                stream.close()
+            if archive_stream:
+                archive_stream.close()
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+@app.route('/scan/stats')
+@admin_required
+def scan_stats():
+    return jsonify({
+        'frame_cache': frame_cache.stats(),
+        'pending_tokens': len(pending_tokens),
+        'decode_latency_ms': round(frame_gate.latency * 1000, 1),
+        'target_fps': frame_gate.target_fps()
+    })
+
+def process_qr_code(image_source, roi=None):
     """
     Process QR code from either a file path or an image array
-    Returns a dictionary with name, amount, pin, and timestamp if successful, None otherwise
+    Returns a dictionary with name, amount, pin, timestamp and bounds if successful, None otherwise
+    roi is the bounds of the QR code in the previous frame of the same scan session, if any
     """
+    import cv2
+    from qr_decoder import decode_frame
+
     try:
         # Read image if it's a file path
         if isinstance(image_source, str):
@@ -224,204 +445,233 @@ def process_qr_code(image_source):
             return None
             
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Try multiple QR code detection methods
-        # Method 1: Using pyzbar
-        try:
-            from pyzbar.pyzbar import decode
-            decoded_objects = decode(gray)
-            if decoded_objects:
-                for obj in decoded_objects:
-                    data = obj.data.decode('utf-8')
-                    if validate_qr_data(data):
-                        result = parse_qr_data(data)
-                        if result:
-                            # Check if QR code is already used or expired
-                            if is_qr_used(result['name'], result['timestamp']):
-                                result['is_used'] = True
-                                result['error'] = 'This QR code has already been used or has expired. Please generate a new one.'
-                            return result
-        except Exception as e:
-            app.logger.warning(f"Pyzbar QR detection failed: {str(e)}")
+        with SCAN_STAGE_SECONDS.time(stage='grayscale'):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         
-        # Method 2: Using OpenCV's QR code detector
-        try:
-            qr_detector = cv2.QRCodeDetector()
-            retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(gray)
-            if retval:
-                for data in decoded_info:
-                    if data and validate_qr_data(data):
-                        result = parse_qr_data(data)
-                        if result:
-                            # Check if QR code is already used or expired
-                            if is_qr_used(result['name'], result['timestamp']):
-                                result['is_used'] = True
-                                result['error'] = 'This QR code has already been used or has expired. Please generate a new one.'
-                            return result
-        except Exception as e:
-            app.logger.warning(f"OpenCV QR detection failed: {str(e)}")
-        
-        return None
+        # Tiered decode: downscaled frame, previous QR region, then full resolution
+        timings = []
+        found = decode_frame(gray, roi, timings)
+        record_decode_timings(timings)
+        return resolve_qr_codes(found)
         
     except Exception as e:
         app.logger.error(f"Error in process_qr_code: {str(e)}")
         return None
 
-def validate_qr_data(data):
-    """Validate QR code data format"""
-    try:
-        parts = data.split(',')
-        if len(parts) != 4:  # username,amount,pin,timestamp
-            return False
-            
-        username, amount, pin, timestamp = parts
-        
-        # Validate username exists
-        if username not in users:
-            return False
-            
-        # Validate amount is positive number
-        try:
-            amount = float(amount)
-            if amount <= 0:
-                return False
-        except ValueError:
-            return False
-            
-        # Validate PIN is numeric
-        if not pin.isdigit():
-            return False
-            
-        # Validate timestamp format
-        try:
-            datetime.strptime(timestamp, '%Y%m%d%H%M%S')
-        except ValueError:
-            return False
-            
-        return True
-        
-    except Exception as e:
-        app.logger.error(f"Error validating QR data: {str(e)}")
+def record_decode_timings(timings):
+    """Record stage timings and decoder hits/misses reported by decode_frame()"""
+    for stage, seconds, found in timings:
+        SCAN_STAGE_SECONDS.observe(seconds, stage=stage)
+        if found is not None:
+            QR_DECODES.inc(decoder=stage, result='hit' if found else 'miss')
+
+def resolve_qr_codes(found):
+    """Return the first decoded QR code that is a valid transaction, None otherwise"""
+    for qr in found:
+        # A QR code issued by this process and not yet redeemed is one lookup away
+        entry = pending_tokens.lookup(qr.data) if app.config['TOKEN_REGISTRY'] else None
+        if entry is not None:
+            return dict(entry, bounds=qr.bounds)
+
+        with SCAN_STAGE_SECONDS.time(stage='validate_qr_data'):
+            result = parse_qr_data(qr.data)
+            valid = result is not None and validate_qr_data(result)
+        if valid:
+            result['bounds'] = qr.bounds
+            result['payload'] = qr.data
+            # Check if QR code is already used or expired
+            with SCAN_STAGE_SECONDS.time(stage='is_qr_used'):
+                is_used = is_qr_used(result['name'], result['timestamp'], result['issued_at'])
+            if is_used:
+                result['is_used'] = True
+                result['error'] = TOKEN_GONE_ERROR
+            elif app.config['TOKEN_REGISTRY']:
+                # Issued before a restart: register it so the rest of the
+                # flow goes by token too
+                result['token'] = pending_tokens.register(qr.data, result)
+                if result['token'] is None:
+                    # Locked out, or expired since is_qr_used() looked
+                    expired = time.time() - result['issued_at'] >= QR_VALIDITY_SECONDS
+                    result['is_used'] = True
+                    result['error'] = TOKEN_GONE_ERROR if expired else PIN_LOCKED_ERROR
+            return result
+    return None
+
+def confirm_args(result):
+    """Query arguments of the confirm page for a resolved QR code"""
+    if 'token' in result:
+        return {'token': result['token'], 'terminal': current_terminal()}
+    return {'payload': result['payload'], 'terminal': current_terminal()}
+
+def validate_qr_data(qr, check_user=True):
+    """Validate parsed QR code data"""
+    # The user must exist, the amount be positive and a legacy PIN numeric
+    if check_user and store.get_user(qr['name']) is None:
+        return False
+    if qr['amount'] <= 0:
         return False
+    return qr['pin'].startswith(qr_payload.PIN_HASH_PREFIX) or qr['pin'].isdigit()
 
-def is_qr_used(username, timestamp):
-    """Check if a QR code has already been used by comparing with transaction history"""
+def is_qr_used(username, timestamp, issued_at):
+    """Check if a QR code has expired or was already redeemed"""
     try:
-        # Convert QR code timestamp to datetime object
-        qr_time = datetime.strptime(timestamp, '%Y%m%d%H%M%S')
-        
-        # Check user's transaction history
-        if username in user_history:
-            for transaction in user_history[username]:
-                # Convert transaction date to datetime object
-                trans_time = datetime.strptime(transaction['date'], '%Y-%m-%d %H:%M:%S')
-                
-                # If transaction time is within 1 second of QR code time, consider it used
-                if abs((trans_time - qr_time).total_seconds()) < 1:
-                    return True
-                
-                # Also check if QR code is expired (5 minutes validity)
-                if (datetime.now() - qr_time).total_seconds() > 300:  # 5 minutes
-                    return True
-        
-        return False
+        # Expiry only depends on when the QR code was issued (5 minutes validity)
+        if time.time() - issued_at > QR_VALIDITY_SECONDS:
+            return True
+
+        # Redeemed QR codes are indexed by the storage backend
+        return store.is_qr_redeemed(username, timestamp)
     except Exception as e:
         app.logger.error(f"Error checking QR usage: {str(e)}")
         return False
 
 def parse_qr_data(data):
-    """Parse QR code data into a dictionary"""
+    """Parse and verify QR code data into a dictionary, None if it is not a valid payload"""
+    if qr_payload.is_compact(data):
+        try:
+            name, amount, issued_at, pin_hash = qr_payload.decode(app.config['QR_SIGNING_KEY'], data)
+        except qr_payload.PayloadError:
+            return None
+        # The PIN hash stands in for the PIN; /process checks the entered PIN against it
+        return {
+            'name': name,
+            'amount': amount,
+            'pin': f'{qr_payload.PIN_HASH_PREFIX}{pin_hash:08x}',
+            'timestamp': str(issued_at),
+            'issued_at': issued_at
+        }
+
+    # Legacy text payload: username,amount,pin,YYYYmmddHHMMSS
     try:
         username, amount, pin, timestamp = data.split(',')
         return {
             'name': username,
             'amount': float(amount),
             'pin': pin,
-            'timestamp': timestamp
+            'timestamp': timestamp,
+            'issued_at': datetime.strptime(timestamp, '%Y%m%d%H%M%S').timestamp()
         }
-    except Exception as e:
-        app.logger.error(f"Error parsing QR data: {str(e)}")
+    except ValueError:
         return None
 
+def qr_status(data, check_ledger=True):
+    """
+    Validate a decoded payload for batch review. Returns the payload fields
+    except the PIN, whether it is valid and its status: ok, used, expired or
+    invalid. Without check_ledger users and redemptions are not looked up.
+    """
+    qr = parse_qr_data(data)
+    if qr is None or not validate_qr_data(qr, check_user=check_ledger):
+        return {'valid': False, 'status': 'invalid'}
+    if time.time() - qr['issued_at'] > QR_VALIDITY_SECONDS:
+        status = 'expired'
+    elif check_ledger and store.is_qr_redeemed(qr['name'], qr['timestamp']):
+        status = 'used'
+    else:
+        status = 'ok'
+    return {
+        'valid': True,
+        'status': status,
+        'format': 'compact' if qr_payload.is_compact(data) else 'legacy',
+        'name': qr['name'],
+        'amount': qr['amount'],
+        'issued_at': datetime.fromtimestamp(qr['issued_at']).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+TOKEN_GONE_ERROR = 'This QR code has already been used or has expired. Please generate a new one.'
+PIN_LOCKED_ERROR = 'Too many wrong PINs. Please generate a new QR code.'
+NO_QR_ERROR = 'No valid QR code found. Please scan your QR code again.'
+
+def pending_qr(values):
+    """
+    Return (qr, error) for the QR code a confirm or process request names:
+    by token when the token registry is on, otherwise by its payload, which
+    is parsed and verified again. Withdrawal details are never taken from
+    the request itself.
+    """
+    if app.config['TOKEN_REGISTRY']:
+        # Only the token travels with the request; the payload stays in the registry
+        token = values.get('token')
+        if not token:
+            return None, NO_QR_ERROR
+        entry = pending_tokens.get(token)
+        return (entry, None) if entry is not None else (None, TOKEN_GONE_ERROR)
+
+    payload = values.get('payload', '')
+    qr = parse_qr_data(payload) if payload else None
+    if qr is None or not validate_qr_data(qr):
+        return None, NO_QR_ERROR
+    if is_qr_used(qr['name'], qr['timestamp'], qr['issued_at']):
+        return None, TOKEN_GONE_ERROR
+    return qr, None
+
 @app.route('/confirm')
 def confirm():
-    name = request.args.get('name', '')
-    amount = request.args.get('amount', 0)
-    pin = request.args.get('pin', '')
-    
-    return render_template('confirm.html', name=name, amount=amount, pin=pin)
+    qr, error = pending_qr(request.args)
+    if qr is None:
+        return render_template('scan.html', error=error)
+    return render_template('confirm.html', name=qr['name'], amount=qr['amount'], token=qr.get('token'),
+                           payload=request.args.get('payload'), terminal=current_terminal())
+
+# Messages shown on the confirm page for rejected withdrawals
+WITHDRAW_ERRORS = {
+    InvalidAmount: "Invalid amount.",
+    UnknownUser: "User not found.",
+    QRAlreadyUsed: "This QR code has already been used. Please generate a new one.",
+    InsufficientATMBalance: "ATM has insufficient balance. Please try a lower amount.",
+    InsufficientBalance: "Insufficient balance. Please try a lower amount.",
+    UnknownTerminal: "Unknown ATM terminal."
+}
 
 @app.route('/process', methods=['POST'])
 def process():
-    global atm_balance  # Move global declaration to the start of the function
-    
-    name = request.form.get('name', '')
-    amount = float(request.form.get('amount', 0))
-    pin = request.form.get('pin', '')
     entered_pin = request.form.get('entered_pin', '')
+    terminal = request.form.get('terminal') or current_terminal()
+    qr, error = pending_qr(request.form)
+    if qr is None:
+        return render_template('scan.html', error=error)
+    name, amount, pin, timestamp = qr['name'], qr['amount'], qr['pin'], qr['timestamp']
+    token, payload = qr.get('token'), request.form.get('payload')
     
-    # Validate PIN
-    if pin == entered_pin:
-        # Check if user exists and has sufficient balance
-        if name in users:
-            # Check if ATM has sufficient balance
-            if atm_balance < amount:
-                return render_template('confirm.html', 
-                                    name=name, 
-                                    amount=amount, 
-                                    pin=pin, 
-                                    error="ATM has insufficient balance. Please try a lower amount.")
-            
-            # Check if user has sufficient balance
-            if users[name]['balance'] >= amount:
-                # Create transaction record
-                transaction = {
-                    'id': len(atm_history) + 1,
-                    'name': name,
-                    'amount': amount,
-                    'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'status': 'Completed',
-                    'type': 'ATM'
-                }
-                
-                # Add to ATM history
-                atm_history.append(transaction)
-                
-                # Add to user history
-                if name not in user_history:
-                    user_history[name] = []
-                user_history[name].append(transaction)
-                
-                # Update user balance and ATM balance
-                users[name]['balance'] -= amount
-                atm_balance -= amount  # Decrease ATM balance when user withdraws
-                
-                # Save data after successful transaction
-                save_data()
-                
-                # Store transaction in session for success page
-                session['last_transaction'] = transaction
-                return redirect(url_for('success'))
-            else:
-                return render_template('confirm.html', 
-                                    name=name, 
-                                    amount=amount, 
-                                    pin=pin, 
-                                    error="Insufficient balance. Please try a lower amount.")
-        else:
-            return render_template('confirm.html', 
-                                name=name, 
-                                amount=amount, 
-                                pin=pin, 
-                                error="User not found.")
-    else:
+    # Validate PIN (compact QR codes carry a keyed hash of it)
+    if not qr_payload.pin_matches(app.config['QR_SIGNING_KEY'], pin, entered_pin, name, timestamp):
+        if token and not pending_tokens.pin_failed(token):
+            return render_template('scan.html', error=PIN_LOCKED_ERROR)
         return render_template('confirm.html', 
                             name=name, 
                             amount=amount, 
-                            pin=pin, 
+                            token=token,
+                            payload=payload,
+                            terminal=terminal,
                             error="Invalid PIN. Please try again.")
 
+    # Only one submission of a token gets past this point
+    if token:
+        entry = pending_tokens.consume(token)
+        if entry is None:
+            return render_template('scan.html', error=TOKEN_GONE_ERROR)
+
+    # Balance checks and updates happen atomically inside the storage backend,
+    # against the cash of the terminal the customer stands at
+    try:
+        with PROCESS_STAGE_SECONDS.time(stage='withdraw'):
+            transaction = store.withdraw(name, amount, qr_timestamp=timestamp or None, terminal=terminal)
+    except tuple(WITHDRAW_ERRORS) as e:
+        if token and not isinstance(e, QRAlreadyUsed):
+            # The QR code can still be redeemed, e.g. at a terminal with more cash
+            pending_tokens.restore(entry)
+        return render_template('confirm.html', 
+                            name=name, 
+                            amount=amount, 
+                            token=token,
+                            payload=payload,
+                            terminal=terminal,
+                            error=WITHDRAW_ERRORS[type(e)])
+    
+    # Store transaction in session for success page
+    session['last_transaction'] = transaction
+    return redirect(url_for('success'))
+
 @app.route('/success')
 def success():
     transaction = session.get('last_transaction', None)
@@ -430,181 +680,231 @@ def success():
     
     return render_template('success.html', transaction=transaction)
 
+# Transactions shown per history page
+HISTORY_PAGE_SIZE = 20
+
+def history_page_args():
+    """Read the ?before= cursor and ?limit= page size; raises ValueError"""
+    before = request.args.get('before')
+    before = int(before) if before else None
+    limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), 100)
+    return before, limit
+
 @app.route('/history')
 @user_required
 def history():
     username = session.get('username')
-    user_role = users[username]['role'] if username in users else None
-    
-    if user_role == 'admin':
-        # Admin sees ATM history
-        return render_template('history.html', 
-                             transactions=atm_history,
-                             is_admin=True,
-                             username=username)
-    else:
-        # Regular users see only their transactions
-        user_transactions = user_history.get(username, [])
-        return render_template('history.html', 
-                             transactions=user_transactions,
-                             is_admin=False,
-                             username=username)
+    user = store.get_user(username)
+    is_admin = user is not None and user['role'] == 'admin'
+    try:
+        before, limit = history_page_args()
+    except ValueError:
+        return "Invalid page cursor", 400
+
+    # Admin sees ATM history, optionally one terminal's, regular users see
+    # only their transactions. Pages are fetched by id cursor, so each
+    # request costs one page.
+    terminal = (request.args.get('terminal') or None) if is_admin else None
+    transactions, next_cursor = store.history_page(None if is_admin else username, before=before, limit=limit,
+                                                   terminal=terminal)
+    return render_template('history.html', 
+                         transactions=transactions,
+                         is_admin=is_admin,
+                         username=username,
+                         terminal=terminal,
+                         before=before,
+                         next_cursor=next_cursor)
+
+@app.route('/api/history')
+@user_required
+def api_history():
+    username = session.get('username')
+    user = store.get_user(username)
+    try:
+        before, limit = history_page_args()
+    except ValueError:
+        return jsonify({'error': 'Invalid page cursor'}), 400
+
+    # Admins may page through any user's history, or the whole ATM's; both
+    # can be narrowed to one terminal
+    if user is not None and user['role'] == 'admin':
+        username = request.args.get('user') or None
+    transactions, next_cursor = store.history_page(username, before=before, limit=limit,
+                                                   terminal=request.args.get('terminal') or None)
+    return jsonify({'transactions': transactions, 'next_cursor': next_cursor})
 
 @app.route('/generate', methods=['GET', 'POST'])
 @user_required
 def generate():
     if request.method == 'POST':
+        import qrcode
+
         username = session.get('username')
         amount = request.form.get('amount')
-        pin = request.form.get('pin')
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')  # Add timestamp
+        pin = request.form.get('pin', '')
+        try:
+            amount_value = float(amount)
+        except (TypeError, ValueError):
+            amount_value = 0
+        # The payload's amount field holds whole paise up to MAX_AMOUNT; NaN
+        # fails the range check and sub-paisa amounts the rounding one
+        valid_amount = 0 < amount_value <= qr_payload.MAX_AMOUNT and round(amount_value * 100) > 0
+        if not valid_amount or not pin.isdigit():
+            flash(f'Enter an amount up to ₹{qr_payload.MAX_AMOUNT:,} and a numeric PIN', 'danger')
+            return render_template('generate.html', username=username, amount=amount)
+        issued_at = int(time.time())
+        timestamp = datetime.fromtimestamp(issued_at).strftime('%Y%m%d%H%M%S')
         
-        # Create QR code data with timestamp
-        qr_data = f"{username},{amount},{pin},{timestamp}"  # Include timestamp in QR data
-        logger.debug(f"Generating QR code with data: {qr_data}")
+        # Signed binary payload, base45 so it encodes in QR alphanumeric mode
+        qr_data = qr_payload.encode(app.config['QR_SIGNING_KEY'], username, amount_value, pin, issued_at)
+        if app.config['TOKEN_REGISTRY']:
+            pending_tokens.register(qr_data, parse_qr_data(qr_data))
+        logger.debug(f"Generating QR code for {username}, amount {amount_value}")
         
-        # Generate QR code
+        # Generate QR code. Error correction level Q keeps the symbol at a
+        # small fixed version, which kiosk cameras decode quickest.
         qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
+            version=qr_payload.QR_VERSION,
+            error_correction=qrcode.constants.ERROR_CORRECT_Q,
             box_size=10,
             border=4,
         )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
+        with GENERATE_STAGE_SECONDS.time(stage='qr_encode'):
+            qr.add_data(qr_data)
+            try:
+                qr.make(fit=False)
+            except qrcode.exceptions.DataOverflowError:
+                qr.version = None
+                qr.make(fit=True)
         
         # Create QR code image
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save QR code to BytesIO object
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        # Save QR code to file with timestamp in filename
-        filename = f"qr_{username}_{timestamp}.png"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        img.save(filepath)
+        with GENERATE_STAGE_SECONDS.time(stage='qr_render'):
+            img = qr.make_image(fill_color="black", back_color="white")
+            
+            # Save QR code to BytesIO object and serve it from the in-memory cache
+            img_io = BytesIO()
+            img.save(img_io, 'PNG')
+        if app.config['SHARED_STATE']:
+            # The image cache is per process and the next request may reach
+            # another worker, so embed the image in the page instead
+            qr_code = 'data:image/png;base64,' + base64.b64encode(img_io.getvalue()).decode('ascii')
+        else:
+            qr_code = url_for('qr_image', digest=qr_images.put(qr_data, img_io.getvalue(), owner=username))
         
         return render_template('generate.html', 
-                             qr_code=url_for('static', filename=f'uploads/{filename}'),
+                             qr_code=qr_code,
                              username=username,
                              amount=amount,
                              timestamp=timestamp)
     
     return render_template('generate.html', username=session.get('username'))
 
+@app.route('/qr/<digest>.png')
+@user_required
+def qr_image(digest):
+    entry = qr_images.get(digest)
+    # Only the user who generated a QR code may fetch it (it carries the PIN)
+    if entry is None or entry[1] != session.get('username'):
+        return render_template('404.html'), 404
+    png, _ = entry
+    response = make_response(png)
+    response.mimetype = 'image/png'
+    response.headers['Cache-Control'] = f'private, max-age={QR_VALIDITY_SECONDS}, immutable'
+    response.set_etag(digest)
+    return response.make_conditional(request)
+
 @app.route('/dashboard')
 @user_required
 def dashboard():
     username = session.get('username')
-    user_data = users[username]
+    user_data = store.get_user(username)
     user_role = user_data['role']
     
     if user_role == 'admin':
-        # For admin, show ATM balance and recent ATM transactions
-        recent_transactions = atm_history[-5:] if atm_history else []
+        # For admin, show the cash across all terminals, each terminal's
+        # balance and totals, and recent ATM transactions
+        recent_transactions = store.recent_transactions(limit=5)
         return render_template('dashboard.html',
                              username=username,
                              is_admin=True,
-                             atm_balance=atm_balance,
-                             transactions=recent_transactions)
+                             atm_balance=store.get_atm_balance(),
+                             terminals=terminal_summaries(),
+                             transactions=recent_transactions,
+                             daily_totals=store.daily_totals(days=7),
+                             cash_out_rate=store.cash_out_rate())
     else:
         # For regular users, show their balance and recent transactions
-        user_transactions = user_history.get(username, [])[-5:] if username in user_history else []
+        user_transactions = store.recent_transactions(username, limit=5)
         return render_template('dashboard.html',
                              username=username,
                              is_admin=False,
                              balance=user_data['balance'],
-                             transactions=user_transactions)
+                             transactions=user_transactions,
+                             totals=store.user_totals(username))
+
+def terminal_summaries():
+    """Every terminal's id, cash balance and transaction totals"""
+    totals = store.terminal_totals()
+    empty = {'withdrawn': 0.0, 'deposited': 0.0, 'count': 0}
+    return [dict(totals.get(terminal, empty), id=terminal, balance=balance)
+            for terminal, balance in sorted(store.list_terminals().items())]
+
+@app.route('/terminals', methods=['POST'])
+@admin_required
+def add_terminal():
+    terminal = request.form.get('terminal_id', '').strip()
+    try:
+        balance = float(request.form.get('balance', 0))
+    except ValueError:
+        balance = -1
+    if not TERMINAL_ID_PATTERN.match(terminal):
+        flash('Terminal IDs are 1-32 letters, digits, - or _', 'danger')
+    elif not math.isfinite(balance) or balance < 0:
+        flash('Cash balance must be 0 or more', 'danger')
+    elif not store.add_terminal(terminal, balance):
+        flash(f'Terminal {terminal} already exists', 'danger')
+    else:
+        flash(f'Added terminal {terminal} with ₹{balance:.2f}', 'success')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/terminals')
+@admin_required
+def api_terminals():
+    terminals = terminal_summaries()
+    return jsonify({'terminals': terminals, 'atm_balance': sum(terminal['balance'] for terminal in terminals)})
 
 @app.route('/export/<format>')
 @admin_required
 def export_data(format):
-    if format not in ['csv', 'json']:
+    if format not in EXPORT_FORMATS:
         return "Invalid format", 400
-        
-    # Prepare data for export
-    export_data = {
-        'users': {
-            username: {
-                'role': data['role'],
-                'balance': data['balance']
-            } for username, data in users.items()
-        },
-        'atm_balance': atm_balance,
-        'atm_history': atm_history,
-        'user_history': user_history,
-        'export_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    
-    if format == 'json':
-        # Create JSON file
-        json_data = json.dumps(export_data, indent=4)
-        mem_file = io.BytesIO()
-        mem_file.write(json_data.encode('utf-8'))
-        mem_file.seek(0)
-        return send_file(
-            mem_file,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'qratm_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-        )
-    else:
-        # Create CSV files
-        mem_file = io.BytesIO()
-        writer = csv.writer(mem_file)
-        
-        # Write users data
-        writer.writerow(['Users Data'])
-        writer.writerow(['Username', 'Role', 'Balance'])
-        for username, data in users.items():
-            writer.writerow([username, data['role'], data['balance']])
-        
-        writer.writerow([])  # Empty row for separation
-        
-        # Write ATM balance
-        writer.writerow(['ATM Balance'])
-        writer.writerow([atm_balance])
-        
-        writer.writerow([])  # Empty row for separation
-        
-        # Write ATM history
-        writer.writerow(['ATM History'])
-        writer.writerow(['ID', 'User', 'Amount', 'Date', 'Status', 'Type'])
-        for t in atm_history:
-            writer.writerow([
-                t['id'],
-                t['name'],
-                t['amount'],
-                t['date'],
-                t['status'],
-                t['type']
-            ])
-        
-        writer.writerow([])  # Empty row for separation
-        
-        # Write user history
-        writer.writerow(['User History'])
-        for username, transactions in user_history.items():
-            writer.writerow([username])
-            for t in transactions:
-                writer.writerow([
-                    t['id'],
-                    t['name'],
-                    t['amount'],
-                    t['date'],
-                    t['status'],
-                    t['type']
-                ])
-        
-        mem_file.seek(0)
-        return send_file(
-            mem_file,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'qratm_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
+    try:
+        filters = ExportFilters.from_args(request.args)
+    except ValueError:
+        return "Invalid date, use YYYY-MM-DD", 400
+    compress = request.args.get('gzip') == '1'
+
+    # Rows are generated while the response is sent, so memory use does not
+    # grow with the size of the history
+    filename = f'qratm_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{format}'
+    mimetype = EXPORT_FORMATS[format]
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(generate_export(store, format, filters, compress=compress), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/metrics')
+def metrics():
+    # Scrapers can authenticate with a bearer token; people need an admin session
+    token = app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        user = store.get_user(session['username']) if 'username' in session else None
+        if user is None or user['role'] != 'admin':
+            return 'Admin access required', 403
+    response = make_response(REGISTRY.render())
+    response.headers['Content-Type'] = METRICS_CONTENT_TYPE
+    return response
 
 # Add a route to manually save data (admin only)
 @app.route('/save_data')
@@ -620,42 +920,21 @@ def deposit():
     try:
         user_id = request.form.get('user_id')
         amount = float(request.form.get('amount', 0))
+        terminal = request.form.get('terminal') or DEFAULT_TERMINAL
         
-        # Validate user exists
-        if user_id not in users:
+        # Credit the user and the terminal in one atomic storage transaction;
+        # the ledger rejects amounts that are not positive and finite
+        try:
+            store.deposit(user_id, amount, terminal=terminal)
+        except InvalidAmount:
+            flash('Amount must be greater than 0', 'danger')
+            return redirect(url_for('dashboard'))
+        except UnknownUser:
             flash('User not found', 'danger')
             return redirect(url_for('dashboard'))
-            
-        # Validate amount is positive
-        if amount <= 0:
-            flash('Amount must be greater than 0', 'danger')
+        except UnknownTerminal:
+            flash('Terminal not found', 'danger')
             return redirect(url_for('dashboard'))
-            
-        # Create transaction record
-        transaction = {
-            'id': len(atm_history) + 1,
-            'name': user_id,
-            'amount': amount,
-            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'status': 'Completed',
-            'type': 'Deposit'
-        }
-        
-        # Add to ATM history
-        atm_history.append(transaction)
-        
-        # Add to user history
-        if user_id not in user_history:
-            user_history[user_id] = []
-        user_history[user_id].append(transaction)
-        
-        # Update user balance and ATM balance
-        users[user_id]['balance'] += amount
-        global atm_balance
-        atm_balance += amount
-        
-        # Save data after successful transaction
-        save_data()
         
         flash(f'Successfully deposited ${amount:.2f} to {user_id}\'s account', 'success')
         return redirect(url_for('dashboard'))
@@ -674,7 +953,48 @@ def page_not_found(e):
 def internal_server_error(e):
     return render_template('500.html'), 500
 
+# Importing this module only builds objects: it starts no threads, touches no
+# files and leaves OpenCV, pyzbar and qrcode unloaded, so it is fast and
+# spawned decode workers can import it. create_app() does the startup work
+# (logging, the upload folder, loading the ledger); warm-up then loads the
+# imaging stack in the background so the first /scan or /generate does not
+# wait for it. Background tasks start on the first request.
+app.config['WARM_UP'] = os.environ.get('QRATM_WARM_UP', '1') == '1'
+
+def warm_up():
+    """Import the QR encoder and decoders and start the decode workers"""
+    started = time.perf_counter()
+    try:
+        import qrcode  # noqa: F401
+        decode_pool.warm_up()
+        app.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        app.logger.error(f"Warm-up failed: {str(e)}")
+
+# Serializes the one-time ledger load between concurrent first requests
+_load_lock = threading.Lock()
+
+def create_app(warm=None):
+    """Load the ledger, seed the default users and return the app ready to serve; later calls only return it"""
+    if app.config.get('LEDGER_LOADED'):
+        return app
+    with _load_lock:
+        if not app.config.get('LEDGER_LOADED'):
+            # Logging: JSON records written by a background thread, level
+            # from QRATM_LOG_LEVEL (see log_config.py)
+            configure_logging()
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            init_data()
+            app.config['LEDGER_LOADED'] = True
+            if app.config['WARM_UP'] if warm is None else warm:
+                threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    return app
+
 if __name__ == '__main__':
     # Create SSL context
     ssl_context = ('cert.pem', 'key.pem')
-    app.run(host='0.0.0.0', port=5000, ssl_context=ssl_context, debug=True)
+    # The debug reloader's parent process only watches files; warm up in the
+    # child that serves requests
+    create_app(warm=app.config['WARM_UP'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+    # The storage ledger locks per account, so requests can run concurrently
+    app.run(host='0.0.0.0', port=5000, ssl_context=ssl_context, debug=True, threaded=True)
@@ -0,0 +1,183 @@
+"""
+ASGI entry point for serving many kiosks from one process.
+
+A kiosk's scan loop keeps posting camera frames, and each frame spends most of
+its time waiting for a decode worker. Under WSGI that wait holds a thread per
+kiosk. Here binary frames on POST /scan are handled on the event loop: the
+request body is read asynchronously, the frame waits for its turn with
+FrameGate.admit_async() and for its decode with the pool's Future, and no
+thread is held meanwhile. CPU-bound decoding stays in the decode pool's
+worker processes.
+
+Every other request, including history, API reads and exports, goes to the
+Flask app through a2wsgi's WSGI bridge, which runs it on a bounded thread
+pool (QRATM_ASGI_THREADS, default 32) and streams the response back.
+
+    pip install -r requirements.txt
+    python serve.py
+
+Run from the QRATM directory; serve.py starts uvicorn with TLS.
+"""
+import asyncio
+import os
+import uuid
+from io import BytesIO
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import jsonify, render_template, session
+
+import app as qratm
+from frame_gate import FrameSuperseded
+from decode_pool import PoolBusy
+
+flask_app = qratm.app
+
+# Seconds a frame may wait for its decode before the kiosk is told to retry
+DECODE_TIMEOUT = 10
+
+# read_body() result for a client that went away before sending the whole body
+DISCONNECTED = object()
+
+
+class ScanApplication:
+    """Answers binary /scan frames natively and hands everything else to Flask"""
+
+    def __init__(self, threads=32):
+        self.wsgi = WSGIMiddleware(flask_app, workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and self.is_binary_frame(scope):
+            await self.scan_frame(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Loading the ledger reads files; keep it off the event loop
+                try:
+                    await asyncio.to_thread(qratm.create_app)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                qratm.decode_pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def is_binary_frame(scope):
+        if scope['method'] != 'POST' or scope['path'] != '/scan':
+            return False
+        for name, value in scope['headers']:
+            if name == b'content-type':
+                return value.decode('latin1').split(';')[0].strip().lower() in qratm.BINARY_FRAME_TYPES
+        return False
+
+    async def scan_frame(self, scope, receive, send):
+        """Async version of the binary frame branch of app.scan()"""
+        body = await read_body(receive, flask_app.config['MAX_CONTENT_LENGTH'])
+        if body is DISCONNECTED:
+            # Nobody is left to answer; a partial frame is not worth decoding
+            return
+        if body is None:
+            await send_json(send, 413, b'{"success": false, "error": "Image too large."}')
+            return
+
+        environ = build_environ(scope, BytesIO(body))
+        with flask_app.request_context(environ):
+            # Same before/after request handling as a Flask view, so request
+            # ids, metrics and the session cookie behave identically
+            try:
+                try:
+                    response = flask_app.preprocess_request()
+                    if response is None:
+                        response = await self.decode_frame(body)
+                except Exception as e:
+                    response = flask_app.handle_user_exception(e)
+                response = flask_app.finalize_request(response)
+            except Exception as e:
+                response = flask_app.handle_exception(e)
+
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                            for name, value in response.headers.items()]
+            })
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def decode_frame(self, image_bytes):
+        if not image_bytes:
+            return jsonify({'success': False, 'error': 'No image data received.'}), 400
+        scan_id = session.setdefault('scan_id', uuid.uuid4().hex)
+        try:
+            async with qratm.frame_gate.admit_async(scan_id):
+                payload, status = await decode_scan_frame(image_bytes, scan_id)
+        except FrameSuperseded:
+            payload, status = {'success': False, 'dropped': True}, 200
+            qratm.SCAN_FRAMES.inc(outcome='dropped')
+        except Exception as e:
+            flask_app.logger.error(f"Error processing QR code: {str(e)}")
+            return render_template('scan.html', error='An error occurred while processing the QR code.')
+        return qratm.scan_frame_response(payload, status)
+
+
+async def decode_scan_frame(image_bytes, scan_id):
+    """app.decode_scan_frame() that awaits the decode instead of blocking on it"""
+    # Hashing decodes a JPEG thumbnail and recording the result reads the
+    # ledger; both run on threads so the event loop keeps serving other kiosks.
+    # to_thread() copies the context, so Flask's request context goes along.
+    digest, hit, found = await asyncio.to_thread(qratm.lookup_scan_frame, image_bytes, scan_id)
+    timings = []
+    if digest is not None and not hit:
+        roi = qratm.scan_regions.get(scan_id)
+        try:
+            found, timings = await decode(image_bytes, roi)
+        except PoolBusy:
+            qratm.SCAN_FRAMES.inc(outcome='busy')
+            return {'success': False, 'busy': True}, 503
+    return await asyncio.to_thread(qratm.scan_frame_result, scan_id, digest, hit, found, timings)
+
+
+async def decode(image_bytes, roi):
+    pool = qratm.decode_pool
+    if pool.workers == 0:
+        # Inline decoding would stall the event loop; give it a thread
+        return await asyncio.to_thread(pool.decode, image_bytes, roi, DECODE_TIMEOUT)
+    return await asyncio.wait_for(asyncio.wrap_future(pool.try_submit(image_bytes, roi)), DECODE_TIMEOUT)
+
+
+async def read_body(receive, limit):
+    """Read a request body; returns None if it is longer than limit bytes, DISCONNECTED if the client left"""
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return DISCONNECTED
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            return None
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_json(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+application = ScanApplication(threads=int(os.environ.get('QRATM_ASGI_THREADS', 32)))
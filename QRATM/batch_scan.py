@@ -0,0 +1,126 @@
+"""
+Batch QR validation for reconciliation, fraud review and kiosk health checks.
+
+Images are decoded in parallel across cores and a result is produced for each
+one as soon as it is decoded: the decoded payload (never the PIN), whether it
+is valid, whether it is still redeemable, used or expired, and the decode time.
+The same code backs the /scan/batch endpoint and this command-line tool:
+
+    python batch_scan.py captures/ [--workers 4] [--check-ledger] > results.ndjson
+
+Run it from the QRATM directory. --check-ledger also looks up used QR codes in
+the ledger; with the json backend only do that while the server is stopped,
+since loading repairs the journal file in place.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_directory(path):
+    """Yield (relative path, bytes) for every image below a directory"""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if is_image_name(filename):
+                full_path = os.path.join(root, filename)
+                with open(full_path, 'rb') as f:
+                    yield os.path.relpath(full_path, path), f.read()
+
+
+def iter_zip(fileobj):
+    """Yield (member name, bytes) for every image in a zip archive"""
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and is_image_name(info.filename):
+                yield info.filename, archive.read(info)
+
+
+def decode_all(images, submit, max_in_flight):
+    """
+    Decode (name, bytes) pairs with submit(image_bytes) -> Future of
+    (QR codes, timings), keeping at most max_in_flight queued. Yields
+    (name, QR codes or None, timings) in input order.
+    """
+    pending = deque()
+    for name, image_bytes in images:
+        pending.append((name, submit(image_bytes)))
+        if len(pending) >= max_in_flight:
+            name, future = pending.popleft()
+            yield (name,) + future.result()
+    while pending:
+        name, future = pending.popleft()
+        yield (name,) + future.result()
+
+
+def describe(name, found, timings, check):
+    """Build the result for one image; check(data) validates a decoded payload"""
+    result = {
+        'image': name,
+        'decode_ms': round(sum(seconds for _, seconds, _ in timings) * 1000, 2)
+    }
+    if found is None:
+        result.update(status='unreadable', valid=False)
+        return result
+    if not found:
+        result.update(status='no_qr', valid=False)
+        return result
+    # Report the first valid QR code, or the first one if none is valid
+    checked = [(qr, check(qr.data)) for qr in found]
+    qr, info = next(((qr, info) for qr, info in checked if info['valid']), checked[0])
+    result.update(info)
+    result['decoder'] = qr.decoder
+    result['qr_count'] = len(found)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode and validate every QR image in a directory')
+    parser.add_argument('path', help='directory of captured images')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='decode processes')
+    parser.add_argument('--check-ledger', action='store_true',
+                        help='load the ledger to check which QR codes were already used')
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    import app
+    from decode_pool import decode_image_bytes
+
+    if args.check_ledger:
+        app.load_data()
+
+    def check(data):
+        return app.qr_status(data, check_ledger=args.check_ledger)
+
+    counts = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        def submit(image_bytes):
+            return executor.submit(decode_image_bytes, image_bytes)
+
+        results = decode_all(iter_directory(args.path), submit, max_in_flight=args.workers * 2)
+        for name, found, timings in results:
+            result = describe(name, found, timings, check)
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    summary = ', '.join(f'{status}: {count}' for status, count in sorted(counts.items()))
+    print(f"Scanned {total} images in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s) - {summary}",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Decode micro-benchmark on a synthetic corpus of camera-like frames.
+
+QR codes are generated with the same settings as /generate, then rendered into
+1280x720 frames the way a kiosk camera sees them: scaled, rotated, blurred,
+with sensor noise and JPEG compression. Every frame is decoded through the
+same path the decode pool workers use (decode_pool.decode_image_bytes), and
+the report gives throughput and latency percentiles overall, per decoder path
+(the tier that produced the result) and per pipeline stage (every attempt).
+
+    python bench_decode.py [--frames 30] [--seed 1] [--output report.json]
+    python bench_decode.py --compare baseline.json
+
+Run it from the QRATM directory. The corpus only depends on --seed and the
+profile settings, so reports from different commits are directly comparable;
+--compare prints the change against an earlier report.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+
+# Signing key for the synthetic payloads; only their size matters here
+BENCH_KEY = b'bench'
+
+# name -> ranges the frame parameters are drawn from:
+# QR width in pixels, rotation in degrees, blur sigma, noise sigma, JPEG quality
+PROFILES = {
+    'clean': {'size': (330, 400), 'angle': (0, 0), 'blur': (0, 0), 'noise': (0, 0), 'quality': (90, 90)},
+    'small': {'size': (120, 180), 'angle': (-5, 5), 'blur': (0, 0.6), 'noise': (0, 3), 'quality': (80, 90)},
+    'rotated': {'size': (250, 400), 'angle': (-40, 40), 'blur': (0, 0.6), 'noise': (0, 3), 'quality': (80, 90)},
+    'blurred': {'size': (250, 400), 'angle': (-5, 5), 'blur': (1.2, 2.5), 'noise': (0, 3), 'quality': (80, 90)},
+    'noisy': {'size': (250, 400), 'angle': (-5, 5), 'blur': (0, 0.6), 'noise': (8, 16), 'quality': (80, 90)},
+    'compressed': {'size': (250, 400), 'angle': (-5, 5), 'blur': (0, 0.6), 'noise': (0, 3), 'quality': (20, 40)},
+    'empty': None
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def qr_image(data, version, error_correction):
+    """Grayscale QR code rendered like /generate (box size 10, border 4)"""
+    import numpy as np
+    import qrcode
+
+    qr = qrcode.QRCode(version=version, error_correction=error_correction, box_size=10, border=4)
+    qr.add_data(data)
+    try:
+        qr.make(fit=False)
+    except qrcode.exceptions.DataOverflowError:
+        qr.version = None
+        qr.make(fit=True)
+    return np.array(qr.make_image(fill_color='black', back_color='white').convert('L'))
+
+
+def background(rng):
+    """Uneven grey background, like a counter top under kiosk lighting"""
+    import numpy as np
+
+    x = np.linspace(0, 1, FRAME_WIDTH, dtype=np.float32)
+    y = np.linspace(0, 1, FRAME_HEIGHT, dtype=np.float32)[:, None]
+    base = rng.uniform(80, 160)
+    return base + rng.uniform(-40, 40) * x + rng.uniform(-40, 40) * y
+
+
+def render_frame(qr, params, rng):
+    """Place a QR image in a camera frame; returns (JPEG bytes, QR bounds or None)"""
+    import cv2
+    import numpy as np
+
+    frame = background(rng)
+    bounds = None
+    if qr is not None:
+        size = params['size']
+        symbol = cv2.resize(qr, (size, size), interpolation=cv2.INTER_AREA)
+        # Rotate on a canvas large enough for the corners; the uncovered
+        # corners stay transparent so the background shows through
+        canvas = int(size * 1.5)
+        offset = (canvas - size) // 2
+        patch = np.zeros((canvas, canvas), np.float32)
+        mask = np.zeros((canvas, canvas), np.float32)
+        patch[offset:offset + size, offset:offset + size] = symbol
+        mask[offset:offset + size, offset:offset + size] = 1
+        rotation = cv2.getRotationMatrix2D((canvas / 2, canvas / 2), params['angle'], 1.0)
+        patch = cv2.warpAffine(patch, rotation, (canvas, canvas), flags=cv2.INTER_LINEAR)
+        mask = cv2.warpAffine(mask, rotation, (canvas, canvas), flags=cv2.INTER_LINEAR)
+        x = int(rng.uniform(0, FRAME_WIDTH - canvas))
+        y = int(rng.uniform(0, FRAME_HEIGHT - canvas))
+        region = frame[y:y + canvas, x:x + canvas]
+        frame[y:y + canvas, x:x + canvas] = region * (1 - mask) + patch * mask
+        bounds = {'x': x, 'y': y, 'width': canvas, 'height': canvas}
+
+    if params['blur'] > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), params['blur'])
+    if params['noise'] > 0:
+        frame = frame + np.random.default_rng(rng.getrandbits(32)).normal(0, params['noise'], frame.shape)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    # Cameras deliver colour frames; the decode path converts to grayscale
+    frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, params['quality']])
+    return encoded.tobytes(), bounds
+
+
+def frame_params(ranges, rng):
+    """Draw the parameters of one frame from a profile's ranges"""
+    return {
+        'size': int(rng.uniform(*ranges['size'])),
+        'angle': rng.uniform(*ranges['angle']),
+        'blur': rng.uniform(*ranges['blur']),
+        'noise': rng.uniform(*ranges['noise']),
+        'quality': int(rng.uniform(*ranges['quality']))
+    }
+
+
+def build_corpus(frames_per_profile, seed, version, error_correction):
+    """Return a list of frame dicts: profile, params, payload, jpeg, bounds"""
+    import qr_payload
+
+    rng = random.Random(seed)
+    issued_at = 1_700_000_000
+    corpus = []
+    for profile, ranges in PROFILES.items():
+        for i in range(frames_per_profile):
+            if ranges is None:
+                params = {'size': 0, 'angle': 0, 'blur': 0, 'noise': rng.uniform(0, 4), 'quality': 85}
+                jpeg, bounds = render_frame(None, params, rng)
+                corpus.append({'profile': profile, 'params': params, 'payload': None, 'jpeg': jpeg, 'bounds': None})
+                continue
+            params = frame_params(ranges, rng)
+            name = f'user{rng.randint(1, 999)}'
+            amount = rng.randint(1, 2000) * 50
+            pin = f'{rng.randint(0, 9999):04d}'
+            # Mostly compact payloads, with some legacy ones still in circulation
+            if i % 4 == 3:
+                payload = f'{name},{amount},{pin},{datetime.fromtimestamp(issued_at).strftime("%Y%m%d%H%M%S")}'
+            else:
+                payload = qr_payload.encode(BENCH_KEY, name, amount, pin, issued_at + i)
+            jpeg, bounds = render_frame(qr_image(payload, version, error_correction), params, rng)
+            corpus.append({'profile': profile, 'params': params, 'payload': payload, 'jpeg': jpeg, 'bounds': bounds})
+    return corpus
+
+
+def percentile(sorted_values, p):
+    """Linear-interpolated percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(seconds, elapsed=None):
+    """Count, mean and percentiles in milliseconds, plus throughput if elapsed is given"""
+    values = sorted(s * 1000 for s in seconds)
+    summary = {'count': len(values), 'mean_ms': round(sum(values) / len(values), 3) if values else None}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f'p{p}_ms'] = round(value, 3) if value is not None else None
+    if elapsed:
+        summary['per_second'] = round(len(values) / elapsed, 2)
+    return summary
+
+
+def run(corpus, repeat, use_roi):
+    """Decode the corpus repeat times and return the report sections"""
+    from decode_pool import decode_image_bytes
+
+    frames = []
+    stages = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            roi = item['bounds'] if use_roi else None
+            frame_started = time.perf_counter()
+            found, timings = decode_image_bytes(item['jpeg'], roi)
+            latency = time.perf_counter() - frame_started
+            for stage, seconds, hit in timings:
+                entry = stages.setdefault(stage, {'seconds': [], 'hits': 0})
+                entry['seconds'].append(seconds)
+                entry['hits'] += bool(hit)
+            decoded = [qr.data for qr in found or ()]
+            frames.append({
+                'profile': item['profile'],
+                'latency': latency,
+                'path': found[0].decoder if found else 'none',
+                'correct': decoded == [item['payload']] if item['payload'] else not decoded
+            })
+    elapsed = time.perf_counter() - started
+
+    def group(key):
+        groups = {}
+        for frame in frames:
+            groups.setdefault(frame[key], []).append(frame)
+        return {
+            name: dict(summarize([f['latency'] for f in members]),
+                       correct_rate=round(sum(f['correct'] for f in members) / len(members), 4))
+            for name, members in sorted(groups.items())
+        }
+
+    return {
+        'overall': dict(summarize([f['latency'] for f in frames], elapsed),
+                        correct_rate=round(sum(f['correct'] for f in frames) / len(frames), 4)),
+        'paths': group('path'),
+        'profiles': group('profile'),
+        'stages': {
+            stage: dict(summarize(entry['seconds']),
+                        hit_rate=round(entry['hits'] / len(entry['seconds']), 4) if stage != 'imdecode' else None)
+            for stage, entry in sorted(stages.items())
+        }
+    }
+
+
+def environment():
+    import cv2
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(report, baseline):
+    """Print the change of each latency/throughput figure against a baseline report"""
+    def change(new, old):
+        if new is None or not old:
+            return '      n/a'
+        return f'{(new - old) / old * 100:+8.1f}%'
+
+    print(f"Against {baseline['environment'].get('commit') or 'baseline'}:")
+    rows = [('overall', report['overall'], baseline['overall'])]
+    for section in ('paths', 'stages', 'profiles'):
+        for name, current in report[section].items():
+            if name in baseline.get(section, {}):
+                rows.append((f'{section[:-1]} {name}', current, baseline[section][name]))
+    for label, current, old in rows:
+        figures = ' '.join(f'p{p} {change(current[f"p{p}_ms"], old[f"p{p}_ms"])}' for p in PERCENTILES)
+        print(f'  {label:<28} {figures}')
+    print(f"  throughput {change(report['overall']['per_second'], baseline['overall']['per_second'])}")
+
+
+def print_report(report):
+    overall = report['overall']
+    print(f"{overall['count']} frames, {overall['per_second']} frames/s, "
+          f"{overall['correct_rate'] * 100:.1f}% decoded correctly")
+    for section in ('paths', 'stages', 'profiles'):
+        print(f'{section}:')
+        for name, summary in report[section].items():
+            figures = ' '.join(f"p{p} {summary[f'p{p}_ms']:8.2f}ms" for p in PERCENTILES)
+            rate = summary.get('hit_rate', summary.get('correct_rate'))
+            rate = f'{rate * 100:5.1f}%' if rate is not None else ''
+            print(f"  {name:<20} n={summary['count']:<6} {figures} {rate}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark QR decoding on synthetic camera frames')
+    parser.add_argument('--frames', type=int, default=30, help='frames per profile')
+    parser.add_argument('--repeat', type=int, default=3, help='times each frame is decoded')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--roi', action='store_true',
+                        help="pass each QR code's true bounds as the previous frame's region")
+    parser.add_argument('--error-correction', choices=('L', 'M', 'Q', 'H'), default='Q',
+                        help='QR error correction level (Q is what /generate uses)')
+    parser.add_argument('--output', default='bench_report.json', help='where to write the JSON report')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    args = parser.parse_args(argv)
+
+    import cv2
+    import qrcode
+
+    from qr_payload import QR_VERSION
+
+    # Decode on one thread, like each decode pool worker
+    cv2.setNumThreads(1)
+    error_correction = getattr(qrcode.constants, f'ERROR_CORRECT_{args.error_correction}')
+
+    started = time.perf_counter()
+    corpus = build_corpus(args.frames, args.seed, QR_VERSION, error_correction)
+    print(f'Built {len(corpus)} frames in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    # One untimed pass so imports and detector setup are not measured
+    run(corpus[::args.frames], 1, args.roi)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'settings': {
+            'frames_per_profile': args.frames,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'roi': args.roi,
+            'error_correction': args.error_correction,
+            'qr_version': QR_VERSION,
+            'profiles': PROFILES
+        }
+    }
+    report.update(run(corpus, args.repeat, args.roi))
+    print_report(report)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Process pool for CPU-bound QR decoding.
+
+Camera frames are handed to the workers still JPEG-encoded, which is roughly
+ten times smaller than the decoded pixels, so the only copy between processes
+is the compressed frame going in and a few decoded strings coming back. Each
+worker decodes straight to grayscale and runs the tiered decoder with its own
+reusable OpenCV detector.
+
+The number of frames waiting for or in a worker is bounded. When the bound is
+reached decode() raises PoolBusy immediately so the request can answer "busy"
+instead of queueing behind work nobody will wait for.
+
+OpenCV and the decoders are imported on first use, so importing this module
+(and the app) stays fast.
+"""
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+    """All decode slots are taken"""
+
+
+def decode_image_bytes(image_bytes, roi=None):
+    """
+    Decode an encoded image and return (QR codes found, stage timings)
+    The QR code list is None if the bytes are not an image. Timings are
+    (stage, seconds, found) tuples so the server can record them.
+    """
+    import cv2
+    import numpy as np
+    from qr_decoder import decode_frame
+
+    timings = []
+    started = time.perf_counter()
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    timings.append(('imdecode', time.perf_counter() - started, None))
+    if gray is None:
+        return None, timings
+    return decode_frame(gray, roi, timings), timings
+
+
+def _init_worker():
+    import cv2
+    from log_config import configure_logging
+    from qr_decoder import get_detector
+
+    # Spawned workers start with no logging setup; use the server's pipeline
+    configure_logging()
+
+    # One OpenCV thread per worker process; parallelism comes from the pool
+    cv2.setNumThreads(1)
+    get_detector()
+
+
+def _ready():
+    return True
+
+
+class DecodePool:
+    """Bounded pool of decode worker processes (workers=0 decodes inline)"""
+
+    def __init__(self, workers, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 2
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        # Batch uploads together hold at most half the slots, so kiosks keep
+        # getting frames through however many batches run at once
+        self.batch_slots = max(self.max_pending // 2, 1)
+        self._batch_slots = threading.BoundedSemaphore(self.batch_slots)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so importing the app never forks workers.
+        # 'spawn' keeps the workers free of the server's threads and state.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker)
+                atexit.register(self.shutdown)
+                logger.info(f"Started {self.workers} QR decode workers")
+            return self._executor
+
+    def decode(self, image_bytes, roi=None, timeout=10):
+        """Decode a frame in a worker and return (QR codes, timings); raises PoolBusy if no slot is free"""
+        return self.try_submit(image_bytes, roi).result(timeout=timeout)
+
+    def try_submit(self, image_bytes, roi=None):
+        """Queue a frame if a slot is free and return a Future of (QR codes, timings); raises PoolBusy otherwise"""
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy()
+        return self._submit(image_bytes, roi)
+
+    def submit(self, image_bytes, roi=None):
+        """Queue a frame, waiting for a free slot; returns a Future of (QR codes, timings)"""
+        self._slots.acquire()
+        return self._submit(image_bytes, roi)
+
+    def submit_batch(self, image_bytes, roi=None):
+        """submit() for bulk decoding, waiting for one of the batch_slots too"""
+        self._batch_slots.acquire()
+        try:
+            future = self.submit(image_bytes, roi)
+        except BaseException:
+            self._batch_slots.release()
+            raise
+        future.add_done_callback(lambda f: self._batch_slots.release())
+        return future
+
+    def _submit(self, image_bytes, roi):
+        # Caller holds a slot
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(decode_image_bytes(image_bytes, roi))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+            return future
+
+        try:
+            future = self._get_executor().submit(decode_image_bytes, image_bytes, roi)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the worker finishes, even if this request
+        # has already given up waiting, so the bound covers running work too
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def warm_up(self):
+        """Start the workers and load the decoders now rather than on the first frame"""
+        if self.workers == 0:
+            from qr_decoder import get_detector
+            get_detector()
+            return
+        executor = self._get_executor()
+        for future in [executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,150 @@
+"""
+Streaming data exports for /export/<format>.
+
+Exports are generated row by row from the storage backend and sent as a
+chunked response, so memory use stays flat however long the history is.
+Formats:
+
+* csv    - users, the ATM and terminal balances and the transactions as CSV sections
+* json   - one JSON document with users, balances and the transactions
+* ndjson - one JSON transaction per line
+
+Transactions can be filtered by date range, user, type and terminal, and any
+format can be gzip-compressed on the fly.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+TRANSACTION_FIELDS = ['id', 'name', 'amount', 'date', 'status', 'type', 'terminal']
+
+# Rows are batched into chunks of roughly this many characters
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportFilters:
+    """Transaction filters parsed from the export query string"""
+
+    def __init__(self, username=None, start=None, end=None, kind=None, terminal=None):
+        self.username = username
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.terminal = terminal
+
+    @classmethod
+    def from_args(cls, args):
+        """Build filters from ?user=&type=&terminal=&start=YYYY-MM-DD&end=YYYY-MM-DD; raises ValueError"""
+        start = end = None
+        if args.get('start'):
+            start = datetime.strptime(args['start'], '%Y-%m-%d').strftime('%Y-%m-%d %H:%M:%S')
+        if args.get('end'):
+            # The end date is inclusive
+            end = (datetime.strptime(args['end'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        return cls(username=args.get('user') or None, start=start, end=end, kind=args.get('type') or None,
+                   terminal=args.get('terminal') or None)
+
+    def transactions(self, store):
+        return store.iter_transactions(self.username, start=self.start, end=self.end, kind=self.kind,
+                                       terminal=self.terminal)
+
+    def users(self, store):
+        users = store.list_users()
+        if self.username is not None:
+            users = {self.username: users[self.username]} if self.username in users else {}
+        return users
+
+
+def _chunked(pieces):
+    """Join small strings into CHUNK_SIZE pieces so the server writes fewer, larger chunks"""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _csv_rows(store, filters, export_date):
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def row(values):
+        writer.writerow(values)
+        text = line.getvalue()
+        line.seek(0)
+        line.truncate()
+        return text
+
+    yield row(['Export Date', export_date])
+    yield row([])
+    yield row(['Users Data'])
+    yield row(['Username', 'Role', 'Balance'])
+    for username, data in filters.users(store).items():
+        yield row([username, data['role'], data.get('balance')])
+    yield row([])
+    yield row(['ATM Balance'])
+    yield row([store.get_atm_balance()])
+    yield row([])
+    yield row(['Terminals'])
+    yield row(['Terminal', 'Balance'])
+    for terminal, balance in store.list_terminals().items():
+        yield row([terminal, balance])
+    yield row([])
+    yield row(['Transactions'])
+    yield row(['ID', 'User', 'Amount', 'Date', 'Status', 'Type', 'Terminal'])
+    for t in filters.transactions(store):
+        yield row([t[field] for field in TRANSACTION_FIELDS])
+
+
+def _json_rows(store, filters, export_date):
+    users = {username: {'role': data['role'], 'balance': data.get('balance')}
+             for username, data in filters.users(store).items()}
+    yield '{"export_date": ' + json.dumps(export_date)
+    yield ', "atm_balance": ' + json.dumps(store.get_atm_balance())
+    yield ', "terminals": ' + json.dumps(store.list_terminals())
+    yield ', "users": ' + json.dumps(users)
+    yield ', "atm_history": ['
+    separator = '\n'
+    for transaction in filters.transactions(store):
+        yield separator + json.dumps(transaction)
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+def _ndjson_rows(store, filters, export_date):
+    for transaction in filters.transactions(store):
+        yield json.dumps(transaction) + '\n'
+
+
+ROW_WRITERS = {
+    'csv': _csv_rows,
+    'json': _json_rows,
+    'ndjson': _ndjson_rows
+}
+
+
+def generate_export(store, format, filters, compress=False):
+    """Yield the export as bytes chunks, gzip-compressed if compress is set"""
+    export_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    chunks = (chunk.encode('utf-8') for chunk in _chunked(ROW_WRITERS[format](store, filters, export_date)))
+    if not compress:
+        yield from chunks
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
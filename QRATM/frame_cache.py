@@ -0,0 +1,146 @@
+"""
+Per-session cache of decode results for near-identical camera frames.
+
+While a customer lines up their phone, consecutive frames barely change. Each
+frame gets a 64-bit difference hash (dHash) computed from a tiny grayscale
+thumbnail, plus a sharpness score; if a recent frame of the same session has a
+hash within a few bits and is at least as sharp, its "no QR" result is reused
+and the decoders are skipped.
+
+At 8x9 pixels a QR code is a grey blob, so the hash tells scenes apart but not
+what a code says. Only negative results are cached: a frame is always decoded
+once the session's previous frame found a code, so one customer's payload is
+never served for another's. The sharpness check keeps a cached result from a
+blurry frame, taken while the phone was still moving, from hiding the sharp
+frame that follows.
+
+JPEG frames are thumbnailed with OpenCV's reduced-size decoding, which only
+does a fraction of the work of a full decode. OpenCV is imported on first use.
+
+RegionTracker remembers where each session last saw a QR code so the decoder
+can look there first.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+HASH_SIZE = 8
+
+# A frame sharper than a cached one by more than this factor is decoded again;
+# sensor noise moves the score by well under 1%
+SHARPER = 1.05
+
+# dHash of a frame and the mean gradient of its thumbnail
+FrameDigest = namedtuple('FrameDigest', 'dhash sharpness')
+
+
+def frame_hash(image_bytes):
+    """Return the FrameDigest of an encoded frame, or None if it is not an image"""
+    import cv2
+    import numpy as np
+
+    thumb = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if thumb is None:
+        return None
+    small = cv2.resize(thumb, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    pixels = thumb.astype(np.int16)
+    sharpness = float(np.abs(np.diff(pixels, axis=1)).mean() + np.abs(np.diff(pixels, axis=0)).mean())
+    return FrameDigest(int(np.packbits(bits).view('>u8')[0]), sharpness)
+
+
+class FrameCache:
+    """Bounded LRU/TTL cache of "no QR" decode results keyed by perceptual frame hash"""
+
+    def __init__(self, max_sessions=1024, entries_per_session=8, ttl=1.0, max_distance=2):
+        self.max_sessions = max_sessions
+        self.entries_per_session = entries_per_session
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, digest):
+        """Return (True, result) for a recent similar frame at least as sharp, (False, None) otherwise"""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries:
+                for cached_hash, (result, sharpness, stored_at) in list(entries.items()):
+                    if now - stored_at > self.ttl:
+                        del entries[cached_hash]
+                    elif (bin(cached_hash ^ digest.dhash).count('1') <= self.max_distance
+                          and digest.sharpness <= sharpness * SHARPER):
+                        entries.move_to_end(cached_hash)
+                        self.hits += 1
+                        return True, result
+            self.misses += 1
+            return False, None
+
+    def put(self, session_id, digest, result):
+        """Record a frame's decode result; a found code clears the session so the next frame is decoded"""
+        with self._lock:
+            if result:
+                self._sessions.pop(session_id, None)
+                return
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+            self._sessions.move_to_end(session_id)
+            entries[digest.dhash] = (result, digest.sharpness, time.monotonic())
+            entries.move_to_end(digest.dhash)
+            while len(entries) > self.entries_per_session:
+                entries.popitem(last=False)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _hit_rate(self):
+        # Caller holds _lock
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def hit_rate(self):
+        with self._lock:
+            return self._hit_rate()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self._hit_rate(), 4),
+                'sessions': len(self._sessions)
+            }
+
+
+class RegionTracker:
+    """Remembers where each scan session last saw a QR code"""
+
+    def __init__(self, max_sessions=1024, ttl=2.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._regions.get(session_id)
+            if entry is None:
+                return None
+            bounds, seen_at = entry
+            if time.monotonic() - seen_at > self.ttl:
+                del self._regions[session_id]
+                return None
+            return bounds
+
+    def update(self, session_id, bounds):
+        with self._lock:
+            if bounds is None:
+                self._regions.pop(session_id, None)
+                return
+            self._regions[session_id] = (bounds, time.monotonic())
+            self._regions.move_to_end(session_id)
+            while len(self._regions) > self.max_sessions:
+                self._regions.popitem(last=False)
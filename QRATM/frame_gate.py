@@ -0,0 +1,155 @@
+"""
+Per-session frame admission for the camera scanner.
+
+Each kiosk session may have at most one frame being decoded. A frame that
+arrives while another is in flight waits in a single-slot queue; if an even
+newer frame arrives first, the waiting one is dropped (latest frame wins), so
+the server never spends CPU on frames nobody is waiting for.
+
+The gate also measures decode latency and tells each client the frame rate it
+should send at: no faster than its own frames can be decoded, and no more than
+its fair share of the decode capacity across all active sessions.
+
+admit() blocks the calling thread while a frame waits; asyncio servers use
+admit_async(), which waits on the event loop instead. Both share the same
+per-session state.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+
+class FrameSuperseded(Exception):
+    """A newer frame from the same session replaced this one"""
+
+
+def _set_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _SessionGate:
+    def __init__(self):
+        self.cond = threading.Condition()
+        # (event loop, future) of frames waiting in admit_async()
+        self.waiters = []
+        self.busy = False
+        self.latest = 0
+        self.last_seen = time.monotonic()
+
+
+class FrameGate:
+    """Latest-frame-wins admission with adaptive target frame rates"""
+
+    def __init__(self, capacity=1, min_fps=2.0, max_fps=15.0, wait_timeout=5.0,
+                 active_window=2.0, max_sessions=1024, smoothing=0.2):
+        self.capacity = max(capacity, 1)  # frames the server can decode at once
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.wait_timeout = wait_timeout
+        self.active_window = active_window
+        self.max_sessions = max_sessions
+        self.smoothing = smoothing
+
+        self.latency = 1.0 / max_fps  # moving average of decode time, in seconds
+        self._gates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _gate(self, session_id):
+        with self._lock:
+            gate = self._gates.get(session_id)
+            if gate is None:
+                gate = self._gates[session_id] = _SessionGate()
+                # Forget the least recently used idle sessions
+                for old_id in list(self._gates):
+                    if len(self._gates) <= self.max_sessions:
+                        break
+                    if not self._gates[old_id].busy:
+                        del self._gates[old_id]
+            self._gates.move_to_end(session_id)
+            gate.last_seen = time.monotonic()
+            return gate
+
+    @contextmanager
+    def admit(self, session_id):
+        """Hold the session's decode slot; raises FrameSuperseded if a newer frame arrives first"""
+        gate = self._gate(session_id)
+        with gate.cond:
+            gate.latest += 1
+            ticket = gate.latest
+            # Wake any older waiting frame so it can see it has been replaced
+            self._wake(gate)
+            deadline = time.monotonic() + self.wait_timeout
+            while gate.busy and ticket == gate.latest:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not gate.cond.wait(remaining):
+                    break
+            if gate.busy or ticket != gate.latest:
+                raise FrameSuperseded()
+            gate.busy = True
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(gate, started)
+
+    @asynccontextmanager
+    async def admit_async(self, session_id):
+        """admit() for coroutines: waits without blocking the event loop"""
+        gate = self._gate(session_id)
+        loop = asyncio.get_running_loop()
+        with gate.cond:
+            gate.latest += 1
+            ticket = gate.latest
+            self._wake(gate)
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            with gate.cond:
+                if ticket != gate.latest:
+                    raise FrameSuperseded()
+                if not gate.busy:
+                    gate.busy = True
+                    break
+                waiter = loop.create_future()
+                gate.waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, deadline - loop.time())
+            except asyncio.TimeoutError:
+                raise FrameSuperseded()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(gate, started)
+
+    def _release(self, gate, started):
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.latency += self.smoothing * (elapsed - self.latency)
+        with gate.cond:
+            gate.busy = False
+            self._wake(gate)
+
+    @staticmethod
+    def _wake(gate):
+        # Caller holds gate.cond
+        gate.cond.notify_all()
+        for loop, waiter in gate.waiters:
+            loop.call_soon_threadsafe(_set_done, waiter)
+        gate.waiters.clear()
+
+    def active_sessions(self):
+        cutoff = time.monotonic() - self.active_window
+        with self._lock:
+            return sum(1 for gate in self._gates.values() if gate.last_seen >= cutoff)
+
+    def target_fps(self):
+        """Frame rate each client should send at, given current decode latency and load"""
+        latency = max(self.latency, 1e-3)
+        own_rate = 1.0 / latency
+        fair_share = self.capacity / latency / max(self.active_sessions(), 1)
+        return round(max(self.min_fps, min(self.max_fps, own_rate, fair_share)), 1)
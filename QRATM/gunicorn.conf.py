@@ -0,0 +1,22 @@
+# Gunicorn settings for running QRATM with several worker processes:
+#
+#     pip install gunicorn
+#     gunicorn
+#
+# Run from the QRATM directory. POSIX only; on Windows use python app.py.
+import multiprocessing
+import os
+
+# Every worker serves the same SQLite ledger (see storage.py)
+os.environ.setdefault('QRATM_SHARED_STATE', '1')
+
+# The web workers already use every core, so decode frames inline instead of
+# giving each worker its own decode process pool
+os.environ.setdefault('QRATM_DECODE_WORKERS', '0')
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('QRATM_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('QRATM_WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('QRATM_WEB_THREADS', 4))
+certfile = 'cert.pem'
+keyfile = 'key.pem'
@@ -0,0 +1,158 @@
+"""
+Time-segmented archive of old transactions for the in-memory (JSON) storage
+backend.
+
+Only a recent window of history stays in memory and in the data file. When
+the journal is compacted, transactions from before the window are moved to
+immutable segment files: gzip-compressed tables in the history_table layout,
+split at month boundaries and at SEGMENT_ROWS rows. index.json lists every
+segment with its id and date range and its transaction count per user and
+per terminal, plus the running totals of everything archived, so loading the
+ledger reads the index and no segment.
+
+History pages and exports open segments only when they reach them, skipping
+segments without the requested user, terminal or dates, and keep the last
+few they opened in memory.
+"""
+import copy
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from aggregates import merge_totals, totals_of
+from history_table import TransactionTable, to_date
+from journal import write_atomic
+
+INDEX_FILE = 'index.json'
+
+# Most transactions a segment file holds
+SEGMENT_ROWS = 50000
+
+
+def _segment_bounds(table):
+    """(start, stop) row ranges of table that stay within one month and SEGMENT_ROWS"""
+    start = 0
+    month = None
+    for row, seconds in enumerate(table.times):
+        row_month = to_date(seconds)[:7]
+        if row > start and (row_month != month or row - start >= SEGMENT_ROWS):
+            yield start, row
+            start = row
+        month = row_month
+    if start < len(table):
+        yield start, len(table)
+
+
+class HistoryArchive:
+    """Archived transaction segments in one directory, oldest first"""
+
+    def __init__(self, directory, cache_size=4):
+        self.directory = directory
+        self.cache_size = cache_size
+        # Replaced, never changed in place, so readers can iterate a copy
+        # they looked up without locking
+        self.segments = []
+        self.totals = {}
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(segment['count'] for segment in self.segments)
+
+    @property
+    def last_id(self):
+        return self.segments[-1]['last_id'] if self.segments else 0
+
+    def load(self):
+        """Read the segment index"""
+        self.segments, self.totals = [], {}
+        with self._lock:
+            self._tables.clear()
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            self.segments, self.totals = index['segments'], index['totals']
+
+    def append(self, table):
+        """Write the rows of table, which are newer than every archived row, as new segments"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list(self.segments)
+        totals = copy.deepcopy(self.totals)
+        for start, stop in _segment_bounds(table):
+            segment = table.slice(start, stop)
+            filename = f'{segment.ids[0]:010d}-{segment.ids[-1]:010d}.json.gz'
+            write_atomic(os.path.join(self.directory, filename),
+                         gzip.compress(json.dumps(segment.to_json(), separators=(',', ':')).encode('utf-8')))
+            segment_totals = totals_of(segment.summaries())
+            merge_totals(totals, segment_totals)
+            segments.append({
+                'file': filename,
+                'first_id': segment.ids[0],
+                'last_id': segment.ids[-1],
+                'start': to_date(min(segment.times)),
+                'end': to_date(max(segment.times)),
+                'count': len(segment),
+                'users': {name: values['count'] for name, values in segment_totals['users'].items()},
+                'terminals': {terminal: values['count'] for terminal, values in segment_totals['terminals'].items()}
+            })
+        # Segments only exist for readers once the index names them
+        write_atomic(os.path.join(self.directory, INDEX_FILE),
+                     json.dumps({'segments': segments, 'totals': totals}, separators=(',', ':')))
+        self.segments, self.totals = segments, totals
+
+    def table(self, segment):
+        """The TransactionTable of a segment, read from its file unless recently used"""
+        with self._lock:
+            table = self._tables.get(segment['file'])
+            if table is not None:
+                self._tables.move_to_end(segment['file'])
+                return table
+        with open(os.path.join(self.directory, segment['file']), 'rb') as f:
+            table = TransactionTable.from_json(json.loads(gzip.decompress(f.read())))
+        with self._lock:
+            self._tables[segment['file']] = table
+            while len(self._tables) > self.cache_size:
+                self._tables.popitem(last=False)
+        return table
+
+    def _matching(self, username, terminal):
+        return [segment for segment in self.segments
+                if (username is None or username in segment['users'])
+                and (terminal is None or terminal in segment['terminals'])]
+
+    def iter_transactions(self, username=None, terminal=None, start=None, end=None, before=None):
+        """
+        Yield archived transactions oldest first, of one user and/or terminal,
+        with ids below before; only segments overlapping [start, end) are read
+        """
+        for segment in self._matching(username, terminal):
+            if before is not None and segment['first_id'] >= before:
+                break
+            if (start is not None and segment['end'] < start) or (end is not None and segment['start'] >= end):
+                continue
+            history = self.table(segment).view(username, terminal)
+            stop = len(history) if before is None else history.bisect_id(before)
+            for index in range(stop):
+                yield history[index]
+
+    def page(self, username=None, terminal=None, before=None, limit=20):
+        """
+        Return (transactions, more): up to limit archived transactions with
+        ids below before, newest first, and whether older ones remain
+        """
+        page = []
+        for segment in reversed(self._matching(username, terminal)):
+            if before is not None and segment['first_id'] >= before:
+                continue
+            if len(page) >= limit:
+                return page, True
+            history = self.table(segment).view(username, terminal)
+            end = len(history) if before is None else history.bisect_id(before)
+            start = max(end - (limit - len(page)), 0)
+            page += history[start:end][::-1]
+            if start > 0:
+                return page, True
+        return page, False
@@ -0,0 +1,323 @@
+"""
+Compact transaction history for the in-memory (JSON) storage backend.
+
+Transactions are stored column by column in typed arrays: ids, amounts and
+timestamps (integer seconds) as machine numbers, user names, terminals, types
+and statuses as small integers into interned string tables. Each user's and
+each terminal's history is an array of row numbers into the same table, so no
+transaction is stored twice. The QR timestamp of a withdrawal is a column of
+its own, since nearly every withdrawal has one; any other optional field
+lives in a sparse per-row dict.
+
+Callers still see the usual transaction dicts: HistoryView builds them on
+access, so a page of history costs only the rows on that page. The table is
+saved to the snapshot in the same columnar layout.
+"""
+import bisect
+from array import array
+from functools import lru_cache
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+from ledger import DEFAULT_TERMINAL
+
+# Dates are local wall-clock time; they are stored as seconds since this
+# naive epoch so they convert back to exactly the same string
+EPOCH = datetime(1970, 1, 1)
+
+# Fields every transaction has; anything else but the QR timestamp goes to
+# TransactionTable.extra
+CORE_FIELDS = ('id', 'name', 'amount', 'date', 'status', 'type', 'terminal')
+
+
+def to_seconds(date):
+    return int((datetime.fromisoformat(date) - EPOCH).total_seconds())
+
+
+@lru_cache(maxsize=4096)
+def _day(days):
+    return (EPOCH + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def to_date(seconds):
+    # Formatting the time of day by hand is several times faster than strftime
+    days, second = divmod(seconds, 86400)
+    return f'{_day(days)} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}'
+
+
+def _qr_time(qr_timestamp):
+    """The QR timestamp as stored in the qr_times column, 0 if it does not round-trip through an integer"""
+    if qr_timestamp and qr_timestamp.isdigit() and qr_timestamp[0] != '0' and len(qr_timestamp) < 19:
+        return int(qr_timestamp)
+    return 0
+
+
+def _add_row(index, key, row):
+    rows = index.get(key)
+    if rows is None:
+        rows = index[key] = array('l')
+    rows.append(row)
+
+
+class StringTable:
+    """Interns strings as small integers"""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self._index = {value: number for number, value in enumerate(self.values)}
+
+    def number(self, value):
+        number = self._index.get(value)
+        if number is None:
+            number = self._index[value] = len(self.values)
+            self.values.append(value)
+        return number
+
+    def find(self, value):
+        return self._index.get(value)
+
+
+class TransactionTable:
+    """Append-only columnar table of transactions, kept in id order"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.users = array('l')
+        self.amounts = array('d')
+        self.times = array('q')
+        self.types = array('h')
+        self.statuses = array('h')
+        self.terminals = array('h')
+        # QR timestamp of each row as an integer, 0 for none
+        self.qr_times = array('q')
+        self.names = StringTable()
+        self.kinds = StringTable()
+        self.status_names = StringTable()
+        self.terminal_names = StringTable()
+        # row -> {field: value} for other optional fields
+        self.extra = {}
+        # user number -> array of that user's rows, and the same per terminal
+        self.user_rows = {}
+        self.terminal_rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, transaction):
+        """Add a transaction dict; its id must be above every id in the table"""
+        row = len(self.ids)
+        user = self.names.number(transaction['name'])
+        self.users.append(user)
+        self.amounts.append(transaction['amount'])
+        self.times.append(to_seconds(transaction['date']))
+        self.types.append(self.kinds.number(transaction['type']))
+        self.statuses.append(self.status_names.number(transaction['status']))
+        terminal = self.terminal_names.number(transaction.get('terminal', DEFAULT_TERMINAL))
+        self.terminals.append(terminal)
+        qr_time = _qr_time(transaction.get('qr_timestamp'))
+        self.qr_times.append(qr_time)
+        # The id goes last: len(table) counts complete rows only, so lock-free
+        # readers never see a row whose columns are still being appended
+        self.ids.append(transaction['id'])
+        extra = {key: value for key, value in transaction.items()
+                 if key not in CORE_FIELDS and not (key == 'qr_timestamp' and qr_time)}
+        if extra:
+            self.extra[row] = extra
+        _add_row(self.user_rows, user, row)
+        _add_row(self.terminal_rows, terminal, row)
+        return row
+
+    def get(self, row):
+        """Build the transaction dict for a row"""
+        transaction = {
+            'id': self.ids[row],
+            'name': self.names.values[self.users[row]],
+            'amount': self.amounts[row],
+            'date': to_date(self.times[row]),
+            'status': self.status_names.values[self.statuses[row]],
+            'type': self.kinds.values[self.types[row]],
+            'terminal': self.terminal_names.values[self.terminals[row]]
+        }
+        if self.qr_times[row]:
+            transaction['qr_timestamp'] = str(self.qr_times[row])
+        extra = self.extra.get(row)
+        if extra:
+            transaction.update(extra)
+        return transaction
+
+    def qr_timestamp(self, row):
+        """The QR timestamp of a row, or None"""
+        if self.qr_times[row]:
+            return str(self.qr_times[row])
+        return (self.extra.get(row) or {}).get('qr_timestamp')
+
+    def redemptions(self, start=0, stop=None):
+        """Yield (name, qr_timestamp) for the rows from start to stop that redeemed a QR code"""
+        stop = len(self) if stop is None else stop
+        for row in range(start, stop):
+            qr_timestamp = self.qr_timestamp(row)
+            if qr_timestamp:
+                yield self.names.values[self.users[row]], qr_timestamp
+
+    def summaries(self):
+        """Yield (name, type, amount, date, terminal) for every row without building dicts"""
+        names, kinds, terminals = self.names.values, self.kinds.values, self.terminal_names.values
+        for user, kind, amount, seconds, terminal in zip(self.users, self.types, self.amounts, self.times,
+                                                         self.terminals):
+            yield names[user], kinds[kind], amount, to_date(seconds), terminals[terminal]
+
+    def view(self, username=None, terminal=None):
+        """All transactions, or one user's and/or one terminal's, as a lazy sequence of dicts"""
+        if username is None and terminal is None:
+            return HistoryView(self)
+        if terminal is None:
+            return HistoryView(self, self.user_rows.get(self.names.find(username), array('l')))
+        terminal_rows = self.terminal_rows.get(self.terminal_names.find(terminal), array('l'))
+        if username is None:
+            return HistoryView(self, terminal_rows)
+        # Filter whichever partition is smaller
+        user = self.names.find(username)
+        user_rows = self.user_rows.get(user, array('l'))
+        if len(user_rows) <= len(terminal_rows):
+            number = self.terminal_names.find(terminal)
+            return HistoryView(self, array('l', (row for row in user_rows if self.terminals[row] == number)))
+        return HistoryView(self, array('l', (row for row in terminal_rows if self.users[row] == user)))
+
+    def to_json(self):
+        """Columnar, JSON-serializable copy of the table"""
+        return {
+            'id': self.ids.tolist(),
+            'user': self.users.tolist(),
+            'amount': self.amounts.tolist(),
+            'time': self.times.tolist(),
+            'type': self.types.tolist(),
+            'status': self.statuses.tolist(),
+            'terminal': self.terminals.tolist(),
+            'qr_time': self.qr_times.tolist(),
+            'users': list(self.names.values),
+            'types': list(self.kinds.values),
+            'statuses': list(self.status_names.values),
+            'terminals': list(self.terminal_names.values),
+            'extra': {str(row): dict(extra) for row, extra in self.extra.items()}
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        table = cls()
+        table.ids = array('q', data['id'])
+        table.users = array('l', data['user'])
+        table.amounts = array('d', data['amount'])
+        table.times = array('q', data['time'])
+        table.types = array('h', data['type'])
+        table.statuses = array('h', data['status'])
+        table.names = StringTable(data['users'])
+        table.kinds = StringTable(data['types'])
+        table.status_names = StringTable(data['statuses'])
+        if 'terminal' in data:
+            table.terminals = array('h', data['terminal'])
+            table.terminal_names = StringTable(data['terminals'])
+        else:
+            # Tables saved before terminals existed: everything happened at
+            # the default terminal
+            table.terminal_names = StringTable([DEFAULT_TERMINAL])
+            table.terminals = array('h', bytes(2 * len(table.ids)))
+        table.extra = {int(row): extra for row, extra in data['extra'].items()}
+        if 'qr_time' in data:
+            table.qr_times = array('q', data['qr_time'])
+        else:
+            # Tables saved before the column kept QR timestamps in extra
+            table.qr_times = array('q', bytes(8 * len(table.ids)))
+            for row, extra in list(table.extra.items()):
+                qr_time = _qr_time(extra.get('qr_timestamp'))
+                if qr_time:
+                    table.qr_times[row] = qr_time
+                    del extra['qr_timestamp']
+                    if not extra:
+                        del table.extra[row]
+        table._index_rows()
+        return table
+
+    def _index_rows(self):
+        for row, (user, terminal) in enumerate(zip(self.users, self.terminals)):
+            _add_row(self.user_rows, user, row)
+            _add_row(self.terminal_rows, terminal, row)
+
+    def slice(self, start, stop=None):
+        """A new table holding rows start to stop of this one"""
+        stop = len(self) if stop is None else stop
+        table = TransactionTable()
+        table.ids = self.ids[start:stop]
+        table.users = self.users[start:stop]
+        table.amounts = self.amounts[start:stop]
+        table.times = self.times[start:stop]
+        table.types = self.types[start:stop]
+        table.statuses = self.statuses[start:stop]
+        table.terminals = self.terminals[start:stop]
+        table.qr_times = self.qr_times[start:stop]
+        table.names = StringTable(self.names.values)
+        table.kinds = StringTable(self.kinds.values)
+        table.status_names = StringTable(self.status_names.values)
+        table.terminal_names = StringTable(self.terminal_names.values)
+        # Looked up row by row; rows may be appended to extra meanwhile
+        for row in range(start, stop):
+            extra = self.extra.get(row)
+            if extra:
+                table.extra[row - start] = extra
+        table._index_rows()
+        return table
+
+    def count_before(self, seconds):
+        """
+        Number of leading rows dated before seconds since EPOCH, assuming
+        dates do not go backwards from one row to the next
+        """
+        # Ids and dates are assigned together under the ledger's id lock, so
+        # rows in id order are in date order as long as the wall clock is
+        return bisect.bisect_left(self.times, seconds)
+
+    @classmethod
+    def from_transactions(cls, transactions):
+        """Build a table from transaction dicts (the pre-columnar snapshot format)"""
+        table = cls()
+        for transaction in sorted(transactions, key=lambda t: t['id']):
+            table.append(transaction)
+        return table
+
+
+class HistoryView(Sequence):
+    """Read-only sequence of transaction dicts over some rows of a table"""
+
+    def __init__(self, table, rows=None):
+        self.table = table
+        self.rows = rows
+        # Rows appended after the view was taken are not part of it
+        self._length = len(table) if rows is None else len(rows)
+
+    def __len__(self):
+        return self._length
+
+    def _row(self, index):
+        return index if self.rows is None else self.rows[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.table.get(self._row(i)) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('history index out of range')
+        return self.table.get(self._row(index))
+
+    def id_at(self, index):
+        return self.table.ids[self._row(index)]
+
+    def bisect_id(self, transaction_id):
+        """Index of the first transaction whose id is not below transaction_id"""
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < transaction_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
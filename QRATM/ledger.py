@@ -0,0 +1,170 @@
+"""
+Thread-safe ledger for the in-memory (JSON) storage backend.
+
+The ledger owns account and terminal cash balances and is the only code that
+checks or changes them. Accounts and ATM terminals hash onto fixed sets of
+LOCK_STRIPES locks, and transaction ids come from a monotonic allocator, so
+concurrent requests on different accounts and terminals rarely block each
+other for longer than an id allocation, and two withdrawals can never spend
+the same money or share an id. The locks exist up front: no request, however
+made up its account or terminal name, creates one.
+
+Lock order is always account -> terminal -> id allocator, and stripes of one
+kind are taken in index order. frozen() takes every lock in that order to
+give the snapshot compactor a consistent view.
+"""
+import math
+import threading
+from contextlib import contextmanager, ExitStack
+
+# Locks per kind (accounts, terminals); names share a lock when they hash
+# onto the same stripe
+LOCK_STRIPES = 64
+
+# Terminal that holds the cash of ledgers from before multi-terminal support,
+# and serves requests that do not name a terminal
+DEFAULT_TERMINAL = 'main'
+
+
+class LedgerError(Exception):
+    """Base class for rejected balance changes"""
+
+
+class InvalidAmount(LedgerError):
+    """The amount is not a positive, finite number"""
+
+
+class UnknownUser(LedgerError):
+    """The account does not exist"""
+
+
+class InsufficientBalance(LedgerError):
+    """The user's balance does not cover the withdrawal"""
+
+
+class InsufficientATMBalance(LedgerError):
+    """The ATM does not hold enough cash for the withdrawal"""
+
+
+class QRAlreadyUsed(LedgerError):
+    """The QR code was already redeemed by an earlier withdrawal"""
+
+
+class UnknownTerminal(LedgerError):
+    """The ATM terminal does not exist"""
+
+
+def check_amount(amount):
+    """Raise InvalidAmount unless amount is a positive, finite number"""
+    # NaN fails every comparison, so it must be rejected explicitly
+    if not math.isfinite(amount) or amount <= 0:
+        raise InvalidAmount(amount)
+
+
+class Ledger:
+    """Account and terminal cash balances with per-account and per-terminal locking"""
+
+    def __init__(self, accounts=None, terminals=None, last_id=0):
+        self.accounts = accounts if accounts is not None else {}
+        # terminal id -> cash held by that terminal
+        self.terminals = terminals if terminals is not None else {}
+        self._last_id = last_id
+        self._id_lock = threading.Lock()
+        self._account_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._terminal_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+
+    @property
+    def atm_balance(self):
+        """Cash held across all terminals"""
+        return sum(self.terminals.values())
+
+    def _lock_for(self, name, locks=None):
+        locks = self._account_locks if locks is None else locks
+        return locks[hash(name) % len(locks)]
+
+    @contextmanager
+    def account(self, name):
+        """Hold an account's lock and yield its record; raises UnknownUser"""
+        with self._lock_for(name):
+            account = self.accounts.get(name)
+            if account is None:
+                raise UnknownUser(name)
+            yield account
+
+    @contextmanager
+    def new_account(self, name):
+        """Hold the lock of an account that is being created or replaced"""
+        with self._lock_for(name):
+            yield
+
+    @contextmanager
+    def new_accounts(self, names):
+        """Hold the locks of several accounts being created, in stripe order"""
+        stripes = {hash(name) % len(self._account_locks) for name in names}
+        with ExitStack() as stack:
+            for stripe in sorted(stripes):
+                stack.enter_context(self._account_locks[stripe])
+            yield
+
+    @contextmanager
+    def terminal(self, terminal):
+        """Hold a terminal's lock and yield its cash balance; raises UnknownTerminal"""
+        with self._lock_for(terminal, self._terminal_locks):
+            if terminal not in self.terminals:
+                raise UnknownTerminal(terminal)
+            yield self.terminals[terminal]
+
+    def add_terminal(self, terminal, balance, on_commit):
+        """Create a terminal holding balance; returns False if it already exists"""
+        with self._lock_for(terminal, self._terminal_locks):
+            if terminal in self.terminals:
+                return False
+            on_commit()
+            self.terminals[terminal] = balance
+            return True
+
+    def _commit(self, on_commit):
+        # Ids are allocated and recorded under one short lock, so the history
+        # stays in id order whichever terminals are involved
+        with self._id_lock:
+            self._last_id += 1
+            return on_commit(self._last_id)
+
+    def withdraw(self, name, amount, terminal, on_commit):
+        """
+        Compare-and-set withdrawal from an account and a terminal.
+        on_commit(transaction_id) runs under the id lock once both balances
+        are known to cover the amount; its return value is returned.
+        """
+        check_amount(amount)
+        with self.account(name) as account:
+            balance = account.get('balance', 0)
+            if balance < amount:
+                raise InsufficientBalance(name)
+            with self.terminal(terminal) as cash:
+                if cash < amount:
+                    raise InsufficientATMBalance(name)
+                result = self._commit(on_commit)
+                self.terminals[terminal] = cash - amount
+            # Nobody else can change the account while its lock is held
+            account['balance'] = balance - amount
+            return result
+
+    def deposit(self, name, amount, terminal, on_commit):
+        """Credit an account and a terminal; on_commit works as in withdraw()"""
+        check_amount(amount)
+        with self.account(name) as account:
+            with self.terminal(terminal) as cash:
+                result = self._commit(on_commit)
+                self.terminals[terminal] = cash + amount
+            account['balance'] = account.get('balance', 0) + amount
+            return result
+
+    @contextmanager
+    def frozen(self):
+        """Hold every lock so no balance can change"""
+        with ExitStack() as stack:
+            for lock in self._account_locks + self._terminal_locks:
+                stack.enter_context(lock)
+            stack.enter_context(self._id_lock)
+            yield
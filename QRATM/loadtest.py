@@ -0,0 +1,672 @@
+"""
+End-to-end load test of the withdrawal flow and scaling test of the ledger.
+
+flow: simulated users and kiosks run the whole withdrawal concurrently: log
+in, /generate, fetch the QR image, post camera frames of it to /scan until it
+decodes, /confirm and /process. A share of the QR codes (--replay-rate) is
+presented at a second kiosk at the same moment, so any double spend the
+ledger lets through is counted. Afterwards the new transactions are read back
+from /api/history and checked for duplicate redemptions.
+
+    python loadtest.py flow [--kiosks 8] [--users 50] [--flows 400]
+    python loadtest.py flow --url https://localhost:5000 --insecure
+
+Without --url the app runs in this process behind Flask's test client, on a
+fresh ledger in a temporary directory. With --url a running instance is
+driven over HTTP; create its load test users first, while it is stopped:
+
+    python loadtest.py seed [--users 50]
+
+ledger: builds synthetic ledgers of growing size from the users and
+transaction mix of qratm_data.json and times loading, save_data, is_qr_used,
+/history pages and full /export downloads at each size.
+
+    python loadtest.py ledger [--sizes 1000,10000,100000] [--backend json]
+
+Run it from the QRATM directory. Both modes print a summary and write a JSON
+report (--output, default loadtest_report.json) with latency percentiles,
+throughput and error counts.
+"""
+import argparse
+import base64
+import html
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from bench_decode import PERCENTILES, PROFILES, environment, frame_params, render_frame, summarize
+
+# Load test users are named load0000, load0001, ...
+USER_PREFIX = 'load'
+USER_PASSWORD = 'load123'
+USER_BALANCE = 10_000_000.0
+TERMINAL_PREFIX = 'load-'
+TERMINAL_CASH = 1_000_000_000.0
+
+# Frames posted for one QR code before its scan counts as failed
+MAX_SCAN_ATTEMPTS = 10
+
+QR_IMAGE_PATTERN = re.compile(r'<img src="([^"]+)" alt="Generated QR Code"')
+HIDDEN_INPUT_PATTERN = re.compile(r'<input type="hidden" name="(\w+)" value="([^"]*)">')
+
+
+def location(url):
+    """Path and query of a redirect target"""
+    if not url:
+        return None
+    parts = urllib.parse.urlsplit(url)
+    return parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+class TestClientDriver:
+    """One browser session on the app in this process, through Flask's test client"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, form=None, body=None, content_type=None):
+        """Send a request without following redirects; returns (status, redirect path, body)"""
+        response = self.client.open(path, method=method, data=form if body is None else body,
+                                    content_type=content_type)
+        return response.status_code, location(response.headers.get('Location')), response.get_data()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Redirects are steps of the flow; hand them back as responses
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPDriver:
+    """One browser session on a running instance, with its own cookies"""
+
+    def __init__(self, base_url, verify=True):
+        handlers = [urllib.request.HTTPCookieProcessor(), NoRedirect()]
+        if not verify:
+            # The generated certificate is self-signed
+            handlers.append(urllib.request.HTTPSHandler(context=ssl._create_unverified_context()))
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(*handlers)
+
+    def request(self, method, path, form=None, body=None, content_type=None):
+        """Send a request without following redirects; returns (status, redirect path, body)"""
+        if form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            content_type = 'application/x-www-form-urlencoded'
+        headers = {'Content-Type': content_type} if content_type else {}
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, location(response.headers.get('Location')), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, location(e.headers.get('Location')), e.read()
+
+
+class Recorder:
+    """Latencies per step and event counts, shared by all simulated clients"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.counts = {}
+
+    def record(self, step, seconds):
+        with self.lock:
+            self.seconds.setdefault(step, []).append(seconds)
+
+    def count(self, event, n=1):
+        with self.lock:
+            self.counts[event] = self.counts.get(event, 0) + n
+
+    def request(self, step, driver, method, path, **kwargs):
+        """Send a request through driver and record its latency under step"""
+        started = time.perf_counter()
+        try:
+            return driver.request(method, path, **kwargs)
+        finally:
+            self.record(step, time.perf_counter() - started)
+
+
+def login(recorder, driver, username, password):
+    status, redirect, _ = recorder.request('login', driver, 'POST', '/login',
+                                           form={'username': username, 'password': password})
+    if status != 302 or redirect != '/dashboard':
+        raise SystemExit(f'Could not log in as {username}; run "python loadtest.py seed" against this ledger first')
+
+
+class SimulatedUser:
+    def __init__(self, name, driver):
+        self.name = name
+        self.driver = driver
+        self.lock = threading.Lock()
+        self.last_issued = 0.0
+
+
+class Kiosk:
+    """A kiosk at one terminal, plus a twin session at another for presenting QR codes twice"""
+
+    def __init__(self, terminal, driver, twin_terminal, twin, seed):
+        self.terminal = terminal
+        self.driver = driver
+        self.twin_terminal = twin_terminal
+        self.twin = twin
+        self.rng = random.Random(seed)
+
+
+class FlowTest:
+    """Runs the login -> /generate -> /scan -> /confirm -> /process flow from many kiosks at once"""
+
+    def __init__(self, make_driver, admin=('admin', 'admin123'), amount=100, replay_rate=0.1, profile='clean'):
+        self.make_driver = make_driver
+        self.admin_credentials = admin
+        self.amount = amount
+        self.replay_rate = replay_rate
+        self.profile = profile
+        self.recorder = Recorder()
+        self.users = []
+        self.kiosks = []
+
+    def setup(self, user_count, kiosk_count, terminal_count, seed):
+        admin = self.make_driver()
+        login(self.recorder, admin, *self.admin_credentials)
+        terminals = [f'{TERMINAL_PREFIX}{i}' for i in range(terminal_count)]
+        for terminal in terminals:
+            # Terminals left by an earlier run are reused
+            admin.request('POST', '/terminals', form={'terminal_id': terminal, 'balance': TERMINAL_CASH})
+        self.admin = admin
+
+        for i in range(user_count):
+            driver = self.make_driver()
+            login(self.recorder, driver, f'{USER_PREFIX}{i:04d}', USER_PASSWORD)
+            self.users.append(SimulatedUser(f'{USER_PREFIX}{i:04d}', driver))
+
+        for i in range(kiosk_count):
+            terminal = terminals[i % terminal_count]
+            twin_terminal = terminals[(i + 1) % terminal_count]
+            sessions = []
+            for name in (terminal, twin_terminal):
+                driver = self.make_driver()
+                status, _, _ = self.recorder.request('kiosk_start', driver, 'GET', f'/scan?terminal={name}')
+                if status != 200:
+                    raise SystemExit(f'Could not start a kiosk at terminal {name} (HTTP {status})')
+                sessions.append(driver)
+            self.kiosks.append(Kiosk(terminal, sessions[0], twin_terminal, sessions[1], seed + i))
+
+    def last_transaction_id(self):
+        _, _, body = self.admin.request('GET', '/api/history?limit=1')
+        transactions = json.loads(body)['transactions']
+        return transactions[0]['id'] if transactions else 0
+
+    def generate(self, user, pin):
+        """Generate a QR code as user; returns its PNG or None"""
+        status, _, body = self.recorder.request('generate', user.driver, 'POST', '/generate',
+                                                form={'amount': self.amount, 'pin': pin})
+        match = QR_IMAGE_PATTERN.search(body.decode('utf-8', 'replace'))
+        if status != 200 or not match:
+            return None
+        source = html.unescape(match.group(1))
+        if source.startswith('data:'):
+            # Shared-state mode embeds the image in the page
+            return base64.b64decode(source.split(',', 1)[1])
+        status, _, png = self.recorder.request('qr_image', user.driver, 'GET', source)
+        return png if status == 200 else None
+
+    def camera_frame(self, png, rng):
+        """The frame a kiosk camera posts for a QR code: (bytes, content type)"""
+        if self.profile == 'png':
+            return png, 'image/png'
+        import cv2
+        import numpy as np
+
+        qr = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+        jpeg, _ = render_frame(qr, frame_params(PROFILES[self.profile], rng), rng)
+        return jpeg, 'image/jpeg'
+
+    def scan(self, kiosk, frame, content_type):
+        """Post the frame until it decodes; returns the confirm page path or None"""
+        for _ in range(MAX_SCAN_ATTEMPTS):
+            status, _, body = self.recorder.request('scan', kiosk.driver, 'POST', '/scan',
+                                                    body=frame, content_type=content_type)
+            try:
+                result = json.loads(body)
+            except ValueError:
+                result = {}
+            if result.get('success'):
+                return result['redirect']
+            if not (result.get('busy') or result.get('dropped')):
+                return None
+            # The kiosk was told to back off; send the frame again shortly
+            self.recorder.count('scan_retries')
+            time.sleep(0.05)
+        return None
+
+    def process(self, driver, form):
+        """Submit the confirm form; returns whether the withdrawal went through"""
+        status, redirect, _ = self.recorder.request('process', driver, 'POST', '/process', form=form)
+        return status == 302 and redirect == '/success'
+
+    def present_twice(self, kiosk, form):
+        """Submit the same QR code at two terminals at once; returns how many went through"""
+        twin_form = dict(form, terminal=kiosk.twin_terminal)
+        start = threading.Barrier(2)
+        outcome = []
+
+        def twin():
+            start.wait()
+            outcome.append(self.process(kiosk.twin, twin_form))
+
+        thread = threading.Thread(target=twin)
+        thread.start()
+        start.wait()
+        redeemed = self.process(kiosk.driver, form)
+        thread.join()
+        return redeemed + sum(outcome)
+
+    def run_flow(self, kiosk, user):
+        pin = f'{kiosk.rng.randint(0, 9999):04d}'
+        with user.lock:
+            # Payloads carry their issue time in whole seconds; a user's next
+            # QR code must not share it with the previous one
+            wait = user.last_issued + 1 - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            started = time.perf_counter()
+            png = self.generate(user, pin)
+            user.last_issued = time.time()
+        if png is None:
+            self.recorder.count('generate_failed')
+            return
+
+        frame, content_type = self.camera_frame(png, kiosk.rng)
+        scanned = time.perf_counter()
+        redirect = self.scan(kiosk, frame, content_type)
+        if redirect is None:
+            self.recorder.count('scan_failed')
+            return
+        self.recorder.record('scan_until_decoded', time.perf_counter() - scanned)
+
+        status, _, body = self.recorder.request('confirm', kiosk.driver, 'GET', redirect)
+        form = {name: html.unescape(value) for name, value in HIDDEN_INPUT_PATTERN.findall(body.decode())}
+        # The form carries the pending token, or the QR payload where the
+        # server runs without a token registry
+        if status != 200 or not ('token' in form or 'payload' in form):
+            self.recorder.count('confirm_failed')
+            return
+        form['entered_pin'] = pin
+
+        if kiosk.rng.random() < self.replay_rate:
+            redeemed = self.present_twice(kiosk, form)
+            if redeemed > 1:
+                self.recorder.count('double_spends', redeemed - 1)
+            elif redeemed == 1:
+                self.recorder.count('replays_rejected')
+        else:
+            redeemed = int(self.process(kiosk.driver, form))
+        if not redeemed:
+            self.recorder.count('process_failed')
+            return
+        self.recorder.count('withdrawals', redeemed)
+        self.recorder.count('flows_completed')
+        self.recorder.record('flow', time.perf_counter() - started)
+
+    def run(self, flows):
+        """Run flows withdrawals across all kiosks; returns the elapsed seconds"""
+        counter = itertools.count()
+
+        def kiosk_loop(kiosk):
+            while (n := next(counter)) < flows:
+                try:
+                    self.run_flow(kiosk, self.users[n % len(self.users)])
+                except Exception as e:
+                    self.recorder.count('flow_errors')
+                    print(f'Flow {n} failed: {e!r}', file=sys.stderr)
+
+        threads = [threading.Thread(target=kiosk_loop, args=(kiosk,)) for kiosk in self.kiosks]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def audit(self, since_id):
+        """Read back the transactions after since_id; returns (QR withdrawals, duplicate redemptions)"""
+        redemptions = {}
+        before = None
+        while True:
+            path = '/api/history?limit=100' + (f'&before={before}' if before else '')
+            _, _, body = self.admin.request('GET', path)
+            page = json.loads(body)
+            new = [transaction for transaction in page['transactions'] if transaction['id'] > since_id]
+            for transaction in new:
+                if transaction['type'] == 'ATM' and transaction.get('qr_timestamp'):
+                    key = (transaction['name'], transaction['qr_timestamp'])
+                    redemptions[key] = redemptions.get(key, 0) + 1
+            if len(new) < len(page['transactions']) or page['next_cursor'] is None:
+                break
+            before = page['next_cursor']
+        return sum(redemptions.values()), sum(count - 1 for count in redemptions.values() if count > 1)
+
+
+def seed_users(store, count):
+    """Create the load test users; returns the names that were added"""
+    return store.add_missing_users({
+        f'{USER_PREFIX}{i:04d}': {'password': USER_PASSWORD, 'role': 'user', 'balance': USER_BALANCE}
+        for i in range(count)
+    })
+
+
+def use_ledger(app, directory):
+    """Point the app at the ledger files in directory"""
+    from storage import create_storage
+
+    # The previous ledger's compactor must not outlive it
+    app.store.stop()
+    app.app.config['DATA_FILE'] = os.path.join(directory, 'qratm_data.json')
+    app.app.config['SQLITE_FILE'] = os.path.join(directory, 'qratm_data.db')
+    app.store = create_storage(app.app.config)
+    return app.store
+
+
+def run_flow(args):
+    workdir = None
+    if args.url:
+        def make_driver():
+            return HTTPDriver(args.url, verify=not args.insecure)
+        app = None
+    else:
+        import app
+
+        workdir = tempfile.mkdtemp(prefix='qratm-load-')
+        use_ledger(app, workdir)
+        app.create_app()
+        seed_users(app.store, args.users)
+
+        def make_driver():
+            return TestClientDriver(app.app)
+
+    test = FlowTest(make_driver, admin=(args.admin, args.admin_password), amount=args.amount,
+                    replay_rate=args.replay_rate, profile=args.profile)
+    try:
+        test.setup(args.users, args.kiosks, args.terminals, args.seed)
+        since_id = test.last_transaction_id()
+        elapsed = test.run(args.flows)
+        recorded, duplicates = test.audit(since_id)
+    finally:
+        if app is not None:
+            app.decode_pool.shutdown()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    counts = dict(test.recorder.counts, ledger_withdrawals=recorded, ledger_double_spends=duplicates)
+    return {
+        'mode': 'flow',
+        'settings': {
+            'target': args.url or 'test client',
+            'backend': None if args.url else app.app.config['STORAGE_BACKEND'],
+            'kiosks': args.kiosks,
+            'users': args.users,
+            'terminals': args.terminals,
+            'flows': args.flows,
+            'amount': args.amount,
+            'replay_rate': args.replay_rate,
+            'profile': args.profile,
+            'seed': args.seed
+        },
+        'elapsed_seconds': round(elapsed, 3),
+        'flows': summarize(test.recorder.seconds.get('flow', []), elapsed),
+        'steps': {step: summarize(seconds) for step, seconds in sorted(test.recorder.seconds.items())},
+        'counts': counts
+    }
+
+
+def synthetic_ledger(base_file, size, terminals, rng):
+    """
+    A snapshot with size transactions in the format qratm_data.json had before
+    the columnar history. Users, amounts and transaction types are drawn from
+    base_file; customers are cloned so each has about 100 transactions.
+    """
+    from storage import JSONStorage
+
+    # Load a copy, since loading repairs the journal file in place
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(base_file, directory)
+        base = JSONStorage(os.path.join(directory, os.path.basename(base_file)))
+        base.load()
+        users = {name: dict(data) for name, data in base.list_users().items()}
+        mix = [(transaction['type'], transaction['amount']) for transaction in base.get_history()]
+    users.setdefault('admin', {'password': 'admin123', 'role': 'admin'})
+
+    customers = [name for name, data in users.items() if name and data.get('role') == 'user']
+    for i in range(max(size // 100 - len(customers), 0)):
+        template = customers[i % len(customers)]
+        users[f'{template}_{i}'] = dict(users[template])
+    names = [name for name, data in users.items() if name and data.get('role') == 'user']
+
+    mix = mix or [('ATM', 100.0)]
+    # One transaction a minute, ending now
+    first = int(time.time()) - size * 60
+    transactions = []
+    for i in range(size):
+        kind, amount = rng.choice(mix)
+        issued_at = first + i * 60
+        transaction = {
+            'id': i + 1,
+            'name': rng.choice(names),
+            'amount': amount,
+            'date': datetime.fromtimestamp(issued_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'status': 'Completed',
+            'type': kind,
+            'terminal': rng.choice(terminals)
+        }
+        if kind == 'ATM':
+            transaction['qr_timestamp'] = str(issued_at)
+        transactions.append(transaction)
+    return {
+        'users': users,
+        'terminals': {terminal: TERMINAL_CASH for terminal in terminals},
+        'atm_history': transactions
+    }
+
+
+def measure_ledger(app, size, args, rng):
+    """Build a ledger of size transactions and time the operations that scale with it"""
+    terminals = ['main'] + [f'{TERMINAL_PREFIX}{i}' for i in range(args.terminals - 1)]
+    snapshot = synthetic_ledger(args.base, size, terminals, rng)
+    directory = tempfile.mkdtemp(prefix=f'qratm-ledger-{size}-')
+    try:
+        data_file = os.path.join(directory, 'qratm_data.json')
+        with open(data_file, 'w') as f:
+            json.dump(snapshot, f)
+        if args.backend == 'sqlite':
+            from migrate_to_sqlite import migrate
+            migrate(data_file, os.path.join(directory, 'qratm_data.db'))
+
+        recorder = Recorder()
+        store = use_ledger(app, directory)
+        started = time.perf_counter()
+        store.load()
+        recorder.record('load', time.perf_counter() - started)
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            app.save_data()
+            recorder.record('save_data', time.perf_counter() - started)
+
+        # Redemptions are only indexed for the recent window of history; older
+        # QR codes have long expired. Sample hits from the newest tenth.
+        redeemed = [transaction for transaction in snapshot['atm_history'] if 'qr_timestamp' in transaction]
+        redeemed = redeemed[-max(len(redeemed) // 10, 1):]
+        for transaction in rng.sample(redeemed, min(args.samples, len(redeemed))):
+            started = time.perf_counter()
+            used = app.is_qr_used(transaction['name'], transaction['qr_timestamp'], time.time())
+            recorder.record('is_qr_used_hit', time.perf_counter() - started)
+            if not used:
+                recorder.count('is_qr_used_wrong')
+            started = time.perf_counter()
+            used = app.is_qr_used(transaction['name'], str(time.time()), time.time())
+            recorder.record('is_qr_used_miss', time.perf_counter() - started)
+            if used:
+                recorder.count('is_qr_used_wrong')
+
+        admin = TestClientDriver(app.app)
+        login(recorder, admin, 'admin', snapshot['users']['admin']['password'])
+        user = rng.choice([transaction['name'] for transaction in snapshot['atm_history']])
+        pages = {
+            'history_first_page': '/history',
+            'history_deep_page': f'/history?before={size // 2}',
+            'history_terminal': f'/history?terminal={terminals[-1]}',
+            'api_history_user': f'/api/history?user={urllib.parse.quote(user)}&limit=100',
+            'export_csv': '/export/csv',
+            'export_json': '/export/json'
+        }
+        export_bytes = {}
+        for _ in range(args.repeat):
+            for step, path in pages.items():
+                status, _, body = recorder.request(step, admin, 'GET', path)
+                if status != 200:
+                    recorder.count(f'{step}_errors')
+                if step.startswith('export'):
+                    export_bytes[step] = len(body)
+        return {
+            'transactions': size,
+            'users': len(snapshot['users']),
+            'data_file_bytes': os.path.getsize(data_file),
+            'export_bytes': export_bytes,
+            'operations': {step: summarize(seconds) for step, seconds in recorder.seconds.items()},
+            'counts': recorder.counts
+        }
+    finally:
+        app.store.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_ledger(args):
+    import app
+
+    # Nothing is decoded; keep the imaging stack unloaded. measure_ledger()
+    # loads each ledger itself, so the first request must not load the
+    # default one over it.
+    app.app.config['WARM_UP'] = False
+    app.app.config['LEDGER_LOADED'] = True
+    rng = random.Random(args.seed)
+    sizes = {}
+    for size in args.sizes:
+        started = time.perf_counter()
+        sizes[size] = measure_ledger(app, size, args, rng)
+        print(f'Measured {size} transactions in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    return {
+        'mode': 'ledger',
+        'settings': {
+            'base': args.base,
+            'backend': args.backend,
+            'sizes': args.sizes,
+            'terminals': args.terminals,
+            'samples': args.samples,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'sizes': sizes
+    }
+
+
+def run_seed(args):
+    import app
+
+    app.load_data()
+    added = seed_users(app.store, args.users)
+    app.save_data()
+    print(f'Added {len(added)} load test users ({USER_PREFIX}0000...) with password {USER_PASSWORD}')
+
+
+def print_summary(step, summary, width=22):
+    figures = ' '.join(f"p{p} {summary[f'p{p}_ms']:9.2f}ms" for p in PERCENTILES)
+    print(f"  {step:<{width}} n={summary['count']:<7} {figures}")
+
+
+def print_report(report):
+    if report['mode'] == 'flow':
+        flows = report['flows']
+        print(f"{flows['count']} withdrawals in {report['elapsed_seconds']}s "
+              f"({flows.get('per_second', 0)} flows/s)")
+        print('steps:')
+        for step, summary in report['steps'].items():
+            print_summary(step, summary)
+        print('counts:')
+        for event, count in sorted(report['counts'].items()):
+            print(f'  {event:<22} {count}')
+        return
+    for size, result in report['sizes'].items():
+        print(f"{size} transactions, {result['users']} users, "
+              f"data file {result['data_file_bytes'] / 1024 / 1024:.1f} MB:")
+        for step, summary in result['operations'].items():
+            print_summary(step, summary)
+        for event, count in sorted(result['counts'].items()):
+            print(f'  {event:<22} {count}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the withdrawal flow and the ledger')
+    parser.add_argument('--output', default='loadtest_report.json', help='where to write the JSON report')
+    parser.add_argument('--seed', type=int, default=1)
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    flow = modes.add_parser('flow', help='run the withdrawal flow from many kiosks concurrently')
+    flow.add_argument('--url', help='drive a running instance instead of the app in this process')
+    flow.add_argument('--insecure', action='store_true', help="don't verify the server's TLS certificate")
+    flow.add_argument('--kiosks', type=int, default=8, help='kiosks scanning concurrently')
+    flow.add_argument('--users', type=int, default=50, help='simulated users')
+    flow.add_argument('--terminals', type=int, default=4, help='ATM terminals the kiosks are spread over')
+    flow.add_argument('--flows', type=int, default=400, help='withdrawals to run')
+    flow.add_argument('--amount', type=float, default=100, help='amount of each withdrawal')
+    flow.add_argument('--replay-rate', type=float, default=0.1,
+                      help='share of QR codes presented at two terminals at once')
+    flow.add_argument('--profile', choices=[name for name, ranges in PROFILES.items() if ranges] + ['png'],
+                      default='clean', help='camera frame profile from bench_decode.py, or png for the raw image')
+    flow.add_argument('--admin', default='admin', help='admin user, to add terminals and audit the history')
+    flow.add_argument('--admin-password', default='admin123')
+
+    ledger = modes.add_parser('ledger', help='time ledger operations on synthetic ledgers of growing size')
+    ledger.add_argument('--base', default='qratm_data.json', help='data file the synthetic ledgers are based on')
+    ledger.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1000, 10000, 100000], help='comma-separated transaction counts')
+    ledger.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    ledger.add_argument('--terminals', type=int, default=4)
+    ledger.add_argument('--samples', type=int, default=500, help='is_qr_used lookups per size')
+    ledger.add_argument('--repeat', type=int, default=3, help='times each save, page and export is timed')
+
+    seed = modes.add_parser('seed', help='add the load test users to the ledger in this directory')
+    seed.add_argument('--users', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    # The app logs every save and request; keep the summary readable
+    os.environ.setdefault('QRATM_LOG_LEVEL', 'WARNING')
+    if args.mode == 'seed':
+        run_seed(args)
+        return
+    if args.mode == 'ledger':
+        os.environ['QRATM_STORAGE'] = args.backend
+        report = run_ledger(args)
+    else:
+        report = run_flow(args)
+
+    report['created'] = datetime.now().isoformat(timespec='seconds')
+    report['environment'] = environment()
+    print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Non-blocking, structured logging.
+
+Request threads only put log records on a queue; a QueueListener thread
+formats them and does the I/O, so a slow terminal or disk never adds to scan
+latency. Records are written as one JSON object per line and carry the id of
+the request that produced them (also returned in the X-Request-ID header).
+
+Per-frame messages such as decoder warnings are rate limited: each call site
+may log a few messages per interval and the rest are counted and summarized.
+
+Settings come from the environment:
+
+* QRATM_LOG_LEVEL  - DEBUG, INFO (default), WARNING, ...
+* QRATM_LOG_FORMAT - json (default) or text
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Loggers whose messages fire once per camera frame
+RATE_LIMITED_LOGGERS = ('qr_decoder', 'decode_pool', 'frame_cache')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+
+
+def _current_request_id():
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return '-'
+    if has_request_context():
+        return g.get('request_id', '-')
+    return '-'
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id; runs in the thread that logs"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = _current_request_id()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets each call site log at most burst records per interval seconds"""
+
+    def __init__(self, names=RATE_LIMITED_LOGGERS, burst=5, interval=60.0):
+        super().__init__()
+        self.names = tuple(names)
+        self.burst = burst
+        self.interval = interval
+        # (logger, file, line) -> [window start, records in window, suppressed]
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not record.name.startswith(self.names):
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'process': record.process,
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """Route all logging through a queue and a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+    level = (level or os.environ.get('QRATM_LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.environ.get('QRATM_LOG_FORMAT', 'json')
+
+    output = logging.StreamHandler()
+    output.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    # Filters on the queue handler run in the thread that logs, where the
+    # request context is available
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.addFilter(RateLimitFilter())
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
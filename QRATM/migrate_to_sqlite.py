@@ -0,0 +1,34 @@
+"""
+One-shot migration of an existing qratm_data.json (plus any journal tail) into
+the SQLite storage backend.
+
+Usage:
+    python migrate_to_sqlite.py [--data qratm_data.json] [--db qratm_data.db]
+
+Then start the app with QRATM_STORAGE=sqlite.
+"""
+import argparse
+
+from storage import JSONStorage, SQLiteStorage
+
+
+def migrate(data_file, db_file):
+    """Copy users, terminal balances and the transaction history, archived history included, into SQLite"""
+    source = JSONStorage(data_file)
+    source.load()
+
+    target = SQLiteStorage(db_file)
+    target.load()
+    transactions = source.get_history()
+    target.import_data(source.list_users(), source.list_terminals(), transactions)
+    return len(source.list_users()), len(transactions)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import qratm_data.json into the SQLite backend')
+    parser.add_argument('--data', default='qratm_data.json', help='JSON data file to import')
+    parser.add_argument('--db', default='qratm_data.db', help='SQLite database to create')
+    args = parser.parse_args()
+
+    user_count, transaction_count = migrate(args.data, args.db)
+    print(f"Imported {user_count} users and {transaction_count} transactions into {args.db}")
@@ -0,0 +1,134 @@
+"""
+Tiered QR decoding for camera frames.
+
+Most kiosk frames contain a large, sharp QR code, so decoding the full 1280px
+frame is wasted work. decode_frame() tries the cheapest option first:
+
+1. a downscaled copy of the frame,
+2. a full-resolution crop around the region where the previous frame of the
+   same scan session found a QR code (see frame_cache.RegionTracker),
+3. the full-resolution frame (pyzbar, then OpenCV's detector).
+
+Every result carries the QR bounds in original frame coordinates so the scan
+page can draw its boundary box.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+from pyzbar.pyzbar import decode as zbar_decode, ZBarSymbol
+
+logger = logging.getLogger(__name__)
+
+# Width frames are reduced to for the first decode attempt
+DOWNSCALE_WIDTH = 640
+
+# Extra space kept around the previous QR bounds when cropping, as a fraction
+# of the QR size, so small hand movements stay inside the crop
+ROI_MARGIN = 0.5
+
+DecodedQR = namedtuple('DecodedQR', ['data', 'bounds', 'decoder'])
+
+_local = threading.local()
+
+
+def get_detector():
+    """Return this worker's OpenCV QR detector, creating it on first use"""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = cv2.QRCodeDetector()
+    return detector
+
+
+def _bounds(x, y, width, height, scale=1.0, offset=(0, 0)):
+    return {
+        'x': int(x * scale) + offset[0],
+        'y': int(y * scale) + offset[1],
+        'width': int(width * scale),
+        'height': int(height * scale)
+    }
+
+
+def _decode_zbar(gray, decoder, scale=1.0, offset=(0, 0)):
+    try:
+        found = []
+        for obj in zbar_decode(gray, symbols=[ZBarSymbol.QRCODE]):
+            left, top, width, height = obj.rect
+            found.append(DecodedQR(obj.data.decode('utf-8'),
+                                   _bounds(left, top, width, height, scale, offset),
+                                   decoder))
+        return found
+    except Exception as e:
+        logger.warning(f"Pyzbar QR detection failed: {str(e)}")
+        return []
+
+
+def _decode_opencv(gray):
+    try:
+        retval, decoded_info, points, _ = get_detector().detectAndDecodeMulti(gray)
+        if not retval:
+            return []
+        found = []
+        for data, corners in zip(decoded_info, points):
+            if data:
+                x, y, width, height = cv2.boundingRect(corners.astype('float32'))
+                found.append(DecodedQR(data, _bounds(x, y, width, height), 'opencv'))
+        return found
+    except Exception as e:
+        logger.warning(f"OpenCV QR detection failed: {str(e)}")
+        return []
+
+
+def _crop(gray, roi):
+    """Return the crop around roi (with margin) and its top-left offset"""
+    frame_height, frame_width = gray.shape[:2]
+    margin_x = int(roi['width'] * ROI_MARGIN)
+    margin_y = int(roi['height'] * ROI_MARGIN)
+    x0 = max(roi['x'] - margin_x, 0)
+    y0 = max(roi['y'] - margin_y, 0)
+    x1 = min(roi['x'] + roi['width'] + margin_x, frame_width)
+    y1 = min(roi['y'] + roi['height'] + margin_y, frame_height)
+    if x1 <= x0 or y1 <= y0:
+        return None, None
+    return gray[y0:y1, x0:x1], (x0, y0)
+
+
+def _timed(timings, decoder, attempt):
+    """Run one decode attempt, recording (decoder, seconds, found) if timings is a list"""
+    if timings is None:
+        return attempt()
+    started = time.perf_counter()
+    found = attempt()
+    timings.append((decoder, time.perf_counter() - started, bool(found)))
+    return found
+
+
+def decode_frame(gray, roi=None, timings=None):
+    """Decode QR codes from a grayscale frame, cheapest tier first"""
+    frame_height, frame_width = gray.shape[:2]
+
+    # Tier 1: downscaled frame
+    if frame_width > DOWNSCALE_WIDTH:
+        scale = DOWNSCALE_WIDTH / frame_width
+
+        def downscaled():
+            small = cv2.resize(gray, (DOWNSCALE_WIDTH, int(frame_height * scale)), interpolation=cv2.INTER_AREA)
+            return _decode_zbar(small, 'pyzbar-downscaled', scale=1 / scale)
+
+        found = _timed(timings, 'pyzbar-downscaled', downscaled)
+        if found:
+            return found
+
+    # Tier 2: full-resolution crop around the previous frame's QR code
+    if roi:
+        crop, offset = _crop(gray, roi)
+        if crop is not None:
+            found = _timed(timings, 'pyzbar-roi', lambda: _decode_zbar(crop, 'pyzbar-roi', offset=offset))
+            if found:
+                return found
+
+    # Tier 3: full-resolution frame
+    return (_timed(timings, 'pyzbar', lambda: _decode_zbar(gray, 'pyzbar'))
+            or _timed(timings, 'opencv', lambda: _decode_opencv(gray)))
@@ -0,0 +1,104 @@
+"""
+In-memory storage for generated QR code images.
+
+Generated QR codes are kept in a size-bounded LRU cache keyed by the SHA-256
+of their payload and served straight from memory, so /generate never writes to
+disk. UploadSweeper removes files left in the upload folder (QR images written
+by older versions, abandoned scan uploads) once they are older than the QR
+validity window.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def payload_digest(payload):
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class QRImageCache:
+    """LRU cache of PNG images bounded by total size in bytes"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, payload, png, owner=None):
+        """Store the image for payload and return its digest"""
+        digest = payload_digest(payload)
+        with self._lock:
+            old = self._images.pop(digest, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._images[digest] = (png, owner, time.monotonic())
+            self.size += len(png)
+            while self.size > self.max_bytes and self._images:
+                _, (evicted, _, _) = self._images.popitem(last=False)
+                self.size -= len(evicted)
+        return digest
+
+    def get(self, digest):
+        """Return (png, owner) for a live image, or None"""
+        with self._lock:
+            entry = self._images.get(digest)
+            if entry is None:
+                return None
+            png, owner, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._images[digest]
+                self.size -= len(png)
+                return None
+            self._images.move_to_end(digest)
+            return png, owner
+
+
+class UploadSweeper:
+    """Background thread deleting upload folder files older than max_age seconds"""
+
+    def __init__(self, folder, max_age=300, interval=60):
+        self.folder = folder
+        self.max_age = max_age
+        self.interval = interval
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def sweep(self):
+        """Delete expired files now; returns how many were removed"""
+        cutoff = time.time() - self.max_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove expired upload {entry.path}: {str(e)}")
+        if removed:
+            logger.info(f"Removed {removed} expired files from {self.folder}")
+        return removed
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='upload-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.sweep()
+            self._stopped.wait(self.interval)
@@ -0,0 +1,145 @@
+"""
+Compact signed QR payloads.
+
+A payload is packed into bytes and base45-encoded (RFC 9285), whose alphabet
+is exactly QR's alphanumeric mode, so it is stored at 5.5 bits per character
+instead of 8:
+
+    version      1 byte
+    name length  1 byte, then the UTF-8 user name
+    amount       4 bytes, minor units (paise)
+    issued at    4 bytes, Unix seconds
+    PIN hash     4 bytes, HMAC of name, PIN and issue time
+    signature    8 bytes, HMAC-SHA256 of everything above, truncated
+
+The PIN itself is not in the QR code; the PIN hash lets /process check the PIN
+the customer types. Legacy "name,amount,pin,YYYYmmddHHMMSS" payloads contain a
+comma, which is not in the base45 alphabet, so the two formats never collide.
+"""
+import hashlib
+import hmac
+import struct
+
+VERSION = 1
+
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_BASE45_VALUES = {char: value for value, char in enumerate(BASE45_ALPHABET)}
+
+_FIELDS = struct.Struct('>IIL')  # amount, issued at, PIN hash
+PIN_HASH_SIZE = 4
+SIGNATURE_SIZE = 8
+
+# Largest amount the 4-byte minor-unit field holds
+MAX_AMOUNT = 0xFFFFFFFF // 100
+
+# Marks a PIN field carrying a PIN hash rather than the PIN itself
+PIN_HASH_PREFIX = 'h'
+
+# QR symbol version for generated codes: payloads of user names up to ~20
+# characters fit it at error correction level Q; longer ones fall back to the
+# smallest version that fits
+QR_VERSION = 4
+
+
+class PayloadError(ValueError):
+    """The payload is malformed or its signature does not match"""
+
+
+def b45encode(data):
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] * 256 + data[i + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d], BASE45_ALPHABET[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d])
+    return ''.join(chars)
+
+
+def b45decode(text):
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError:
+        raise PayloadError('not base45')
+    if len(values) % 3 == 1:
+        raise PayloadError('bad base45 length')
+    data = bytearray()
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        if len(chunk) == 3:
+            value = chunk[0] + chunk[1] * 45 + chunk[2] * 45 * 45
+            if value > 0xFFFF:
+                raise PayloadError('bad base45 value')
+            data += bytes(divmod(value, 256))
+        else:
+            value = chunk[0] + chunk[1] * 45
+            if value > 0xFF:
+                raise PayloadError('bad base45 value')
+            data.append(value)
+    return bytes(data)
+
+
+def _mac(key, message, size):
+    return hmac.new(key, message, hashlib.sha256).digest()[:size]
+
+
+def pin_hash(key, name, pin, issued_at):
+    """Keyed hash of a PIN, bound to the user and the QR code it belongs to"""
+    message = b'pin\0' + name.encode('utf-8') + b'\0' + pin.encode('utf-8') + b'\0' + str(issued_at).encode('ascii')
+    return int.from_bytes(_mac(key, message, PIN_HASH_SIZE), 'big')
+
+
+def encode(key, name, amount, pin, issued_at):
+    """Build the signed payload text for a QR code"""
+    name_bytes = name.encode('utf-8')
+    if len(name_bytes) > 255:
+        raise ValueError('user name too long for a QR payload')
+    # Checked in paise too: 0.001 would otherwise encode as a zero amount
+    if not (0 < amount <= MAX_AMOUNT and round(amount * 100) > 0):
+        raise ValueError('amount out of range for a QR payload')
+    body = (bytes((VERSION, len(name_bytes))) + name_bytes
+            + _FIELDS.pack(round(amount * 100), issued_at, pin_hash(key, name, pin, issued_at)))
+    return b45encode(body + _mac(key, body, SIGNATURE_SIZE))
+
+
+def decode(key, text):
+    """Verify a payload and return (name, amount, issued_at, pin_hash); raises PayloadError"""
+    data = b45decode(text)
+    if len(data) < 2 or data[0] != VERSION:
+        raise PayloadError('unknown payload version')
+    name_end = 2 + data[1]
+    if len(data) != name_end + _FIELDS.size + SIGNATURE_SIZE:
+        raise PayloadError('bad payload length')
+    body, signature = data[:-SIGNATURE_SIZE], data[-SIGNATURE_SIZE:]
+    if not hmac.compare_digest(signature, _mac(key, body, SIGNATURE_SIZE)):
+        raise PayloadError('bad signature')
+    try:
+        name = data[2:name_end].decode('utf-8')
+    except UnicodeDecodeError:
+        raise PayloadError('bad user name')
+    minor_units, issued_at, hashed_pin = _FIELDS.unpack_from(data, name_end)
+    return name, minor_units / 100, issued_at, hashed_pin
+
+
+def is_compact(text):
+    """Whether text looks like a compact payload rather than a legacy one"""
+    return ',' not in text
+
+
+def pin_matches(key, pin_field, entered_pin, name, issued_at):
+    """Check an entered PIN against the PIN field carried from scan to /process"""
+    if pin_field.startswith(PIN_HASH_PREFIX):
+        digits = pin_field[len(PIN_HASH_PREFIX):]
+        # Exactly the hex digits of a PIN hash, so a made-up field cannot overflow it
+        if len(digits) != 2 * PIN_HASH_SIZE or not all(digit in '0123456789abcdefABCDEF' for digit in digits):
+            return False
+        try:
+            issued_at = int(issued_at)
+        except ValueError:
+            return False
+        return hmac.compare_digest(pin_hash(key, name, entered_pin, issued_at).to_bytes(PIN_HASH_SIZE, 'big'),
+                                   bytes.fromhex(digits))
+    # Legacy payloads carry the PIN itself
+    return hmac.compare_digest(pin_field.encode('utf-8'), entered_pin.encode('utf-8'))
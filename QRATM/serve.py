@@ -0,0 +1,48 @@
+"""
+Production launcher for the ASGI app (see asgi.py):
+
+    pip install -r requirements.txt
+    python serve.py
+
+Run from the QRATM directory. One process holds every kiosk connection on its
+event loop and decodes frames in the decode pool's worker processes, so the
+default is a single web worker. TLS is terminated by uvicorn with cert.pem and
+key.pem, restricted to TLS 1.2+ with ECDHE AES-GCM/ChaCha20 ciphers; uvloop
+and httptools are used when installed (the [standard] extra). Behind a proxy
+that already terminates TLS set QRATM_TLS=0.
+
+Settings come from the environment:
+
+* QRATM_BIND            - host:port, default 0.0.0.0:5000
+* QRATM_WEB_WORKERS     - uvicorn worker processes, default 1
+* QRATM_MAX_CONNECTIONS - concurrent connections before answering 503, default 1000
+* QRATM_TLS             - 1 (default) or 0
+"""
+import os
+
+import uvicorn
+
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20'
+
+
+def main():
+    host, _, port = os.environ.get('QRATM_BIND', '0.0.0.0:5000').rpartition(':')
+    workers = int(os.environ.get('QRATM_WEB_WORKERS', 1))
+    if workers > 1:
+        # Several processes must share the SQLite ledger, as under gunicorn
+        os.environ.setdefault('QRATM_SHARED_STATE', '1')
+
+    options = {}
+    if os.environ.get('QRATM_TLS', '1') == '1':
+        options.update(ssl_certfile='cert.pem', ssl_keyfile='key.pem', ssl_ciphers=CIPHERS)
+
+    uvicorn.run('asgi:application', host=host, port=int(port), workers=workers,
+                limit_concurrency=int(os.environ.get('QRATM_MAX_CONNECTIONS', 1000)),
+                # Kiosks post a frame every few hundred milliseconds; keep
+                # their connections (and TLS sessions) open between frames
+                timeout_keep_alive=30, timeout_graceful_shutdown=10, proxy_headers=True, log_config=None,
+                **options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,756 @@
+"""
+Storage backends for QRATM.
+
+The app talks to a single storage object instead of module globals. Two
+backends are available:
+
+* JSONStorage   - the default. State lives in memory and is persisted through
+                  the append-only transaction journal plus a JSON snapshot.
+* SQLiteStorage - a WAL-mode SQLite database with transactions indexed by
+                  user, date and id, so history views run indexed queries.
+
+Pick the backend with the QRATM_STORAGE environment variable ('json' or
+'sqlite'); see create_storage().
+
+JSONStorage keeps the ledger in one process's memory. To run several web
+worker processes (gunicorn -w N), enable shared-state mode with
+QRATM_SHARED_STATE=1: every worker then opens the same SQLite database, whose
+file locks serialize writers, and caches users and terminal balances per
+thread until another connection commits.
+
+JSONStorage keeps only the recent window of history in memory and in the data
+file (QRATM_HISTORY_HOT_DAYS, default 30 days); older transactions are moved
+to compressed, indexed segment files that history pages and exports read on
+demand (see history_archive.py). SQLiteStorage keeps history on disk anyway.
+
+Cash is held by ATM terminals, each with its own balance: withdrawals and
+deposits name the terminal they happen at, and every transaction records it.
+Ledgers from before terminals existed load with their ATM balance on the
+default terminal.
+"""
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from aggregates import LedgerAggregates, window_start, CASH_OUT_WINDOW
+from history_archive import HistoryArchive
+from history_table import TransactionTable, to_seconds
+from journal import TransactionJournal, PERSIST_SECONDS
+from ledger import (Ledger, check_amount, UnknownUser, InsufficientBalance, InsufficientATMBalance,
+                    QRAlreadyUsed, UnknownTerminal, DEFAULT_TERMINAL)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ATM_BALANCE = 50000.00
+
+# Days of history JSONStorage keeps in memory by default; older transactions
+# go to the history archive
+HISTORY_HOT_DAYS = 30
+
+# Fewest transactions archived at once, so a quiet ATM does not write a tiny
+# segment every day
+ARCHIVE_MIN_ROWS = 1000
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class JSONStorage:
+    """
+    In-memory state persisted through the transaction journal. Transactions
+    older than hot_days move to the history archive next to the data file
+    when the journal is compacted; hot_days=0 keeps every one in memory.
+    """
+
+    def __init__(self, data_file, hot_days=HISTORY_HOT_DAYS):
+        self.journal = TransactionJournal(data_file)
+        self.ledger = Ledger(terminals={DEFAULT_TERMINAL: DEFAULT_ATM_BALANCE})
+        # Columnar history of the recent window; per-user histories are row
+        # indexes into it
+        self.history = TransactionTable()
+        self.archive = HistoryArchive(os.path.splitext(data_file)[0] + '_archive')
+        self.hot_days = hot_days
+        # (table, rows) archived before the next snapshot drops them
+        self._archived = None
+        # username -> set of redeemed QR timestamps in the recent window, for
+        # O(1) reuse checks; QR codes expire long before they are archived
+        self.redeemed_qr = {}
+        self.aggregates = LedgerAggregates()
+
+    @property
+    def users(self):
+        return self.ledger.accounts
+
+    def load(self):
+        """Load the data file snapshot and replay the journal written after it"""
+        self.archive.load()
+        data, records = self.journal.load()
+        users = data.get('users', {})
+        # Snapshots from before terminals hold a single ATM balance
+        terminals = data.get('terminals') or {DEFAULT_TERMINAL: data.get('atm_balance', DEFAULT_ATM_BALANCE)}
+        if 'history' in data:
+            self.history = TransactionTable.from_json(data['history'])
+        else:
+            # Snapshots written before the columnar table; user_history
+            # only repeats atm_history
+            self.history = TransactionTable.from_transactions(data.get('atm_history', []))
+        self.ledger = Ledger(users, terminals)
+        replayed = []
+        for record in records:
+            self._apply_record(record, replayed)
+        # Records of different accounts may be journaled out of id order
+        for transaction in sorted(replayed, key=lambda transaction: transaction['id']):
+            self.history.append(transaction)
+        # A crash between archiving and the next snapshot leaves archived
+        # transactions in the snapshot or journal too
+        history = self.history.view()
+        archived = history.bisect_id(self.archive.last_id + 1)
+        if archived:
+            self.history = self.history.slice(archived)
+
+        self.redeemed_qr = {}
+        for name, qr_timestamp in self.history.redemptions():
+            self.redeemed_qr.setdefault(name, set()).add(qr_timestamp)
+        history = self.history.view()
+        self.aggregates.rebuild(self.history.summaries(), self.archive.totals)
+        self.ledger = Ledger(self.ledger.accounts, self.ledger.terminals,
+                             last_id=history.id_at(len(history) - 1) if len(history) else self.archive.last_id)
+
+    def _index_redemption(self, transaction):
+        qr_timestamp = transaction.get('qr_timestamp')
+        if qr_timestamp:
+            self.redeemed_qr.setdefault(transaction['name'], set()).add(qr_timestamp)
+
+    def _apply_record(self, record, replayed):
+        """Apply one journal record to the in-memory state, collecting transactions in replayed"""
+        if record['type'] == 'user':
+            self.users[record['username']] = record['data']
+        elif record['type'] == 'users':
+            self.users.update(record['users'])
+        elif record['type'] == 'terminal':
+            self.ledger.terminals[record['terminal']] = record['balance']
+        elif record['type'] == 'transaction':
+            transaction = record['transaction']
+            replayed.append(transaction)
+            self.users[transaction['name']]['balance'] = record['balance']
+            terminal = transaction.get('terminal', DEFAULT_TERMINAL)
+            if 'atm_delta' in record:
+                self.ledger.terminals[terminal] = self.ledger.terminals.get(terminal, 0.0) + record['atm_delta']
+            else:
+                # Journals written before per-account locking store the absolute balance
+                self.ledger.terminals[DEFAULT_TERMINAL] = record['atm_balance']
+
+    def _archive_old(self):
+        """Copy transactions from before the recent window to the archive; the next snapshot drops them"""
+        if not self.hot_days:
+            return
+        table = self.history
+        cutoff = (datetime.now() - timedelta(days=self.hot_days)).strftime('%Y-%m-%d 00:00:00')
+        # count_before() bisects on dates, which follow ids unless the wall
+        # clock stepped back (a DST change, say). The archive still takes a
+        # prefix of ids, so such a step only moves a few rows across the
+        # cutoff early or late; segments record their min and max dates.
+        rows = table.count_before(to_seconds(cutoff))
+        if rows < ARCHIVE_MIN_ROWS:
+            return
+        try:
+            with PERSIST_SECONDS.time(operation='archive'):
+                self.archive.append(table.slice(0, rows))
+        except OSError as e:
+            logger.error(f"Archiving history failed: {str(e)}")
+            return
+        self._archived = (table, rows)
+
+    def _drop_archived(self):
+        # Caller holds _frozen(), so no transaction is being recorded
+        table, rows = self._archived or (None, 0)
+        self._archived = None
+        if table is not self.history:
+            return
+        for name, qr_timestamp in table.redemptions(0, rows):
+            if name in self.redeemed_qr:
+                self.redeemed_qr[name].discard(qr_timestamp)
+                if not self.redeemed_qr[name]:
+                    del self.redeemed_qr[name]
+        self.history = table.slice(rows)
+
+    def _snapshot(self):
+        """Return a shallow copy of the state for the journal compactor; caller holds _frozen()"""
+        self._drop_archived()
+        return {
+            'users': {username: dict(data) for username, data in self.users.items()},
+            'terminals': dict(self.ledger.terminals),
+            'history': self.history.to_json()
+        }
+
+    def _frozen(self):
+        # load() replaces the ledger, so look it up on every compaction
+        return self.ledger.frozen()
+
+    def start(self):
+        """Start the background journal compactor"""
+        self.journal.start(self._snapshot, self._frozen, self._archive_old)
+
+    def stop(self):
+        """Stop the background journal compactor"""
+        self.journal.stop()
+
+    def save(self):
+        """Archive old history, write a full snapshot to the data file and trim the journal"""
+        self.journal.compact(self._snapshot, self._frozen, self._archive_old)
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def list_users(self):
+        return dict(self.users)
+
+    def add_user(self, username, data):
+        with self.ledger.new_account(username):
+            self.users[username] = data
+            self.journal.append({'type': 'user', 'username': username, 'data': data})
+
+    def add_missing_users(self, users):
+        """Add the users that do not exist yet with one journal write; returns their names"""
+        with self.ledger.new_accounts(users):
+            missing = {username: data for username, data in users.items() if username not in self.users}
+            if missing:
+                self.users.update(missing)
+                self.journal.append({'type': 'users', 'users': missing})
+        return list(missing)
+
+    def get_atm_balance(self):
+        """Cash held across all terminals"""
+        return self.ledger.atm_balance
+
+    def list_terminals(self):
+        """terminal id -> cash balance"""
+        return dict(self.ledger.terminals)
+
+    def get_terminal(self, terminal):
+        """A terminal's cash balance, or None if it does not exist"""
+        return self.ledger.terminals.get(terminal)
+
+    def add_terminal(self, terminal, balance):
+        """Create a terminal holding balance; returns False if it already exists"""
+        return self.ledger.add_terminal(terminal, balance, lambda: self.journal.append(
+            {'type': 'terminal', 'terminal': terminal, 'balance': balance}))
+
+    def is_qr_redeemed(self, username, qr_timestamp):
+        return qr_timestamp in self.redeemed_qr.get(username, ())
+
+    def withdraw(self, name, amount, qr_timestamp=None, terminal=DEFAULT_TERMINAL):
+        """Debit a user and a terminal in one step; returns the transaction"""
+        with self.ledger.account(name):
+            if qr_timestamp and self.is_qr_redeemed(name, qr_timestamp):
+                raise QRAlreadyUsed(name)
+            transaction = self.ledger.withdraw(name, amount, terminal, lambda transaction_id: self._record(
+                transaction_id, name, amount, 'ATM', terminal, qr_timestamp))
+            self._commit(transaction, -amount)
+            return transaction
+
+    def deposit(self, name, amount, terminal=DEFAULT_TERMINAL):
+        """Credit a user and a terminal in one step; returns the transaction"""
+        with self.ledger.account(name):
+            transaction = self.ledger.deposit(name, amount, terminal, lambda transaction_id: self._record(
+                transaction_id, name, amount, 'Deposit', terminal))
+            self._commit(transaction, amount)
+            return transaction
+
+    def _record(self, transaction_id, name, amount, kind, terminal, qr_timestamp=None):
+        # Runs under the ledger's id lock, so the history stays in id order
+        transaction = {
+            'id': transaction_id,
+            'name': name,
+            'amount': amount,
+            'date': _now(),
+            'status': 'Completed',
+            'type': kind,
+            'terminal': terminal
+        }
+        if qr_timestamp:
+            transaction['qr_timestamp'] = qr_timestamp
+        self.history.append(transaction)
+        return transaction
+
+    def _commit(self, transaction, delta):
+        # Caller holds the account lock; other accounts keep going meanwhile
+        name = transaction['name']
+        self._index_redemption(transaction)
+        self.aggregates.record(transaction)
+
+        # One fsync'd journal append instead of rewriting the data file. The
+        # terminal's cash change is journaled as a delta because appends of
+        # different accounts are not ordered.
+        self.journal.append({
+            'type': 'transaction',
+            'transaction': transaction,
+            'balance': self.users[name]['balance'],
+            'atm_delta': delta
+        })
+
+    def get_history(self, username=None, terminal=None):
+        """Return all transactions, or one user's and/or terminal's, oldest first, archived ones included"""
+        return list(self.iter_transactions(username, terminal=terminal))
+
+    def recent_transactions(self, username=None, limit=5, terminal=None):
+        return self.history_page(username, limit=limit, terminal=terminal)[0][::-1]
+
+    def _archive_bound(self, table, before):
+        # Archived transactions are older than the recent window's first one;
+        # a table taken just before an archive run may overlap the archive
+        if len(table) and (before is None or table.ids[0] < before):
+            return table.ids[0]
+        return before
+
+    def history_page(self, username=None, before=None, limit=20, terminal=None):
+        """
+        Return (transactions, next_cursor): up to limit transactions with ids
+        below the cursor, newest first. next_cursor is None on the last page.
+        """
+        table = self.history
+        history = table.view(username, terminal)
+        # Histories are kept in id order, so the cursor is found by bisection
+        end = len(history) if before is None else history.bisect_id(before)
+        start = max(end - limit, 0)
+        page = history[start:end][::-1]
+        if start > 0:
+            return page, page[-1]['id']
+        # The rest of the page comes from the archive
+        older, more = self.archive.page(username, terminal, before=self._archive_bound(table, before),
+                                        limit=limit - len(page))
+        page += older
+        return page, (page[-1]['id'] if more and page else None)
+
+    def user_totals(self, username):
+        return self.aggregates.user_totals(username)
+
+    def terminal_totals(self):
+        return self.aggregates.terminal_totals()
+
+    def daily_totals(self, days=7):
+        return self.aggregates.daily_totals(days)
+
+    def cash_out_rate(self):
+        return self.aggregates.cash_out_rate()
+
+    def iter_transactions(self, username=None, start=None, end=None, kind=None, terminal=None):
+        """
+        Yield transactions oldest first, optionally limited to dates in
+        [start, end), one transaction type and one terminal, without copying
+        the history
+        """
+        # Transactions appended while the caller iterates are left out
+        table = self.history
+        history = table.view(username, terminal)
+        archived = self.archive.iter_transactions(username, terminal, start, end,
+                                                  before=self._archive_bound(table, None))
+        for transaction in itertools.chain(archived, history):
+            if start is not None and transaction['date'] < start:
+                continue
+            if end is not None and transaction['date'] >= end:
+                continue
+            if kind is not None and transaction['type'] != kind:
+                continue
+            yield transaction
+
+
+class SQLiteStorage:
+    """WAL-mode SQLite backend with indexed transaction history"""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            balance REAL
+        );
+        CREATE TABLE IF NOT EXISTS terminals (
+            id TEXT PRIMARY KEY,
+            balance REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            amount REAL NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            type TEXT NOT NULL,
+            qr_timestamp TEXT,
+            terminal TEXT NOT NULL DEFAULT 'main'
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_name ON transactions (name, id);
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+        CREATE TABLE IF NOT EXISTS user_totals (
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, type)
+        );
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, type)
+        );
+        CREATE TABLE IF NOT EXISTS terminal_totals (
+            terminal TEXT NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (terminal, type)
+        );
+    '''
+
+    # Rebuild the summary tables from the transactions; run inside a transaction
+    REBUILD_TOTALS = (
+        'DELETE FROM user_totals',
+        'DELETE FROM daily_totals',
+        'DELETE FROM terminal_totals',
+        'INSERT INTO user_totals SELECT name, type, SUM(amount), COUNT(*) FROM transactions GROUP BY name, type',
+        'INSERT INTO daily_totals SELECT substr(date, 1, 10), type, SUM(amount), COUNT(*) FROM transactions '
+        'GROUP BY 1, type',
+        'INSERT INTO terminal_totals SELECT terminal, type, SUM(amount), COUNT(*) FROM transactions '
+        'GROUP BY terminal, type'
+    )
+
+    # Added to a summary table row in _commit
+    ADD_USER_TOTAL = ('INSERT INTO user_totals (name, type, amount, count) VALUES (?, ?, ?, 1) '
+                      'ON CONFLICT (name, type) DO UPDATE SET amount = amount + excluded.amount, count = count + 1')
+    ADD_DAILY_TOTAL = ('INSERT INTO daily_totals (day, type, amount, count) VALUES (?, ?, ?, 1) '
+                       'ON CONFLICT (day, type) DO UPDATE SET amount = amount + excluded.amount, count = count + 1')
+    ADD_TERMINAL_TOTAL = ('INSERT INTO terminal_totals (terminal, type, amount, count) VALUES (?, ?, ?, 1) '
+                          'ON CONFLICT (terminal, type) DO UPDATE SET amount = amount + excluded.amount, '
+                          'count = count + 1')
+
+    # Created after the column migration in load() so older databases work
+    INDEXES = '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_qr
+            ON transactions (name, qr_timestamp) WHERE qr_timestamp IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_transactions_terminal ON transactions (terminal, id);
+    '''
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+
+    def _cache(self):
+        """This thread's cached users and terminal balances, dropped when another connection commits"""
+        local = self._local
+        # data_version changes whenever any other connection, in this or
+        # another process, commits to the database
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if getattr(local, 'version', None) != version:
+            local.version = version
+            local.users = {}
+            local.terminals = None
+        return local
+
+    def _invalidate(self):
+        # Commits on this thread's own connection do not change data_version
+        self._local.version = None
+
+    @property
+    def conn(self):
+        """One connection per thread; transactions are managed explicitly"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, isolation_level=None, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def load(self):
+        """Create the schema if needed"""
+        self.conn.executescript(self.SCHEMA)
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(transactions)')}
+        if 'qr_timestamp' not in columns:
+            self.conn.execute('ALTER TABLE transactions ADD COLUMN qr_timestamp TEXT')
+        if 'terminal' not in columns:
+            # Earlier transactions all happened at the single ATM
+            self.conn.execute('ALTER TABLE transactions ADD COLUMN terminal TEXT NOT NULL '
+                              f"DEFAULT '{DEFAULT_TERMINAL}'")
+        self.conn.executescript(self.INDEXES)
+        self._invalidate()
+
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Databases from before terminals move their ATM balance to the
+            # default terminal once
+            if not conn.execute('SELECT 1 FROM terminals LIMIT 1').fetchone():
+                atm = None
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'atm'").fetchone():
+                    atm = conn.execute('SELECT balance FROM atm WHERE id = 1').fetchone()
+                conn.execute('INSERT INTO terminals (id, balance) VALUES (?, ?)',
+                             (DEFAULT_TERMINAL, atm[0] if atm else DEFAULT_ATM_BALANCE))
+            # Databases created before the summary tables existed get them filled once
+            if (conn.execute('SELECT 1 FROM transactions LIMIT 1').fetchone()
+                    and not (conn.execute('SELECT 1 FROM daily_totals LIMIT 1').fetchone()
+                             and conn.execute('SELECT 1 FROM terminal_totals LIMIT 1').fetchone())):
+                logger.info(f"Building transaction totals for {self.db_file}")
+                self._rebuild_totals(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _rebuild_totals(self, conn):
+        # Caller holds a write transaction
+        for statement in self.REBUILD_TOTALS:
+            conn.execute(statement)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def save(self):
+        """Fold the WAL back into the main database file"""
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    @staticmethod
+    def _user(row):
+        data = {'password': row['password'], 'role': row['role']}
+        if row['balance'] is not None:
+            data['balance'] = row['balance']
+        return data
+
+    def get_user(self, username):
+        cache = self._cache()
+        if username not in cache.users:
+            row = self.conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+            cache.users[username] = self._user(row) if row else None
+        user = cache.users[username]
+        return dict(user) if user is not None else None
+
+    def list_users(self):
+        return {row['username']: self._user(row) for row in self.conn.execute('SELECT * FROM users')}
+
+    def add_user(self, username, data):
+        self.conn.execute('INSERT OR REPLACE INTO users (username, password, role, balance) VALUES (?, ?, ?, ?)',
+                          (username, data['password'], data['role'], data.get('balance')))
+        self._invalidate()
+
+    def add_missing_users(self, users):
+        """Add the users that do not exist yet in one transaction; returns their names"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = {row['username'] for row in conn.execute('SELECT username FROM users')}
+            missing = [username for username in users if username not in existing]
+            conn.executemany('INSERT INTO users (username, password, role, balance) VALUES (?, ?, ?, ?)',
+                             [(username, users[username]['password'], users[username]['role'],
+                               users[username].get('balance')) for username in missing])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._invalidate()
+        return missing
+
+    def list_terminals(self):
+        """terminal id -> cash balance"""
+        cache = self._cache()
+        if cache.terminals is None:
+            cache.terminals = {row['id']: row['balance']
+                               for row in self.conn.execute('SELECT id, balance FROM terminals ORDER BY id')}
+        return dict(cache.terminals)
+
+    def get_terminal(self, terminal):
+        """A terminal's cash balance, or None if it does not exist"""
+        return self.list_terminals().get(terminal)
+
+    def get_atm_balance(self):
+        """Cash held across all terminals"""
+        return sum(self.list_terminals().values())
+
+    def add_terminal(self, terminal, balance):
+        """Create a terminal holding balance; returns False if it already exists"""
+        try:
+            self.conn.execute('INSERT INTO terminals (id, balance) VALUES (?, ?)', (terminal, balance))
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            self._invalidate()
+        return True
+
+    def is_qr_redeemed(self, username, qr_timestamp):
+        row = self.conn.execute('SELECT 1 FROM transactions WHERE name = ? AND qr_timestamp = ?',
+                                (username, qr_timestamp)).fetchone()
+        return row is not None
+
+    def withdraw(self, name, amount, qr_timestamp=None, terminal=DEFAULT_TERMINAL):
+        """Debit a user and a terminal in one database transaction"""
+        return self._commit(name, amount, 'ATM', -amount, terminal, qr_timestamp)
+
+    def deposit(self, name, amount, terminal=DEFAULT_TERMINAL):
+        """Credit a user and a terminal in one database transaction"""
+        return self._commit(name, amount, 'Deposit', amount, terminal)
+
+    def _commit(self, name, amount, kind, delta, terminal, qr_timestamp=None):
+        check_amount(amount)
+        conn = self.conn
+        # BEGIN IMMEDIATE takes the write lock up front so the balance checks
+        # and the updates cannot interleave with another writer
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT balance FROM users WHERE username = ?', (name,)).fetchone()
+            if row is None:
+                raise UnknownUser(name)
+            if qr_timestamp and self.is_qr_redeemed(name, qr_timestamp):
+                raise QRAlreadyUsed(name)
+            cash = conn.execute('SELECT balance FROM terminals WHERE id = ?', (terminal,)).fetchone()
+            if cash is None:
+                raise UnknownTerminal(terminal)
+            if delta < 0:
+                if cash[0] < amount:
+                    raise InsufficientATMBalance(name)
+                if (row['balance'] or 0) < amount:
+                    raise InsufficientBalance(name)
+
+            date = _now()
+            cursor = conn.execute(
+                'INSERT INTO transactions (name, amount, date, status, type, qr_timestamp, terminal) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, amount, date, 'Completed', kind, qr_timestamp, terminal))
+            conn.execute('UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE username = ?', (delta, name))
+            conn.execute('UPDATE terminals SET balance = balance + ? WHERE id = ?', (delta, terminal))
+            conn.execute(self.ADD_USER_TOTAL, (name, kind, amount))
+            conn.execute(self.ADD_DAILY_TOTAL, (date[:10], kind, amount))
+            conn.execute(self.ADD_TERMINAL_TOTAL, (terminal, kind, amount))
+            with PERSIST_SECONDS.time(operation='sqlite_commit'):
+                conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._invalidate()
+
+        transaction = {
+            'id': cursor.lastrowid,
+            'name': name,
+            'amount': amount,
+            'date': date,
+            'status': 'Completed',
+            'type': kind,
+            'terminal': terminal
+        }
+        if qr_timestamp:
+            transaction['qr_timestamp'] = qr_timestamp
+        return transaction
+
+    @staticmethod
+    def _transaction(row):
+        transaction = dict(row)
+        if transaction['qr_timestamp'] is None:
+            del transaction['qr_timestamp']
+        return transaction
+
+    def get_history(self, username=None, terminal=None):
+        return list(self.iter_transactions(username, terminal=terminal))
+
+    @staticmethod
+    def _where(*conditions):
+        """WHERE clause and parameters for the (clause, value) pairs whose value is not None"""
+        clauses = [clause for clause, value in conditions if value is not None]
+        params = [value for _, value in conditions if value is not None]
+        return (f"WHERE {' AND '.join(clauses)} " if clauses else ''), params
+
+    def recent_transactions(self, username=None, limit=5, terminal=None):
+        where, params = self._where(('name = ?', username), ('terminal = ?', terminal))
+        rows = self.conn.execute(f'SELECT * FROM transactions {where}ORDER BY id DESC LIMIT ?', params + [limit])
+        return [self._transaction(row) for row in reversed(rows.fetchall())]
+
+    def history_page(self, username=None, before=None, limit=20, terminal=None):
+        """Keyset-paginated history, newest first; see JSONStorage.history_page"""
+        where, params = self._where(('name = ?', username), ('terminal = ?', terminal), ('id < ?', before))
+        # One extra row tells whether another page follows
+        rows = self.conn.execute(f'SELECT * FROM transactions {where}ORDER BY id DESC LIMIT ?',
+                                 params + [limit + 1]).fetchall()
+        page = [self._transaction(row) for row in rows[:limit]]
+        return page, (page[-1]['id'] if len(rows) > limit else None)
+
+    @staticmethod
+    def _totals(rows):
+        totals = {'withdrawn': 0.0, 'deposited': 0.0, 'count': 0}
+        for row in rows:
+            totals['deposited' if row['type'] == 'Deposit' else 'withdrawn'] += row['amount']
+            totals['count'] += row['count']
+        return totals
+
+    def user_totals(self, username):
+        return self._totals(self.conn.execute('SELECT type, amount, count FROM user_totals WHERE name = ?',
+                                              (username,)))
+
+    def terminal_totals(self):
+        rows = self.conn.execute('SELECT * FROM terminal_totals ORDER BY terminal').fetchall()
+        return {terminal: self._totals(row for row in rows if row['terminal'] == terminal)
+                for terminal in dict.fromkeys(row['terminal'] for row in rows)}
+
+    def daily_totals(self, days=7):
+        rows = self.conn.execute('SELECT * FROM daily_totals WHERE day IN '
+                                 '(SELECT DISTINCT day FROM daily_totals ORDER BY day DESC LIMIT ?) '
+                                 'ORDER BY day DESC', (days,)).fetchall()
+        return [dict(self._totals(row for row in rows if row['day'] == day), day=day)
+                for day in dict.fromkeys(row['day'] for row in rows)]
+
+    def cash_out_rate(self):
+        """Amount withdrawn per hour over the trailing window"""
+        total = self.conn.execute("SELECT COALESCE(SUM(amount), 0) FROM transactions "
+                                  "WHERE date >= ? AND type != 'Deposit'", (window_start(),)).fetchone()[0]
+        return total * 3600 / CASH_OUT_WINDOW
+
+    def iter_transactions(self, username=None, start=None, end=None, kind=None, terminal=None):
+        """Yield transactions oldest first, filtered like JSONStorage.iter_transactions"""
+        where, params = self._where(('name = ?', username), ('date >= ?', start), ('date < ?', end),
+                                    ('type = ?', kind), ('terminal = ?', terminal))
+        # Rows are fetched from the cursor as the caller iterates
+        for row in self.conn.execute(f'SELECT * FROM transactions {where}ORDER BY id', params):
+            yield self._transaction(row)
+
+    def import_data(self, users, terminals, transactions):
+        """Bulk-load users, terminal balances and transaction history in one transaction"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]:
+                raise ValueError(f"{self.db_file} already contains transactions")
+            conn.executemany('INSERT OR REPLACE INTO users (username, password, role, balance) VALUES (?, ?, ?, ?)',
+                             [(username, data['password'], data['role'], data.get('balance'))
+                              for username, data in users.items()])
+            conn.execute('DELETE FROM terminals')
+            conn.executemany('INSERT INTO terminals (id, balance) VALUES (?, ?)', list(terminals.items()))
+            conn.executemany('INSERT INTO transactions (id, name, amount, date, status, type, qr_timestamp, terminal) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             [(t['id'], t['name'], t['amount'], t['date'], t['status'], t['type'],
+                               t.get('qr_timestamp'), t.get('terminal', DEFAULT_TERMINAL)) for t in transactions])
+            self._rebuild_totals(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._invalidate()
+
+
+def create_storage(config):
+    """Build the storage backend selected by config['STORAGE_BACKEND']"""
+    backend = config.get('STORAGE_BACKEND', 'json')
+    if backend == 'json':
+        if config.get('SHARED_STATE'):
+            raise ValueError("Shared-state mode needs the sqlite backend; the json ledger lives in one process")
+        return JSONStorage(config['DATA_FILE'], hot_days=config.get('HISTORY_HOT_DAYS', HISTORY_HOT_DAYS))
+    if backend == 'sqlite':
+        return SQLiteStorage(config['SQLITE_FILE'])
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,87 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import export
+from export import ExportFilters, generate_export
+from history_table import TransactionTable
+from storage import JSONStorage
+
+
+def transactions():
+    rows = [('alice', 'withdrawal', 'main', '2024-01-30 09:00:00'),
+            ('bob', 'deposit', 'lobby', '2024-01-31 23:59:59'),
+            ('alice', 'deposit', 'lobby', '2024-02-01 00:00:00'),
+            ('alice', 'withdrawal', 'lobby', '2024-02-02 10:30:00')]
+    return [{'id': i, 'name': name, 'amount': 10.0 * i, 'date': date, 'status': 'completed',
+             'type': kind, 'terminal': terminal} for i, (name, kind, terminal, date) in enumerate(rows, 1)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    data_file = tmp_path / 'qratm_data.json'
+    data_file.write_text(json.dumps({
+        'users': {'alice': {'pin': '1234', 'balance': 1000.0, 'role': 'user'},
+                  'bob': {'pin': '4321', 'balance': 500.0, 'role': 'user'}},
+        'terminals': {'main': 50000.0, 'lobby': 20000.0},
+        'history': TransactionTable.from_transactions(transactions()).to_json()
+    }))
+    store = JSONStorage(str(data_file), hot_days=0)
+    store.load()
+    return store
+
+
+def export_text(store, format, compress=False, **args):
+    data = b''.join(generate_export(store, format, ExportFilters.from_args(args), compress))
+    return (gzip.decompress(data) if compress else data).decode('utf-8')
+
+
+def ndjson_ids(store, **args):
+    return [json.loads(line)['id'] for line in export_text(store, 'ndjson', **args).splitlines()]
+
+
+def test_ndjson_has_one_transaction_per_line(store):
+    lines = export_text(store, 'ndjson').splitlines()
+    assert [json.loads(line) for line in lines] == transactions()
+
+
+def test_filters(store):
+    assert ndjson_ids(store, user='alice') == [1, 3, 4]
+    assert ndjson_ids(store, type='deposit') == [2, 3]
+    assert ndjson_ids(store, terminal='lobby', user='alice') == [3, 4]
+    # Both ends of the date range are inclusive days
+    assert ndjson_ids(store, start='2024-01-31', end='2024-02-01') == [2, 3]
+    assert ndjson_ids(store, user='carol') == []
+
+
+def test_bad_dates_are_rejected():
+    with pytest.raises(ValueError):
+        ExportFilters.from_args({'start': '31/01/2024'})
+
+
+def test_json_document(store):
+    document = json.loads(export_text(store, 'json', user='bob'))
+    assert document['users'] == {'bob': {'role': 'user', 'balance': 500.0}}
+    assert document['terminals'] == {'main': 50000.0, 'lobby': 20000.0}
+    assert document['atm_history'] == [transactions()[1]]
+
+
+def test_csv_sections(store):
+    rows = list(csv.reader(io.StringIO(export_text(store, 'csv', type='withdrawal'))))
+    assert ['alice', 'user', '1000.0'] in rows
+    assert ['lobby', '20000.0'] in rows
+    header = rows.index(['ID', 'User', 'Amount', 'Date', 'Status', 'Type', 'Terminal'])
+    assert [row[0] for row in rows[header + 1:]] == ['1', '4']
+
+
+def test_gzip_matches_plain_export(store, monkeypatch):
+    # Small chunks so the compressor sees several of them
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 64)
+    for format in export.FORMATS:
+        plain = export_text(store, format).splitlines()
+        compressed = export_text(store, format, compress=True).splitlines()
+        # Only the export date may differ between the two runs
+        assert compressed[1:] == plain[1:]
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from frame_cache import FrameCache, FrameDigest, frame_hash
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+qrcode = pytest.importorskip('qrcode')
+
+def camera_frame(data, blur=0, seed=0):
+    """A 1280x720 JPEG frame with a QR code at a fixed position"""
+    qr = qrcode.QRCode(version=3, box_size=4, border=4)
+    qr.add_data(data)
+    code = np.array(qr.make_image().convert('L'), np.uint8)
+    frame = np.full((720, 1280), 140, np.uint8)
+    frame[300:300 + code.shape[0], 560:560 + code.shape[1]] = code
+    if blur:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    noise = np.random.default_rng(seed).normal(0, 2, frame.shape)
+    frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def decode(image_bytes):
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    data, _, _ = cv2.QRCodeDetector().detectAndDecode(image)
+    return [data] if data else []
+
+
+def scan(cache, session_id, image_bytes):
+    """The /scan flow: reuse a cached result or decode and record it"""
+    digest = frame_hash(image_bytes)
+    hit, found = cache.get(session_id, digest)
+    if not hit:
+        found = decode(image_bytes)
+        cache.put(session_id, digest, found)
+    return found
+
+
+def test_different_codes_in_the_same_layout_are_decoded_apart():
+    first = camera_frame('CUSTOMER-ONE-PAYLOAD', seed=1)
+    second = camera_frame('CUSTOMER-TWO-PAYLOAD', seed=2)
+    cache = FrameCache()
+    # At hash size the two frames look alike
+    assert bin(frame_hash(first).dhash ^ frame_hash(second).dhash).count('1') <= cache.max_distance
+
+    assert scan(cache, 'kiosk', first) == ['CUSTOMER-ONE-PAYLOAD']
+    assert scan(cache, 'kiosk', second) == ['CUSTOMER-TWO-PAYLOAD']
+    assert cache.hits == 0
+
+
+def test_sharper_frame_is_decoded_after_a_blurry_miss():
+    cache = FrameCache()
+    blurry = camera_frame('CUSTOMER-ONE-PAYLOAD', blur=4, seed=1)
+    sharp = camera_frame('CUSTOMER-ONE-PAYLOAD', seed=2)
+    assert scan(cache, 'kiosk', blurry) == []
+    assert scan(cache, 'kiosk', sharp) == ['CUSTOMER-ONE-PAYLOAD']
+
+
+def test_similar_empty_frames_hit():
+    cache = FrameCache()
+    empty = np.full((720, 1280), 140, np.uint8)
+    frames = [cv2.imencode('.jpg', np.clip(empty + np.random.default_rng(seed).normal(0, 2, empty.shape), 0, 255)
+                           .astype(np.uint8))[1].tobytes() for seed in range(3)]
+    for image_bytes in frames:
+        assert scan(cache, 'kiosk', image_bytes) == []
+    assert cache.hits == 2
+    assert cache.stats()['hit_rate'] == pytest.approx(2 / 3, abs=1e-4)
+
+
+def test_found_codes_are_not_cached():
+    cache = FrameCache()
+    digest = FrameDigest(0b1011, 5.0)
+    cache.put('kiosk', digest, [])
+    cache.put('kiosk', digest, ['PAYLOAD'])
+    assert cache.get('kiosk', digest) == (False, None)
+
+
+def test_hit_rate_is_consistent_under_concurrency():
+    cache = FrameCache()
+    digest = FrameDigest(0, 1.0)
+    cache.put('kiosk', digest, [])
+
+    def worker():
+        for _ in range(2000):
+            cache.get('kiosk', digest)
+            cache.get('other', digest)
+            assert 0.0 <= cache.hit_rate() <= 1.0
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.hits == cache.misses == 8000
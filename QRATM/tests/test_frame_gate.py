@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from frame_gate import FrameGate, FrameSuperseded
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_latest_waiting_frame_wins():
+    gate = FrameGate()
+    release = threading.Event()
+    outcomes = {}
+
+    def frame(name):
+        try:
+            with gate.admit('kiosk'):
+                outcomes[name] = 'decoded'
+                if name == 'first':
+                    release.wait(5)
+        except FrameSuperseded:
+            outcomes[name] = 'dropped'
+
+    first = threading.Thread(target=frame, args=('first',))
+    first.start()
+    wait_for(lambda: 'first' in outcomes)
+    second = threading.Thread(target=frame, args=('second',))
+    second.start()
+    wait_for(lambda: gate._gates['kiosk'].latest == 2)
+    third = threading.Thread(target=frame, args=('third',))
+    third.start()
+    # The newer frame replaces the waiting one while the first still decodes
+    second.join(5)
+    assert outcomes == {'first': 'decoded', 'second': 'dropped'}
+
+    release.set()
+    first.join(5)
+    third.join(5)
+    assert outcomes == {'first': 'decoded', 'second': 'dropped', 'third': 'decoded'}
+
+
+def test_sessions_do_not_block_each_other():
+    gate = FrameGate(wait_timeout=0.1)
+    with gate.admit('kiosk-1'):
+        with gate.admit('kiosk-2'):
+            pass
+        # A frame of the same session times out instead
+        with pytest.raises(FrameSuperseded):
+            with gate.admit('kiosk-1'):
+                pass
+
+
+def test_latest_waiting_frame_wins_async():
+    gate = FrameGate()
+
+    async def frame(outcomes, name, release=None):
+        try:
+            async with gate.admit_async('kiosk'):
+                outcomes.append((name, 'decoded'))
+                if release is not None:
+                    await release.wait()
+        except FrameSuperseded:
+            outcomes.append((name, 'dropped'))
+
+    async def main():
+        outcomes = []
+        release = asyncio.Event()
+        first = asyncio.create_task(frame(outcomes, 'first', release))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(frame(outcomes, 'second'))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(frame(outcomes, 'third'))
+        await asyncio.wait_for(second, 5)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(first, third), 5)
+        return outcomes
+
+    assert asyncio.run(main()) == [('first', 'decoded'), ('second', 'dropped'), ('third', 'decoded')]
+
+
+def test_target_fps_follows_latency():
+    gate = FrameGate(capacity=4, min_fps=2.0, max_fps=15.0)
+    # Fast decodes are capped at max_fps
+    gate.latency = 0.01
+    gate._gate('kiosk-1')
+    assert gate.target_fps() == 15.0
+    # A session cannot send faster than its own frames decode
+    gate.latency = 0.2
+    assert gate.target_fps() == 5.0
+    # Decode capacity is shared between the active sessions
+    for i in range(2, 9):
+        gate._gate(f'kiosk-{i}')
+    assert gate.target_fps() == 2.5
+    # but never drops below min_fps
+    gate.latency = 1.0
+    assert gate.target_fps() == 2.0
+
+
+def test_idle_sessions_stop_counting():
+    gate = FrameGate(capacity=1, active_window=0.05)
+    gate.latency = 0.1
+    gate._gate('kiosk-1')
+    gate._gate('kiosk-2')
+    assert gate.target_fps() == 5.0
+    time.sleep(0.1)
+    gate._gate('kiosk-1')
+    assert gate.active_sessions() == 1
+    assert gate.target_fps() == 10.0
+
+
+def test_latency_is_a_moving_average():
+    gate = FrameGate(smoothing=0.5)
+    gate.latency = 0.0
+    with gate.admit('kiosk'):
+        time.sleep(0.1)
+    assert 0.05 <= gate.latency < 0.1
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import storage as storage_module
+from history_table import TransactionTable
+from storage import JSONStorage
+
+
+def old_transactions(count):
+    # Dated years before the recent window, across a month boundary
+    return [{'id': i, 'name': 'alice' if i % 2 else 'bob', 'amount': float(i),
+             'date': f'2020-0{1 + i // 20}-{1 + i % 20:02d} 12:00:00', 'status': 'completed',
+             'type': 'deposit', 'terminal': 'main'} for i in range(1, count + 1)]
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_module, 'ARCHIVE_MIN_ROWS', 1)
+    data_file = tmp_path / 'qratm_data.json'
+    data_file.write_text(json.dumps({
+        'users': {'alice': {'pin': '1234', 'balance': 1000.0, 'role': 'user'},
+                  'bob': {'pin': '4321', 'balance': 500.0, 'role': 'user'}},
+        'terminals': {'main': 50000.0},
+        'history': TransactionTable.from_transactions(old_transactions(30)).to_json()
+    }))
+    storage = JSONStorage(str(data_file), hot_days=1)
+    storage.load()
+    for _ in range(5):
+        storage.deposit('alice', 1.0)
+    storage.save()
+    yield storage
+    storage.stop()
+
+
+def pages(storage, username=None, limit=4):
+    ids, cursor = [], None
+    while True:
+        page, cursor = storage.history_page(username, before=cursor, limit=limit)
+        ids.append([t['id'] for t in page])
+        if cursor is None:
+            return ids
+
+
+def test_old_transactions_are_archived(storage):
+    assert len(storage.archive) == 30
+    assert len(storage.archive.segments) == 2
+    assert [t['id'] for t in storage.history.view()] == list(range(31, 36))
+
+
+def test_pages_span_live_and_archived_rows(storage):
+    ids = pages(storage)
+    assert sum(ids, []) == list(range(35, 0, -1))
+    # The second page starts in memory and ends in the archive
+    assert ids[1] == [31, 30, 29, 28]
+
+
+def test_user_pages_span_live_and_archived_rows(storage):
+    ids = pages(storage, 'alice', limit=7)
+    assert ids[0] == [35, 34, 33, 32, 31, 29, 27]
+    assert sum(ids, []) == list(range(35, 30, -1)) + list(range(29, 0, -2))
+
+
+def test_archive_survives_reload(storage, tmp_path):
+    reloaded = JSONStorage(str(tmp_path / 'qratm_data.json'), hot_days=1)
+    reloaded.load()
+    assert sum(pages(reloaded), []) == list(range(35, 0, -1))
+    assert reloaded.get_history('bob') == [t for t in old_transactions(30) if t['name'] == 'bob']
+    assert reloaded.deposit('bob', 1.0)['id'] == 36
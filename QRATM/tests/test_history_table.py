@@ -0,0 +1,72 @@
+import json
+
+from history_table import TransactionTable, to_seconds
+from ledger import DEFAULT_TERMINAL
+
+
+def transactions():
+    return [
+        {'id': 1, 'name': 'alice', 'amount': 10.0, 'date': '2024-01-31 23:59:59', 'status': 'completed',
+         'type': 'withdrawal', 'terminal': 'lobby', 'qr_timestamp': '20240131235900'},
+        {'id': 2, 'name': 'bob', 'amount': 25.5, 'date': '2024-02-01 00:00:00', 'status': 'completed',
+         'type': 'deposit', 'terminal': DEFAULT_TERMINAL},
+        # A QR timestamp that does not round-trip through an integer stays in extra
+        {'id': 5, 'name': 'alice', 'amount': 7.25, 'date': '2024-02-01 08:30:00', 'status': 'completed',
+         'type': 'withdrawal', 'terminal': DEFAULT_TERMINAL, 'qr_timestamp': '0123', 'note': 'x'},
+    ]
+
+
+def test_rows_round_trip():
+    table = TransactionTable.from_transactions(transactions())
+    assert list(table.view()) == transactions()
+    assert table.qr_timestamp(0) == '20240131235900'
+    assert table.qr_timestamp(1) is None
+    assert table.qr_timestamp(2) == '0123'
+    assert list(table.redemptions()) == [('alice', '20240131235900'), ('alice', '0123')]
+
+
+def test_to_json_round_trip():
+    table = TransactionTable.from_transactions(transactions())
+    loaded = TransactionTable.from_json(json.loads(json.dumps(table.to_json())))
+    assert list(loaded.view()) == transactions()
+    assert [t['id'] for t in loaded.view('alice')] == [1, 5]
+    assert [t['id'] for t in loaded.view(terminal='lobby')] == [1]
+    assert [t['id'] for t in loaded.view('alice', DEFAULT_TERMINAL)] == [5]
+    # Appending continues the loaded indexes
+    loaded.append(dict(transactions()[0], id=6))
+    assert [t['id'] for t in loaded.view('alice')] == [1, 5, 6]
+
+
+def test_from_json_migrates_old_snapshots():
+    # Saved before the terminal and qr_time columns: QR timestamps in extra,
+    # every transaction at the default terminal
+    data = TransactionTable.from_transactions(transactions()).to_json()
+    for column in ('terminal', 'terminals', 'qr_time'):
+        del data[column]
+    data['extra'] = {'0': {'qr_timestamp': '20240131235900'}, '2': {'qr_timestamp': '0123', 'note': 'x'}}
+
+    table = TransactionTable.from_json(data)
+    expected = [dict(t, terminal=DEFAULT_TERMINAL) for t in transactions()]
+    assert list(table.view()) == expected
+    assert table.extra == {2: {'qr_timestamp': '0123', 'note': 'x'}}
+    assert list(table.view(terminal=DEFAULT_TERMINAL)) == expected
+
+
+def test_slice():
+    table = TransactionTable.from_transactions(transactions())
+    tail = table.slice(1)
+    assert list(tail.view()) == transactions()[1:]
+    assert [t['id'] for t in tail.view('alice')] == [5]
+    assert list(table.slice(0, 1).view()) == transactions()[:1]
+
+
+def test_count_before():
+    table = TransactionTable.from_transactions(transactions())
+    assert table.count_before(to_seconds('2024-01-01 00:00:00')) == 0
+    assert table.count_before(to_seconds('2024-02-01 00:00:00')) == 1
+    assert table.count_before(to_seconds('2024-02-02 00:00:00')) == 3
+
+
+def test_bisect_id():
+    view = TransactionTable.from_transactions(transactions()).view()
+    assert [view.bisect_id(i) for i in (0, 1, 2, 3, 5, 6)] == [0, 0, 1, 2, 2, 3]
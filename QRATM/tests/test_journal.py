@@ -0,0 +1,104 @@
+import json
+import shutil
+
+import pytest
+
+from journal import TransactionJournal
+from storage import JSONStorage
+
+
+def open_storage(tmp_path):
+    storage = JSONStorage(str(tmp_path / 'qratm_data.json'), hot_days=0)
+    storage.load()
+    return storage
+
+
+def state(storage):
+    return storage.list_users(), storage.list_terminals(), storage.get_history()
+
+
+def run_transactions(storage, start, count):
+    for i in range(start, start + count):
+        if i % 3:
+            storage.withdraw('alice', 10.0, qr_timestamp=f'2024010112{i:04d}')
+        else:
+            storage.deposit('bob', 25.0)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.add_missing_users({
+        'alice': {'pin': '1234', 'balance': 1000.0, 'role': 'user'},
+        'bob': {'pin': '4321', 'balance': 500.0, 'role': 'user'}
+    })
+    return storage
+
+
+def test_replay_after_crash_before_compaction(tmp_path, storage):
+    run_transactions(storage, 0, 10)
+    storage.save()
+    run_transactions(storage, 10, 7)
+    expected = state(storage)
+    # Crash: the last transactions exist only in the journal
+    storage.journal._file.close()
+
+    recovered = open_storage(tmp_path)
+    assert state(recovered) == expected
+    assert recovered.is_qr_redeemed('alice', '20240101120016')
+    # New ids continue after the replayed ones
+    assert recovered.deposit('bob', 1.0)['id'] == expected[2][-1]['id'] + 1
+
+
+def test_replay_after_crash_during_compaction(tmp_path, storage):
+    run_transactions(storage, 0, 12)
+    journal = tmp_path / 'qratm_data.journal'
+    untrimmed = tmp_path / 'untrimmed.journal'
+    shutil.copy(journal, untrimmed)
+    storage.save()
+    expected = state(storage)
+    # Crash after the snapshot was written but before the journal was trimmed:
+    # the journal still holds records the snapshot contains
+    shutil.copy(untrimmed, journal)
+
+    recovered = open_storage(tmp_path)
+    assert state(recovered) == expected
+
+
+def test_torn_journal_tail_is_discarded(tmp_path, storage):
+    run_transactions(storage, 0, 5)
+    expected = state(storage)
+    storage.journal._file.close()
+    with open(tmp_path / 'qratm_data.journal', 'ab') as f:
+        f.write(b'{"type":"transaction","transa')
+
+    recovered = open_storage(tmp_path)
+    assert state(recovered) == expected
+    with open(tmp_path / 'qratm_data.journal', 'rb') as f:
+        assert f.read().endswith(b'\n')
+
+
+def test_compaction_is_equivalent_to_replay(tmp_path, storage):
+    run_transactions(storage, 0, 40)
+    storage.journal._file.close()
+    replayed = open_storage(tmp_path)
+
+    replayed.save()
+    with open(tmp_path / 'qratm_data.journal', 'rb') as f:
+        assert f.read() == b''
+    compacted = open_storage(tmp_path)
+    assert state(compacted) == state(replayed) == state(storage)
+    assert compacted.user_totals('alice') == storage.user_totals('alice')
+    assert compacted.terminal_totals() == storage.terminal_totals()
+
+
+def test_snapshot_is_written_compactly(tmp_path):
+    journal = TransactionJournal(str(tmp_path / 'data.json'))
+    journal.load()
+    journal.append({'type': 'user', 'username': 'alice', 'data': {}})
+    journal.compact(lambda: {'history': {'ids': list(range(100))}})
+
+    with open(tmp_path / 'data.json') as f:
+        text = f.read()
+    assert '\n' not in text
+    assert json.loads(text)['journal_seq'] == 1
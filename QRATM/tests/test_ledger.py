@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from ledger import (Ledger, InvalidAmount, InsufficientBalance, InsufficientATMBalance, UnknownTerminal,
+                    UnknownUser, LOCK_STRIPES)
+
+
+def make_ledger(balance=100.0, cash=1000.0):
+    return Ledger({'alice': {'balance': balance}, 'bob': {'balance': balance}}, {'main': cash, 'lobby': cash})
+
+
+@pytest.mark.parametrize('amount', [float('nan'), float('inf'), float('-inf'), 0.0, -5.0])
+def test_withdraw_rejects_invalid_amounts(amount):
+    ledger = make_ledger()
+    committed = []
+    with pytest.raises(InvalidAmount):
+        ledger.withdraw('alice', amount, 'main', committed.append)
+    assert committed == []
+    assert ledger.accounts['alice']['balance'] == 100.0
+    assert ledger.terminals['main'] == 1000.0
+
+
+@pytest.mark.parametrize('amount', [float('nan'), float('inf'), 0.0, -5.0])
+def test_deposit_rejects_invalid_amounts(amount):
+    ledger = make_ledger()
+    committed = []
+    with pytest.raises(InvalidAmount):
+        ledger.deposit('alice', amount, 'main', committed.append)
+    assert committed == []
+    assert ledger.accounts['alice']['balance'] == 100.0
+    assert ledger.terminals['main'] == 1000.0
+
+
+def test_withdraw_rejects_insufficient_balance_and_cash():
+    ledger = make_ledger(balance=100.0, cash=50.0)
+    with pytest.raises(InsufficientBalance):
+        ledger.withdraw('alice', 100.01, 'main', lambda transaction_id: transaction_id)
+    with pytest.raises(InsufficientATMBalance):
+        ledger.withdraw('alice', 60.0, 'main', lambda transaction_id: transaction_id)
+    assert ledger.accounts['alice']['balance'] == 100.0
+    assert ledger.terminals['main'] == 50.0
+
+    assert ledger.withdraw('alice', 50.0, 'main', lambda transaction_id: transaction_id) == 1
+    assert ledger.accounts['alice']['balance'] == 50.0
+    assert ledger.terminals['main'] == 0.0
+
+
+def test_unknown_names_are_rejected_without_new_locks():
+    ledger = make_ledger()
+    for i in range(200):
+        with pytest.raises(UnknownUser):
+            ledger.withdraw(f'nobody{i}', 1.0, 'main', lambda transaction_id: transaction_id)
+        with pytest.raises(UnknownTerminal):
+            ledger.withdraw('alice', 1.0, f'kiosk{i}', lambda transaction_id: transaction_id)
+    assert len(ledger._account_locks) == len(ledger._terminal_locks) == LOCK_STRIPES
+    assert ledger.accounts['alice']['balance'] == 100.0
+
+
+def test_concurrent_withdraw_deposit_and_frozen():
+    accounts = {f'user{i}': {'balance': 1000.0} for i in range(20)}
+    terminals = {f'kiosk{i}': 100000.0 for i in range(20)}
+    ledger = Ledger(accounts, terminals)
+    ids = []
+    snapshots = []
+    done = threading.Event()
+
+    def customer(worker):
+        for i in range(500):
+            name = f'user{(worker + i) % 20}'
+            terminal = f'kiosk{(worker * 7 + i) % 20}'
+            if i % 2:
+                ids.append(ledger.deposit(name, 3.0, terminal, lambda transaction_id: transaction_id))
+            else:
+                try:
+                    ids.append(ledger.withdraw(name, 5.0, terminal, lambda transaction_id: transaction_id))
+                except InsufficientBalance:
+                    pass
+
+    def spread():
+        return sum(account['balance'] for account in accounts.values()) - ledger.atm_balance
+
+    def compactor():
+        # Every snapshot must see account and terminal balances that agree
+        while not done.is_set():
+            with ledger.frozen():
+                snapshots.append(spread())
+
+    workers = [threading.Thread(target=customer, args=(worker,)) for worker in range(8)]
+    frozen = threading.Thread(target=compactor)
+    frozen.start()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(timeout=30)
+    done.set()
+    frozen.join(timeout=30)
+
+    assert not any(thread.is_alive() for thread in workers + [frozen]), 'deadlock'
+    assert sorted(ids) == list(range(1, len(ids) + 1))
+    assert all(account['balance'] >= 0 for account in accounts.values())
+    # Withdrawals and deposits move an account and a terminal by the same
+    # amount, so the difference of their totals never changes
+    assert snapshots
+    assert all(snapshot == pytest.approx(spread()) for snapshot in snapshots)
+    assert spread() == pytest.approx(20 * 1000.0 - 20 * 100000.0)
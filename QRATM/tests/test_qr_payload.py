@@ -0,0 +1,35 @@
+import pytest
+
+import qr_payload
+
+KEY = b'test-key'
+
+
+def test_round_trip():
+    text = qr_payload.encode(KEY, 'alice', 1234.56, '4321', 1700000000)
+    name, amount, issued_at, pin_hash = qr_payload.decode(KEY, text)
+    assert (name, amount, issued_at) == ('alice', 1234.56, 1700000000)
+    assert qr_payload.pin_matches(KEY, f'{qr_payload.PIN_HASH_PREFIX}{pin_hash:08x}', '4321', name, issued_at)
+    assert not qr_payload.pin_matches(KEY, f'{qr_payload.PIN_HASH_PREFIX}{pin_hash:08x}', '0000', name, issued_at)
+
+
+def test_tampered_payload_is_rejected():
+    text = qr_payload.encode(KEY, 'alice', 10.0, '4321', 1700000000)
+    with pytest.raises(qr_payload.PayloadError):
+        qr_payload.decode(b'other-key', text)
+
+
+@pytest.mark.parametrize('pin_field', ['h' + 'f' * 20, 'h-1', 'h-0000001', 'hzzzzzzz', 'h', 'h 1 2 3 4'])
+def test_malformed_pin_hash_is_a_mismatch(pin_field):
+    assert not qr_payload.pin_matches(KEY, pin_field, '1234', 'alice', '1700000000')
+
+
+@pytest.mark.parametrize('amount', [0, -1.0, 0.001, qr_payload.MAX_AMOUNT + 1, float('nan'), float('inf')])
+def test_amount_out_of_range(amount):
+    with pytest.raises(ValueError):
+        qr_payload.encode(KEY, 'alice', amount, '4321', 1700000000)
+
+
+def test_largest_amount_round_trips():
+    text = qr_payload.encode(KEY, 'alice', qr_payload.MAX_AMOUNT, '4321', 1700000000)
+    assert qr_payload.decode(KEY, text)[1] == qr_payload.MAX_AMOUNT
@@ -0,0 +1,56 @@
+import time
+
+from token_registry import TokenRegistry
+
+
+def qr(issued_at=None):
+    issued_at = time.time() if issued_at is None else issued_at
+    return {'name': 'alice', 'amount': 50.0, 'pin': 'h00000000', 'timestamp': str(int(issued_at)),
+            'issued_at': issued_at}
+
+
+def test_consume_once():
+    registry = TokenRegistry(ttl=300)
+    token = registry.register('PAYLOAD', qr())
+    assert registry.lookup('PAYLOAD')['token'] == token
+    entry = registry.consume(token)
+    assert entry is not None
+    assert registry.consume(token) is None
+    registry.restore(entry)
+    assert registry.get(token) is not None
+
+
+def test_expired_codes_are_not_registered():
+    registry = TokenRegistry(ttl=300)
+    assert registry.register('PAYLOAD', qr(time.time() - 301)) is None
+    assert len(registry) == 0
+
+
+def test_lockout_survives_rescan():
+    registry = TokenRegistry(ttl=300, max_pin_attempts=3)
+    token = registry.register('PAYLOAD', qr())
+    assert registry.pin_failed(token)
+    # Registering a live token again keeps its count
+    assert registry.register('PAYLOAD', qr()) == token
+    assert registry.pin_failed(token)
+    assert not registry.pin_failed(token)
+
+    assert registry.get(token) is None
+    assert registry.consume(token) is None
+    assert registry.register('PAYLOAD', qr()) is None
+
+
+def test_expired_tokens_are_evicted_by_slot():
+    registry = TokenRegistry(ttl=10, tick=1.0)
+    now = time.time()
+    registry.register('OLD', qr(now - 5))
+    registry.register('NEW', qr(now))
+    locked = registry.register('LOCKED', qr(now - 5))
+    for _ in range(registry.max_pin_attempts):
+        registry.pin_failed(locked)
+
+    assert registry.evict_expired(now + 7) == 2
+    assert registry.lookup('NEW') is not None
+    assert registry.evict_expired(now + 12) == 1
+    assert len(registry) == 0
+    assert not any(registry._slots)
@@ -0,0 +1,157 @@
+"""
+Registry of pending withdrawal tokens.
+
+/generate registers every QR code it issues under the digest of its payload.
+A scan of that QR code is then one dictionary lookup instead of parsing and
+verifying the payload and checking it against the ledger, and /confirm and
+/process only carry the token: the amount and the PIN hash stay on the
+server. /process consumes the token atomically, so a QR code submitted at two
+kiosks at once is redeemed by one of them; the ledger's redeemed-QR check
+still stands behind it.
+
+A token lives until its QR code expires, even once too many wrong PINs lock
+it out: the locked entry keeps a rescan of the same QR code from registering
+it again with a fresh attempt count. Expiry times are bucketed into a
+timer wheel with one slot per tick; a background thread evicts each slot in
+bulk once its tick has passed, so memory holds live tokens only and nothing
+ever scans the whole registry.
+"""
+import threading
+import time
+
+from qr_images import payload_digest
+
+# Parsed payload fields kept for each token
+FIELDS = ('name', 'amount', 'pin', 'timestamp', 'issued_at')
+
+
+class TokenRegistry:
+    """Pending QR tokens with an expiry timer wheel"""
+
+    def __init__(self, ttl=300, tick=1.0, max_pin_attempts=3):
+        self.ttl = ttl
+        self.tick = tick
+        self.max_pin_attempts = max_pin_attempts
+        # Enough slots for the whole validity window, so a new token never
+        # shares a slot with tokens of an earlier turn of the wheel
+        self._slots = [set() for _ in range(int(ttl / tick) + 2)]
+        self._tokens = {}
+        self._lock = threading.Lock()
+        # First tick whose slot has not been evicted yet
+        self._next_tick = int(time.time() / tick)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _slot(self, expires_at):
+        return self._slots[int(expires_at / self.tick) % len(self._slots)]
+
+    def _add(self, entry):
+        # Caller holds _lock
+        self._tokens[entry['token']] = entry
+        self._slot(entry['expires_at']).add(entry['token'])
+
+    def _remove(self, token):
+        # Caller holds _lock
+        entry = self._tokens.pop(token, None)
+        if entry is not None:
+            self._slot(entry['expires_at']).discard(token)
+        return entry
+
+    def register(self, payload, qr):
+        """
+        Register a QR code by its payload text and parsed fields (name, amount,
+        pin, timestamp, issued_at) until it expires; returns its token, or
+        None if the QR code has already expired or too many wrong PINs locked
+        it out
+        """
+        token = payload_digest(payload)
+        expires_at = qr['issued_at'] + self.ttl
+        if expires_at <= time.time():
+            return None
+        with self._lock:
+            # Registering again keeps the entry and its wrong PIN count
+            entry = self._tokens.get(token)
+            if entry is None:
+                entry = {field: qr[field] for field in FIELDS}
+                entry.update(token=token, expires_at=expires_at, attempts=0, locked=False)
+                self._add(entry)
+            elif entry['locked']:
+                return None
+        return token
+
+    def lookup(self, payload):
+        """The live entry for a scanned payload, or None"""
+        return self.get(payload_digest(payload))
+
+    def get(self, token):
+        """The live entry for a token, or None"""
+        with self._lock:
+            entry = self._tokens.get(token)
+        if entry is None or entry['locked'] or entry['expires_at'] <= time.time():
+            return None
+        return entry
+
+    def consume(self, token):
+        """Remove a token and return its entry; None if it is unknown, expired or already consumed"""
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None or entry['locked']:
+                return None
+            self._remove(token)
+        if entry['expires_at'] <= time.time():
+            return None
+        return entry
+
+    def restore(self, entry):
+        """Put back a consumed token whose withdrawal did not go through"""
+        with self._lock:
+            if entry['expires_at'] > time.time() and entry['token'] not in self._tokens:
+                self._add(entry)
+
+    def pin_failed(self, token):
+        """Count a wrong PIN for a token; returns False once too many have locked it out"""
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None or entry['locked']:
+                return False
+            entry['attempts'] += 1
+            if entry['attempts'] < self.max_pin_attempts:
+                return True
+            # Kept until it expires, so the QR code cannot be registered again
+            entry['locked'] = True
+            return False
+
+    def evict_expired(self, now=None):
+        """Drop the tokens of every tick that has passed; returns how many were dropped"""
+        now = time.time() if now is None else now
+        current = int(now / self.tick)
+        evicted = 0
+        with self._lock:
+            # After a long stall one turn of the wheel covers every slot
+            for tick in range(max(self._next_tick, current - len(self._slots) + 1), current):
+                slot = self._slots[tick % len(self._slots)]
+                expired = {token for token in slot if self._tokens[token]['expires_at'] <= now}
+                slot -= expired
+                for token in expired:
+                    del self._tokens[token]
+                evicted += len(expired)
+            self._next_tick = max(self._next_tick, current)
+        return evicted
+
+    def start(self):
+        """Start the background tick that evicts expired tokens"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='token-expiry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.evict_expired()
+            self._stopped.wait(self.tick)